@@ -18,4 +18,6 @@ if os.path.exists('logging.ini'):
     logger.handlers.clear()
     logging.config.fileConfig('logging.ini', disable_existing_loggers=False)
 
-from . import root, error_handler, user, labelling, debug, web_crawler, extra_pages
+from . import root, error_handler, user, labelling, debug, web_crawler, extra_pages, monitoring
+
+app.register_blueprint(monitoring.blueprint)
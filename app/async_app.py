@@ -0,0 +1,181 @@
+"""
+Native async path for the read-heavy endpoints. The endpoints are the
+same plans (see `db.Plan`) as the Flask views execute, here executed
+by Motor in the event loop, instead of occupying a thread of `WsgiToAsgi`
+for the whole request. All other requests go to the Flask app.
+"""
+import re
+import time
+from http.cookies import SimpleCookie
+from typing import Callable, Any, Dict, Optional, List, Tuple, Pattern
+from urllib.parse import parse_qsl
+
+import motor.motor_asyncio
+import werkzeug.exceptions
+from mongomoron import Executable, QueryBuilder, AggregationPipelineBuilder, UpdateBuilder
+from werkzeug.datastructures import MultiDict
+
+import metrics
+from app import app, asgi_app
+from app.root import list_ds_plan, get_ds_plan, visualize_ds_plan, filter_ds_plan
+from app.user import user_response
+from db import SadistDatabaseConnection, AnalyticsBuilder, Plan, as_plan
+from error_handler import error
+from user_helper import anon_
+from user_session import UserSession, parse_session_id
+
+
+class AsyncDatabaseConnection(object):
+    """
+    Async counterpart of `SadistDatabaseConnection`, executes
+    only what's needed by the read-only endpoints
+    """
+
+    def __init__(self):
+        self.client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+
+    def mongo_client(self) -> motor.motor_asyncio.AsyncIOMotorClient:
+        if not self.client:
+            self.client = motor.motor_asyncio.AsyncIOMotorClient(
+                SadistDatabaseConnection.DATABASE_URL,
+                **SadistDatabaseConnection.client_options())
+        return self.client
+
+    def db(self) -> motor.motor_asyncio.AsyncIOMotorDatabase:
+        return self.mongo_client().get_database()
+
+    async def execute(self, builder: Executable) -> Any:
+        db = self.db()
+        if isinstance(builder, AnalyticsBuilder):
+            db = db.with_options(read_preference=SadistDatabaseConnection.ANALYTICS_READ_PREFERENCE)
+            builder = builder.builder
+        if isinstance(builder, QueryBuilder):
+            collection = db[builder.collection._name]
+            if builder.one:
+                return await collection.find_one(builder.query_filer_document)
+            cursor = collection.find(builder.query_filer_document)
+            if builder.sort_list:
+                cursor.sort(builder.sort_list)
+            return await cursor.to_list(None)
+        elif isinstance(builder, AggregationPipelineBuilder):
+            return await db[builder.collection._name] \
+                .aggregate(builder.get_pipeline()).to_list(None)
+        elif isinstance(builder, UpdateBuilder) and builder.one:
+            return await db[builder.collection._name].update_one(
+                builder.filter_expression, builder.update_operators,
+                upsert=builder.upsert)
+        else:
+            raise NotImplementedError(
+                'Async execution of %s not implemented' % type(builder))
+
+    async def execute_plan(self, plan: Plan) -> Any:
+        """
+        The same as `db.execute_plan`, but async
+        """
+        try:
+            builder = next(plan)
+            while True:
+                builder = plan.send(await self.execute(builder))
+        except StopIteration as e:
+            return e.value
+
+
+aconn = AsyncDatabaseConnection()
+
+# handler gets the path match, request args, and user,
+# and returns the response, or a plan of it
+Handler = Callable[[re.Match, MultiDict, Optional[dict]], Any]
+
+
+class AsyncApp(object):
+    """
+    ASGI app, which serves GET requests of `routes` itself,
+    and passes the rest to `fallback`
+    """
+
+    def __init__(self, fallback: Callable):
+        self.fallback = fallback
+        self.routes: List[Tuple[Pattern, Handler]] = []
+
+    def route(self, rule: str) -> Callable[[Handler], Handler]:
+        """
+        Register a handler, `rule` is a regex of the path
+        """
+
+        def decorator(handler: Handler) -> Handler:
+            self.routes.append((re.compile(rule), handler))
+            return handler
+
+        return decorator
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for rule, handler in self.routes:
+                m = rule.fullmatch(scope['path'])
+                if m:
+                    started = time.perf_counter()
+                    metrics.http_requests_in_progress.inc()
+                    try:
+                        status, body = await self._handle(scope, handler, m)
+                    finally:
+                        metrics.http_requests_in_progress.dec()
+                    metrics.http_request_duration.observe(time.perf_counter() - started,
+                                                          handler.__name__, 'GET')
+                    metrics.http_requests.inc(handler.__name__, str(status))
+                    await send({
+                        'type': 'http.response.start',
+                        'status': status,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'content-length', str(len(body)).encode())],
+                    })
+                    await send({'type': 'http.response.body', 'body': body})
+                    return
+        await self.fallback(scope, receive, send)
+
+    async def _handle(self, scope: dict, handler: Handler, m: re.Match) -> Tuple[int, bytes]:
+        try:
+            headers = dict((k.decode('latin-1'), v.decode('latin-1'))
+                           for k, v in scope['headers'])
+            cookie = SimpleCookie(headers.get('cookie', ''))
+            session_cookie = cookie.get(app.session_cookie_name)
+            session: UserSession = await aconn.execute_plan(UserSession.load_plan(
+                parse_session_id(session_cookie.value if session_cookie else None)))
+
+            args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'),
+                                       keep_blank_values=True))
+            result = await aconn.execute_plan(as_plan(handler(m, args, session.get('user'))))
+            status = 200
+        except werkzeug.exceptions.HTTPException as e:
+            result, status = {'error': e.name}, e.code
+        except Exception as e:
+            result, status = error(e)
+        # the same as flask does in non-debug mode
+        return status, f"{app.json.dumps(result, separators=(',', ':'))}\n".encode()
+
+
+async_app = AsyncApp(asgi_app)
+
+
+@async_app.route(r'/ls')
+def list_ds(m: re.Match, args: MultiDict, user: Optional[dict]) -> Plan:
+    return list_ds_plan(args, user)
+
+
+@async_app.route(r'/ds/([^/]+)')
+def get_ds(m: re.Match, args: MultiDict, user: Optional[dict]) -> Plan:
+    return get_ds_plan(m.group(1), user)
+
+
+@async_app.route(r'/ds/([^/]+)/visualize')
+def visualize_ds(m: re.Match, args: MultiDict, user: Optional[dict]) -> Plan:
+    return visualize_ds_plan(m.group(1), args, user)
+
+
+@async_app.route(r'/ds/([^/]+)/filter')
+def filter_ds(m: re.Match, args: MultiDict, user: Optional[dict]) -> Plan:
+    return filter_ds_plan(m.group(1), args, user)
+
+
+@async_app.route(r'/user/whoami')
+def whoami(m: re.Match, args: MultiDict, user: Optional[dict]) -> Dict[str, Any]:
+    return user_response(user or anon_)
@@ -1,8 +1,11 @@
 import atexit
+import time
 from concurrent.futures._base import Future
 from concurrent.futures.thread import ThreadPoolExecutor
 from typing import Callable
 
+import metrics
+
 _tp = ThreadPoolExecutor(max_workers=1)
 
 
@@ -13,4 +16,24 @@ atexit.register(_shutdown)
 
 
 def call_async(fn: Callable, *args, **kwargs) -> 'Future':
-    return _tp.submit(fn, *args, **kwargs)
+    return _tp.submit(_timed, fn, *args, **kwargs)
+
+
+def queue_size() -> int:
+    """
+    Count of jobs waiting for execution
+    """
+    return _tp._work_queue.qsize()
+
+
+def _timed(fn: Callable, *args, **kwargs):
+    started = time.perf_counter()
+    status = 'failed'
+    metrics.jobs_in_progress.inc()
+    try:
+        result = fn(*args, **kwargs)
+        status = 'succeeded'
+        return result
+    finally:
+        metrics.jobs_in_progress.dec()
+        metrics.job_duration.observe(time.perf_counter() - started, fn.__name__, status)
@@ -2,15 +2,18 @@ import faulthandler
 import multiprocessing
 import os
 import signal
+import time
 import traceback
 from _queue import Empty
 from typing import Iterable, Callable, Tuple, Any, Optional, List
 
 from app import logger
+from progress import Progress
 
 
 def process_in_parallel(input: Iterable, processor: Callable,
-                        args: Tuple, timeout: int = 60) -> Iterable:
+                        args: Tuple, timeout: int = 60,
+                        progress: Optional[Progress] = None) -> Iterable:
     """
     Processes tasks in async (parallel) manner, each task from `input`
     will be put into the queue, optimal count of processes will be launched,
@@ -24,6 +27,7 @@ def process_in_parallel(input: Iterable, processor: Callable,
     In case no new result returns within `timeout` seconds, the processing is
     considering unsuccessful and exception is thrown, remaining processes,
     if any, are killed.
+    If `progress` is passed, it's updated by each result.
     This function itself synchronizes output, i.e. blocks execution while
     all tasks are processed or error is occurred or timeout is happened.
     """
@@ -60,6 +64,9 @@ def process_in_parallel(input: Iterable, processor: Callable,
             result: _Result = output_queue.get(timeout=timeout)
             output_count += 1
             if result.success:
+                if progress:
+                    progress.update(queue=input_queue.qsize(), pid=result.pid,
+                                    busy=result.duration)
                 yield result.output
             else:
                 error_text = """Exception of async processing:
@@ -79,14 +86,16 @@ Only %d of %d tasks are completed.""" % (timeout, output_count, input_count)
 
 class _Result(object):
     def __init__(self, success: bool, output: Optional[Any] = None,
-                 exc: Optional[str] = None):
+                 exc: Optional[str] = None, duration: float = 0.):
         self.success = success
         self.output = output
         self.exc = exc
+        self.pid = os.getpid()
+        self.duration = duration
 
     @staticmethod
-    def success(output: Any):
-        return _Result(success=True, output=output)
+    def success(output: Any, duration: float):
+        return _Result(success=True, output=output, duration=duration)
 
     @staticmethod
     def error(exc: str):
@@ -102,8 +111,9 @@ def _process(input_queue: multiprocessing.Queue,
                 task = input_queue.get(timeout=0)
             except Empty:
                 continue
+            started = time.perf_counter()
             output = processor(task, *args)
-            output_queue.put(_Result.success(output))
+            output_queue.put(_Result.success(output, time.perf_counter() - started))
     except:
         output_queue.put(_Result.error(traceback.format_exc()))
     finally:
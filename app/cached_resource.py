@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Any, Optional
+
+from flask import request, Response
+
+import metrics
+
+
+class ResourceSnapshot(object):
+    """
+    A built resource, serialized and compressed once for all responses
+    """
+
+    def __init__(self, data: Any, body: bytes):
+        self.data = data
+        self.body = body
+        self.gzipped = gzip.compress(body)
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+        self.built_at = time.monotonic()
+
+
+class CachedResource(object):
+    """
+    A resource built from the DB, which is expensive to build and
+    changes rarely, e.g. a catalog of labels. It's kept in memory
+    and rebuilt when older than `ttl` or invalidated. Responses have
+    ETag, so clients re-validate it by 304, and they can request it
+    by a versioned URL (see `versioned_url`) to cache it forever.
+    ETag is a hash of the content, so it's the same in all processes
+    """
+
+    def __init__(self, build: Callable[[], Any], ttl: Optional[float] = 3600,
+                 mimetype: str = 'application/json',
+                 serialize: Callable[[Any], str] = None,
+                 strong_etag: bool = False):
+        """
+        @param build: Function to build the data
+        @param ttl: Seconds to keep built data, None for forever
+        @param mimetype: Mimetype of the response
+        @param serialize: Function to serialize the data, JSON by default
+        @param strong_etag: Whether ETag is strong, i.e. differs for
+        the gzipped and the plain body; weak (the same for both) by default
+        """
+        self.build = build
+        self.name = build.__qualname__
+        self.ttl = ttl
+        self.mimetype = mimetype
+        self.strong_etag = strong_etag
+        self.serialize = serialize or (lambda data: json.dumps(data, separators=(',', ':'),
+                                                               ensure_ascii=False))
+        self.lock = threading.Lock()
+        self._snapshot: Optional[ResourceSnapshot] = None
+
+    def get(self) -> ResourceSnapshot:
+        snapshot = self._snapshot
+        if snapshot and (self.ttl is None or time.monotonic() - snapshot.built_at < self.ttl):
+            metrics.cache_requests.inc(self.name, 'hit')
+            return snapshot
+        metrics.cache_requests.inc(self.name, 'miss')
+        with self.lock:
+            # unless another thread has already rebuilt it
+            if self._snapshot is snapshot:
+                self._snapshot = self._make_snapshot(self.build())
+            return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def versioned_url(self, url: str) -> str:
+        """
+        URL of the current version of the resource, which
+        may be cached by clients forever
+        """
+        return f'{url}?v={self.get().etag}'
+
+    def response(self) -> Response:
+        """
+        Response to the current request of the resource,
+        304 if the client has the current version
+        """
+        snapshot = self.get()
+        gzipped = 'gzip' in request.accept_encodings
+        response = Response(mimetype=self.mimetype)
+        if self.strong_etag:
+            etag = snapshot.etag + '-gzip' if gzipped else snapshot.etag
+            response.set_etag(etag)
+        else:
+            # the same for the gzipped and the plain body, so weak
+            etag = snapshot.etag
+            response.set_etag(etag, weak=True)
+        response.vary.add('Accept-Encoding')
+        if request.args.get('v') == snapshot.etag:
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 3600
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+
+        # If-None-Match is compared weakly, see RFC 9110
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+        elif gzipped:
+            response.set_data(snapshot.gzipped)
+            response.content_encoding = 'gzip'
+        else:
+            response.set_data(snapshot.body)
+        return response
+
+    def _make_snapshot(self, data: Any) -> ResourceSnapshot:
+        return ResourceSnapshot(data, self.serialize(data).encode())
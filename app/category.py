@@ -9,7 +9,7 @@ from bson import ObjectId
 from dateutil.relativedelta import relativedelta
 from mongomoron import *
 
-from db import geo_city, geo_country, ds_classification, conn
+from db import geo_city, geo_country, ds_classification, conn, Plan, as_plan, analytics
 from serializer import DO
 from singleton_mixin import SingletonMixin
 
@@ -237,12 +237,12 @@ class Category(SingletonMixin):
         """
         return []
 
-    def get_filtering(self, ds_list_record: dict, col: str) -> List[Filtering]:
+    def get_filtering(self, ds_list_record: dict, col: str) -> Union[List[Filtering], Plan]:
         """
         Get all suggested filtering for given DS, column and label
         @param ds_list_record: DS list record
         @param col Column name
-        @return: Filtering list
+        @return: Filtering list, or plan of getting it if the DB is needed
         """
         return []
 
@@ -260,16 +260,16 @@ class Category(SingletonMixin):
         return result
 
     @staticmethod
-    def get_all_filtering(ds_list_record: dict) -> Dict[str, List[Filtering]]:
+    def get_all_filtering(ds_list_record: dict) -> Plan:
         """
         Get all suggested filtering for all columns according to assigned labels
         @param ds_list_record: DS list record
-        @return: Map of suggested filtering for each column
+        @return: Plan of getting map of suggested filtering for each column
         """
         result = {}
         for col, label, category in Category.iter_categories(ds_list_record):
             result.setdefault(col, [])
-            result[col] += category.get_filtering(ds_list_record, col)
+            result[col] += yield from as_plan(category.get_filtering(ds_list_record, col))
         return result
 
     @staticmethod
@@ -308,10 +308,10 @@ class Category(SingletonMixin):
         # if category has `name` field, sort alphabetically
         p.sort((document._id.name, pymongo.ASCENDING))
 
-        return list(record['_id'] for record in conn.execute(p))
+        return list(record['_id'] for record in conn.execute(analytics(p)))
 
     def get_boundaries(self, ds_id: Union[str, ObjectId], col: str, label: Optional[str] = None) \
-            -> Tuple[float, float]:
+            -> Plan:
         """
         Get effective boundaries for the numerical values, all values
         outside them will consider outliers.
@@ -322,13 +322,13 @@ class Category(SingletonMixin):
         @param ds_id: DS id
         @param col: Column name
         @param label: Field path relative to details. Defaulting to self.label
-        @return: Tuple min, max
+        @return: Plan of getting tuple min, max
         """
         field = document.details.get_field(label or self.label)
         p = aggregate(ds_classification[ds_id]) \
             .match(document.col == col). \
             group(None, min=min_(field), max=max_(field), p=percentile(field, [.25, .75]))
-        for record in conn.execute(p):
+        for record in (yield analytics(p)):
             abs_min = record['min']
             abs_max = record['max']
             p_min = record['p'][0]
@@ -340,14 +340,15 @@ class Category(SingletonMixin):
             return b_min, b_max + .01 * (b_max - b_min)
 
     def get_ranges(self, ds_id: Union[str, object], col: str, reducer: dict) -> \
-            Optional[List[Tuple[Tuple[float, float], str]]]:
+            Union[Optional[List[Tuple[Tuple[float, float], str]]], Plan]:
         """
         Get ranges for the grouping of numerical values by ranges.
         @param ds_id: DS id
         @param col: Column name
         @param reducer: RangeReducer passed from the frontend.
         TODO cope with DO deserialization and make it a proper object type
-        @return: List of ranges in format ((min, max), range id)
+        @return: List of ranges in format ((min, max), range id),
+        or plan of getting it if the DB is needed
         """
         return None
 
@@ -368,8 +369,8 @@ class DatetimeCategory(Category):
             children={},
         )]
 
-    def get_filtering(self, ds_list_record: dict, col: str) -> List[Filtering]:
-        b_min, b_max = self.get_boundaries(ds_list_record['_id'], col, 'datetime.timestamp')
+    def get_filtering(self, ds_list_record: dict, col: str) -> Plan:
+        b_min, b_max = yield from self.get_boundaries(ds_list_record['_id'], col, 'datetime.timestamp')
         return [RangeFilterProposal(
             col=col,
             label='datetime.timestamp',
@@ -378,10 +379,9 @@ class DatetimeCategory(Category):
             labelformat='datetime',
         )]
 
-    def get_ranges(self, ds_id: Union[str, object], col: str, reducer: dict) -> \
-            Optional[List[Tuple[Tuple[float, float], str]]]:
+    def get_ranges(self, ds_id: Union[str, object], col: str, reducer: dict) -> Plan:
         if 'min' not in reducer or 'max' not in reducer:
-            timestamp_min, timestamp_max = self.get_boundaries(ds_id, col, 'datetime.timestamp')
+            timestamp_min, timestamp_max = yield from self.get_boundaries(ds_id, col, 'datetime.timestamp')
 
         # define boundaries
         timestamp_min = reducer.get('min', timestamp_min)
@@ -503,8 +503,8 @@ class NumberCategory(Category):
             children={},
         )]
 
-    def get_filtering(self, ds_list_record: dict, col: str) -> List[Filtering]:
-        b_min, b_max = self.get_boundaries(ds_list_record['_id'], col, 'number')
+    def get_filtering(self, ds_list_record: dict, col: str) -> Plan:
+        b_min, b_max = yield from self.get_boundaries(ds_list_record['_id'], col, 'number')
         return [RangeFilterProposal(
             col=col,
             label='number',
@@ -512,10 +512,9 @@ class NumberCategory(Category):
             max=b_max,
         )]
 
-    def get_ranges(self, ds_id: Union[str, object], col: str, reducer: dict) -> \
-            Optional[List[Tuple[Tuple[float, float], str]]]:
+    def get_ranges(self, ds_id: Union[str, object], col: str, reducer: dict) -> Plan:
         if 'min' not in reducer or 'max' not in reducer:
-            b_min, b_max = self.get_boundaries(ds_id, col, 'number')
+            b_min, b_max = yield from self.get_boundaries(ds_id, col, 'number')
 
         # define boundaries
         b_min = reducer.get('min', b_min)
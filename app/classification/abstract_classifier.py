@@ -11,10 +11,12 @@ class AbstractClassifier(SingletonMixin):
     of money is out of scope of this module.
     """
 
-    def learn(self, i: Iterable[Tuple[str, str]]):
+    def learn(self, i: Iterable[Tuple[str, str]], incremental: bool = False):
         """
         Update the Model by labelled data.
         :param i: iterable of tuples text, label
+        :param incremental: if True, `i` contains only new labelled data,
+        which should be added to the existing Model instead of re-building it
         :return: nothing
         """
         raise NotImplemented()
@@ -26,3 +28,11 @@ class AbstractClassifier(SingletonMixin):
         :return: label
         """
         raise NotImplemented()
+
+    def preload(self):
+        """
+        Load the Model, if it's not loaded on demand yet.
+        Called before classifying many texts, in particular before
+        forking worker processes, so that they share the loaded Model.
+        """
+        pass
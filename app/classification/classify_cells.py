@@ -1,17 +1,18 @@
 import datetime
 import traceback
 from concurrent.futures._base import Future
-from typing import Union, Optional, Any, Tuple
+from typing import Union, Tuple
 
 from bson import ObjectId
-from mongomoron import index, query, insert_many, update, insert_one, aggregate, \
-    avg
+from mongomoron import index, query, insert_many, update
 
+import async_processing
 from app import logger
 from async_loop import call_async
 from async_processing import process_in_parallel
 from classification.abstract_classifier import AbstractClassifier
-from db import conn, ds_classification, ds, ds_list, cl_stat
+from db import conn, ds_classification, ds, ds_list
+from progress import Progress
 
 # settings
 CHUNK_SIZE = 100
@@ -38,17 +39,22 @@ def classify_cells(ds_id: Union[str, ObjectId],
              conn.execute(query(ds[ds_id])) for col, value in record.items() if
              col != '_id' and value]
 
+    progress = Progress('classification:%s' % classifier.__class__.__name__,
+                        total=len(tasks), processes=async_processing.MAX_PROCESS_COUNT,
+                        persist=lambda d: _update_ds_list_progress(ds_id, d))
     _update_ds_list_record(ds_id, {
         'status': 'in progress',
         'started': datetime.datetime.now(),
-        'estimated': _get_estimated_duration(count=len(tasks))
+        # milliseconds
+        'estimated': progress.estimated * 1000 if progress.estimated is not None else None,
+        'progress': progress.to_dict()
     })
 
-    cl_stat_id = _create_cl_stat_record(count=len(tasks))
+    classifier.preload()
     cells = []
     for cell in process_in_parallel(tasks, processor=_execute_task,
                                     args=(classifier,),
-                                    timeout=120):
+                                    timeout=120, progress=progress):
         cells.append(cell)
 
         if len(cells) >= CHUNK_SIZE:
@@ -59,9 +65,9 @@ def classify_cells(ds_id: Union[str, ObjectId],
         conn.execute(insert_many(ds_classification[ds_id], cells))
 
     _update_ds_list_record(ds_id, {
-        'status': 'finished'
+        'status': 'finished',
+        'progress': progress.finish()
     })
-    _update_cl_stat_record(cl_stat_id)
 
 
 def call_classify_cells(ds_id: Union[str, ObjectId],
@@ -100,29 +106,10 @@ def _update_ds_list_record(ds_id: Union[str, ObjectId],
     )
 
 
-def _create_cl_stat_record(count: int) -> ObjectId:
-    return conn.execute(
-        insert_one(cl_stat, {
-            'count': count,
-            'started': datetime.datetime.now()
-        })
-    ).inserted_id
-
-
-def _update_cl_stat_record(cl_stat_id: ObjectId):
-    return conn.execute(
-        update(cl_stat) \
-            .filter(cl_stat._id == cl_stat_id)
-            .set({'finished': datetime.datetime.now()})
+def _update_ds_list_progress(ds_id: Union[str, ObjectId],
+                             progress: dict):
+    conn.execute(
+        update(ds_list) \
+            .filter(ds_list._id == ObjectId(ds_id))
+            .set({'classification.progress': progress})
     )
-
-
-def _get_estimated_duration(count: int) -> Optional[Any]:
-    p = aggregate(cl_stat) \
-        .match(cl_stat.finished != None) \
-        .add_fields(duration=cl_stat.finished - cl_stat.started) \
-        .add_fields(duration_one=cl_stat.duration / cl_stat.count) \
-        .group(None, avg_duration=avg(cl_stat.duration_one))
-    for result in conn.execute(p):
-        return result['avg_duration'] * count
-    return None
@@ -1,12 +1,16 @@
 from typing import List, Set, Dict, Hashable, Iterable, Tuple, Union, Optional
 
+import numpy as np
 from bson import ObjectId
-from mongomoron import delete, insert_one, query_one, query
+from mongomoron import delete, insert_one, query_one, query, update_one
 
 from app import logger
 from classification.abstract_classifier import AbstractClassifier
 from db import cl_pattern, conn, cl_pattern_char
 
+# tolerance of comparing coupling values
+EPS = 1e-9
+
 
 @AbstractClassifier.sub
 class PatternClassifier(AbstractClassifier):
@@ -46,7 +50,16 @@ class PatternClassifier(AbstractClassifier):
     check a text against all patterns and find the most reliable one.
     """
 
-    def learn(self, i: Iterable[Tuple[str, str]]):
+    def __init__(self):
+        self._index: Optional[PatternIndex] = None
+
+    def learn(self, i: Iterable[Tuple[str, str]], incremental: bool = False):
+        self._index = None
+
+        if incremental:
+            self._learn_incremental(i)
+            return
+
         self._clear_db()
 
         patterns: Dict[Pattern, SampleCount] = dict()
@@ -56,42 +69,6 @@ class PatternClassifier(AbstractClassifier):
             patterns.setdefault(pattern, SampleCount())
             patterns[pattern].add_label(label)
 
-        pattern_elements: Set[Tuple[Hashable, int]] = set()
-        likelihood: Dict[
-            Tuple[Tuple[Hashable, int], Tuple[Hashable, int]], float] = dict()
-
-        def update_likelihood(patterns: Dict[Pattern, SampleCount]):
-            pattern_elements.clear()
-            likelihood.clear()
-            count_prev_element_to_element: \
-                Dict[Tuple[Tuple[Hashable, int], Tuple[
-                    Hashable, int]], int] = dict()
-            count_prev_element_total: Dict[Tuple[Hashable, int]] = dict()
-
-            for pattern, sample_count in patterns.items():
-                total = sample_count.count_total
-                a: Union[None, Tuple[Hashable, int]] = None
-                for b in pattern.get_pattern():
-                    if a:
-                        count_prev_element_to_element.setdefault((a, b), 0)
-                        count_prev_element_to_element[a, b] += total
-                        count_prev_element_total.setdefault(a, 0)
-                        count_prev_element_total[a] += total
-                    pattern_elements.add(b)
-                    a = b
-
-            for a in pattern_elements:
-                for b in pattern_elements:
-                    if a in count_prev_element_total.keys():
-                        likelihood[a, b] = \
-                            count_prev_element_to_element.get((a, b), 0) / \
-                            count_prev_element_total[a]
-
-        def coupling(cluster: Set[Tuple[Hashable, int]]):
-            return sum((likelihood.get((a, b), 0))
-                       for a in cluster for b in cluster) / \
-                len(cluster)
-
         level = 0
 
         while True:
@@ -99,48 +76,25 @@ class PatternClassifier(AbstractClassifier):
                                        for pattern, sample_count in
                                        patterns.items()
                                        if pattern.level == level)
-            update_likelihood(prev_level_patterns)
+            pattern_elements, likelihood = \
+                self._get_likelihood(prev_level_patterns)
 
             level += 1
 
-            chars: List[Char] = list()
-            cluster: Set[Tuple[Hashable, int]] = set()
-            cluster_coupling = 0
-            prev_level_pattern_element_count = len(pattern_elements)
-            prev_level_pattern_element_to_char: Dict[
-                Tuple[Hashable, int], Char] = \
-                dict()
+            chars = [Char(level=level, cluster=cluster) for cluster in
+                     self._make_clusters(pattern_elements, likelihood)]
 
-            def add_char(cluster: Set[Tuple[Hashable, int]]):
-                char = Char(level=level, cluster=cluster)
-                chars.append(char)
-                for prev_level_pattern_element in cluster:
-                    prev_level_pattern_element_to_char[
-                        prev_level_pattern_element] = char
-
-            while len(pattern_elements):
-                pattern_element_with_max_coupling = \
-                    max(pattern_elements,
-                        key=lambda pattern_element: coupling(
-                            cluster.union({pattern_element})))
-                if coupling(cluster.union(
-                        pattern_element_with_max_coupling)) >= cluster_coupling:
-                    cluster.add(pattern_element_with_max_coupling)
-                    cluster_coupling = coupling(cluster)
-                    pattern_elements.remove(pattern_element_with_max_coupling)
-                else:
-                    add_char(cluster)
-                    cluster = set()
-                    cluster_coupling = 0
-            if cluster:
-                add_char(cluster)
-
-            if not (len(chars) < prev_level_pattern_element_count):
+            if not (len(chars) < len(pattern_elements)):
                 break
 
             # save current level chars
+            prev_level_pattern_element_to_char: Dict[
+                Tuple[Hashable, int], Char] = dict()
             for char in chars:
                 char.save()
+                for prev_level_pattern_element in char.char:
+                    prev_level_pattern_element_to_char[
+                        prev_level_pattern_element] = char
 
             for prev_level_pattern, sample_count in prev_level_patterns.items():
                 pattern = Pattern(level=level,
@@ -156,48 +110,230 @@ class PatternClassifier(AbstractClassifier):
         for pattern, sample_count in patterns.items():
             pattern.save(sample_count)
 
-    def classify(self, s: str):
+    def _learn_incremental(self, i: Iterable[Tuple[str, str]]):
+        """
+        Merge new labelled samples into the already learnt patterns.
+        Existing chars are kept as they are, only pattern elements
+        which have not been seen before are clustered: each of them
+        either joins the existing char whose coupling it doesn't
+        decrease, or, if there's no such char, new chars are made
+        of the rest of them. Then sample counts of the affected
+        patterns of each level are updated.
+        Since clusters of the known elements are never revised,
+        a full `learn` should still be run from time to time.
+        :param i: iterable of new (not learnt yet) tuples text, label
+        """
+        i = list(i)
+        if not Cache.get_patterns_by_level(0):
+            # nothing to merge into
+            self.learn(i)
+            return
+
+        # patterns of the current level which got new samples,
+        # with the count of the new samples only
+        delta: Dict[Pattern, SampleCount] = dict()
+        for text, label in i:
+            pattern = Pattern(level=0, sequence=text)
+            delta.setdefault(pattern, SampleCount())
+            delta[pattern].add_label(label)
+
         level = 0
-        s_pattern = Pattern(level=0, sequence=s)
 
-        while True:
-            # check if the s's pattern of current level
-            # matches one of patterns
-            patterns = Cache.get_patterns_by_level(level)
-            sample_count = patterns.get(s_pattern)
-            if sample_count:
-                # make democracy here:
-                # if some label got 50+% samples,
-                # choose this label
-                for label, count in sample_count.count_by_label.items():
-                    if count / sample_count.count_total > .5:
-                        logger.info('Matched s=%s by %s with vote %s' %
-                                    (s, s_pattern, sample_count))
-                        return label
+        try:
+            while True:
+                patterns = Cache.get_patterns_by_level(level)
+                existing = dict((pattern, pattern) for pattern in patterns)
+                for pattern, sample_count in delta.items():
+                    pattern = existing.get(pattern, pattern)
+                    patterns.setdefault(pattern, SampleCount())
+                    patterns[pattern].merge(sample_count)
+                    pattern.save(patterns[pattern])
+
+                level += 1
+
+                if not Cache.get_chars_by_level(level):
+                    break
+
+                # order of the first appearance, to make it deterministic
+                new_pattern_elements = dict(
+                    (pattern_element, None) for pattern in delta
+                    for pattern_element in pattern.get_pattern()
+                    if not Cache.get_char_by_pattern_element(pattern_element))
+                if new_pattern_elements:
+                    self._add_pattern_elements(level,
+                                               list(new_pattern_elements),
+                                               patterns)
+
+                next_delta: Dict[Pattern, SampleCount] = dict()
+                for pattern, sample_count in delta.items():
+                    pattern = Pattern(level=level,
+                                      sequence=[
+                                          Cache.get_char_by_pattern_element(
+                                              pattern_element)
+                                          for pattern_element in
+                                          pattern.get_pattern()])
+                    next_delta.setdefault(pattern, SampleCount())
+                    next_delta[pattern].merge(sample_count)
+                delta = next_delta
+        finally:
+            Cache.clear()
+
+    def _add_pattern_elements(self, level: int,
+                              pattern_elements: List[Tuple[Hashable, int]],
+                              prev_level_patterns: Dict[
+                                  'Pattern', 'SampleCount']):
+        """
+        Assign new pattern elements of (`level` - 1)-level patterns
+        to the chars of `level`, creating new chars if needed
+        """
+        _, likelihood = self._get_likelihood(prev_level_patterns)
+
+        def sum_likelihood(cluster: Set[Tuple[Hashable, int]]):
+            return sum(likelihood.get((a, b), 0)
+                       for a in cluster for b in cluster)
+
+        chars = list(Cache.get_chars_by_level(level))
+        char_sum_likelihood = [sum_likelihood(char.char) for char in chars]
+        changed_chars: Dict[ObjectId, Char] = dict()
+        rest: List[Tuple[Hashable, int]] = list()
+
+        for pattern_element in pattern_elements:
+            # coupling of the char extended by the element,
+            # minus coupling of the char itself
+            def gain(k: int):
+                cluster = chars[k].char
+                extra = likelihood.get((pattern_element, pattern_element), 0) + \
+                        sum(likelihood.get((a, pattern_element), 0) +
+                            likelihood.get((pattern_element, a), 0)
+                            for a in cluster)
+                return (char_sum_likelihood[k] + extra) / (len(cluster) + 1) - \
+                    char_sum_likelihood[k] / len(cluster)
+
+            k = max(range(len(chars)), key=gain)
+            if gain(k) >= -EPS:
+                char = chars[k]
+                char.char = char.char.union({pattern_element})
+                char_sum_likelihood[k] = sum_likelihood(char.char)
+                changed_chars[char._id] = char
+            else:
+                rest.append(pattern_element)
+
+        for char in changed_chars.values():
+            char.save()
+
+        for cluster in self._make_clusters(rest, likelihood):
+            char = Char(level=level, cluster=cluster)
+            char.save()
+            changed_chars[char._id] = char
+
+        for char in changed_chars.values():
+            Cache.put_char(char)
 
-            # make a pattern of a higher level
-            level += 1
-            chars = Cache.get_chars_by_level(level)
-            if not chars:
-                break
-            sequence: List[Char] = list()
-            for pattern_element in s_pattern.pattern:
-                char = Cache.get_char_by_pattern_element(pattern_element)
-                if not char:
-                    logger.warn('Pattern element (%s, %s) does not match'
-                                'any char of level %d' %
-                                (pattern_element[0], pattern_element[1],
-                                 level))
-                    return None
-                sequence.append(char)
+    @staticmethod
+    def _get_likelihood(patterns: Dict['Pattern', 'SampleCount']) -> \
+            Tuple[List[Tuple[Hashable, int]],
+                  Dict[Tuple[Tuple[Hashable, int], Tuple[Hashable, int]],
+                       float]]:
+        """
+        Get pattern elements of the given patterns, in order of
+        the first appearance, and likelihood of one element following
+        another one (only non-zero values)
+        """
+        # dict as an ordered set
+        pattern_elements: Dict[Tuple[Hashable, int], None] = dict()
+        count_prev_element_to_element: \
+            Dict[Tuple[Tuple[Hashable, int], Tuple[
+                Hashable, int]], int] = dict()
+        count_prev_element_total: Dict[Tuple[Hashable, int], int] = dict()
 
-            s_pattern = Pattern(level=level,
-                                sequence=sequence)
+        for pattern, sample_count in patterns.items():
+            total = sample_count.count_total
+            a: Union[None, Tuple[Hashable, int]] = None
+            for b in pattern.get_pattern():
+                if a:
+                    count_prev_element_to_element.setdefault((a, b), 0)
+                    count_prev_element_to_element[a, b] += total
+                    count_prev_element_total.setdefault(a, 0)
+                    count_prev_element_total[a] += total
+                pattern_elements[b] = None
+                a = b
+
+        likelihood = dict(((a, b), count / count_prev_element_total[a])
+                          for (a, b), count in
+                          count_prev_element_to_element.items())
+
+        return list(pattern_elements), likelihood
 
-        return None
+    @staticmethod
+    def _make_clusters(pattern_elements: List[Tuple[Hashable, int]],
+                       likelihood: Dict[Tuple[Tuple[Hashable, int],
+                                              Tuple[Hashable, int]], float]) \
+            -> List[Set[Tuple[Hashable, int]]]:
+        """
+        Greedily split pattern elements to the clusters (see the class
+        description).
+        Likelihood is put to a dense matrix, and for each element we keep
+        its contribution to the sum of likelihood of the current cluster,
+        p(e,e) + sum(p(a,e) + p(e,a), a in cluster), so coupling of
+        the cluster extended by each of the elements is calculated
+        at once, and the whole thing is O(n^2) instead of O(n^4).
+        Of elements with (almost) equal coupling, the first one in
+        `pattern_elements` is taken.
+        The element is accepted if coupling of the cluster unioned with
+        the element's items (char and count, which aren't pattern elements,
+        so they only add to the size of the cluster) doesn't decrease.
+        """
+        n = len(pattern_elements)
+        index = dict((pattern_element, k)
+                     for k, pattern_element in enumerate(pattern_elements))
+        p = np.zeros((n, n))
+        for (a, b), value in likelihood.items():
+            if a in index and b in index:
+                p[index[a], index[b]] = value
+        p_sym = p + p.T
+        p_diag = np.diag(p).copy()
+
+        remaining = np.ones(n, dtype=bool)
+        clusters: List[Set[Tuple[Hashable, int]]] = list()
+        cluster: Set[Tuple[Hashable, int]] = set()
+        cluster_sum = 0.
+        cluster_coupling = 0.
+        contribution = p_diag.copy()
+
+        while remaining.any():
+            coupling = np.where(remaining,
+                                (cluster_sum + contribution) /
+                                (len(cluster) + 1),
+                                -np.inf)
+            k = int(np.flatnonzero(coupling >= coupling.max() - EPS)[0])
+            union_coupling = cluster_sum / \
+                (len(cluster) + len(set(pattern_elements[k]) - cluster))
+            if union_coupling >= cluster_coupling:
+                cluster.add(pattern_elements[k])
+                cluster_sum += contribution[k]
+                cluster_coupling = coupling[k]
+                contribution += p_sym[k]
+                remaining[k] = False
+            else:
+                clusters.append(cluster)
+                cluster = set()
+                cluster_sum = 0.
+                cluster_coupling = 0.
+                contribution = p_diag.copy()
+        if cluster:
+            clusters.append(cluster)
+
+        return clusters
+
+    def preload(self):
+        self._index = PatternIndex.load()
+
+    def classify(self, s: str):
+        if not self._index:
+            self.preload()
+        return self._index.classify(s)
 
     def _clear_db(self):
-        # re-write table, todo: implement incremental update
         conn.execute(delete(cl_pattern))
         conn.execute(delete(cl_pattern_char))
 
@@ -207,7 +343,10 @@ class PatternClassifier(AbstractClassifier):
 
 class Char(object):
     """
-    Character of a higher level
+    Character of a higher level.
+    Once saved, a char is identified by its `_id`, so its cluster
+    can be extended in place (see `PatternClassifier._learn_incremental`)
+    without breaking patterns and chars of higher levels
     """
 
     def __init__(self, level: int, cluster: Set[Tuple[Hashable, int]]):
@@ -216,10 +355,15 @@ class Char(object):
         self.char = frozenset(cluster)
 
     def __hash__(self):
-        return self.char.__hash__()
+        return self._key().__hash__()
 
     def __eq__(self, other):
-        return isinstance(other, Char) and self.char == other.char
+        return isinstance(other, Char) and self._key() == other._key()
+
+    def _key(self) -> Hashable:
+        # the same for `__hash__` and `__eq__`: a saved char by `_id`,
+        # as its cluster may be extended, a not saved one by the cluster
+        return self._id or self.char
 
     def __repr__(self):
         return 'Char(level=%s, char=%s)' % (self.level, self.char)
@@ -232,6 +376,13 @@ class Char(object):
         }
 
     def save(self):
+        if self._id:
+            conn.execute(
+                update_one(cl_pattern_char)
+                .filter(cl_pattern_char._id == self._id)
+                .set(self.serialize())
+            )
+            return
         self._id = conn.execute(
             insert_one(cl_pattern_char, self.serialize())
         ).inserted_id
@@ -302,6 +453,13 @@ class Pattern(object):
         return d
 
     def save(self, sample_count: 'SampleCount'):
+        if self._id:
+            conn.execute(
+                update_one(cl_pattern)
+                .filter(cl_pattern._id == self._id)
+                .set(sample_count.serialize())
+            )
+            return
         self._id = conn.execute(
             insert_one(cl_pattern, self.serialize(sample_count=sample_count))
         ).inserted_id
@@ -337,7 +495,8 @@ class Pattern(object):
 
         return pattern
 
-    def _factorize(self, count):
+    @staticmethod
+    def _factorize(count):
         # ad-hoc algorithm of grouping the similar count values
         base = 10
         result = 1
@@ -393,6 +552,110 @@ class Terminated(Iterable):
         return 'Terminated(%s)' % self.i
 
 
+class PatternIndex(object):
+    """
+    Compiled patterns and chars of all levels, loaded at once.
+    Pattern elements (symbol, count) of each level are coded
+    by integers, where symbol is a literal character for 0-level
+    and code of the char for the others, so a pattern is just a tuple
+    of element codes, and a char of the next level is what element codes
+    are mapped to. Only the winning label of each pattern is kept.
+    """
+
+    def __init__(self):
+        # by level: element (symbol, count) -> element code
+        self.element_codes: List[Dict[Tuple[Hashable, int], int]] = []
+        # by level: element code -> code of the char of the next level
+        self.element_to_char: List[Dict[int, int]] = []
+        # by level: tuple of element codes -> label,
+        # only for patterns where some label got 50+% samples
+        self.labels: List[Dict[Tuple[int, ...], str]] = []
+
+    @staticmethod
+    def load() -> 'PatternIndex':
+        index = PatternIndex()
+
+        char_records = list(conn.execute(query(cl_pattern_char)))
+        char_codes: Dict[ObjectId, int] = dict(
+            (record['_id'], code) for code, record in enumerate(char_records))
+
+        def symbol(level: int, char: Union[str, ObjectId]):
+            return char if level == 0 else char_codes[char]
+
+        for record in char_records:
+            level = record['level'] - 1
+            for char, count in record['char']:
+                code = index._get_element_code(level, (symbol(level, char), count))
+                index.element_to_char[level][code] = char_codes[record['_id']]
+
+        for record in conn.execute(query(cl_pattern)):
+            level = record['level']
+            codes = tuple(index._get_element_code(level, (symbol(level, char), count))
+                          for char, count in record['pattern'])
+            # make democracy here:
+            # if some label got 50+% samples,
+            # choose this label
+            for label, count in record['countByLabel'].items():
+                if count / record['countTotal'] > .5:
+                    index.labels[level][codes] = label
+
+        return index
+
+    def classify(self, s: str) -> Optional[str]:
+        sequence: Iterable[Hashable] = s
+        for level in range(len(self.labels)):
+            element_codes = self.element_codes[level]
+            codes = []
+            for element in self._make_pattern(sequence):
+                code = element_codes.get(element)
+                if code is None:
+                    if level + 1 < len(self.labels):
+                        logger.warn('Pattern element (%s, %s) does not match '
+                                    'any char of level %d',
+                                    element[0], element[1], level + 1)
+                    return None
+                codes.append(code)
+
+            label = self.labels[level].get(tuple(codes))
+            if label:
+                return label
+
+            # make a pattern of a higher level
+            element_to_char = self.element_to_char[level]
+            sequence = [element_to_char.get(code) for code in codes]
+            if None in sequence:
+                if level + 1 < len(self.labels):
+                    logger.warn('Pattern element does not match '
+                                'any char of level %d', level + 1)
+                return None
+
+        return None
+
+    def _get_element_code(self, level: int, element: Tuple[Hashable, int]) -> int:
+        while len(self.labels) <= level:
+            self.element_codes.append(dict())
+            self.element_to_char.append(dict())
+            self.labels.append(dict())
+        element_codes = self.element_codes[level]
+        return element_codes.setdefault(element, len(element_codes))
+
+    @staticmethod
+    def _make_pattern(sequence: Iterable[Hashable]) -> Iterable[Tuple[Hashable, int]]:
+        """
+        The same as `Pattern._make_pattern`
+        """
+        c_prev: Hashable = None
+        c_prev_count = 0
+        for c in sequence:
+            if c_prev is not None and c_prev != c:
+                yield c_prev, Pattern._factorize(c_prev_count)
+                c_prev_count = 0
+            c_prev = c
+            c_prev_count += 1
+        if c_prev is not None:
+            yield c_prev, Pattern._factorize(c_prev_count)
+
+
 class Cache(object):
     """
     Cached on-demand chars, patterns, and pattern elements
@@ -453,6 +716,16 @@ class Cache(object):
             Optional[Char]:
         return Cache.pattern_element_to_char.get(pattern_element)
 
+    @staticmethod
+    def put_char(char: Char):
+        """
+        Add a new or changed (saved) char to the cache
+        """
+        Cache.chars[char._id] = char
+        Cache.get_chars_by_level(char.level).add(char)
+        for pattern_element in char.char:
+            Cache.pattern_element_to_char[pattern_element] = char
+
     @staticmethod
     def clear():
         Cache.chars.clear()
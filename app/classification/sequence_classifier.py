@@ -20,10 +20,13 @@ class SequenceClassifier(AbstractClassifier):
     def detailizer(self) -> SequenceDetailizer:
         return SequenceDetailizer.get()
 
-    def learn(self, i: Iterable[Tuple[str, str]]):
+    def learn(self, i: Iterable[Tuple[str, str]], incremental: bool = False):
         # let stick with option 2.a so far, so no special learning needed
         pass
 
+    def preload(self):
+        self.detailizer.preload()
+
     def classify(self, s: str) -> str:
         sequence = self.detailizer.get_details(s).get('sequence')
         if not sequence:
@@ -1,6 +1,34 @@
 import collections.abc
-import json
-from typing import Iterable, Callable
+from typing import Iterable, Callable, Any, Hashable
+
+
+# types which are hashable and canonical as they are
+_SCALAR_TYPES = frozenset([str, int, float, type(None)])
+
+
+def canonical(value: Any) -> Hashable:
+    """
+    Hashable canonical form of a value from our DB (e.g. a label), i.e.
+    equal for equal values, regardless of order of keys of dicts.
+    Dicts and lists are tagged by their type, so they don't collide with
+    sets and tuples, as well as booleans, so they don't collide with numbers
+    """
+    t = type(value)
+    if t in _SCALAR_TYPES:
+        return value
+    # exact types first, as the most common, with scalar items inlined
+    if t is dict:
+        return dict, frozenset([(k, v if type(v) in _SCALAR_TYPES else canonical(v))
+                                for k, v in value.items()])
+    if t is list:
+        return list, tuple([v if type(v) in _SCALAR_TYPES else canonical(v) for v in value])
+    if t is bool:
+        return bool, value
+    if isinstance(value, dict):
+        return dict, frozenset((k, canonical(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return list, tuple(canonical(v) for v in value)
+    return value
 
 
 class objectset(collections.abc.MutableSet):
@@ -8,20 +36,50 @@ class objectset(collections.abc.MutableSet):
     Set implementation to be able to work with sets of unhashable
     objects, namely lists and dicts. So, almost any object from our DB
     can be used here as value.
-    It's implemented by wrapping a key via json.dumps - maybe
-    not very efficient, but easy to implement way.
+    It's implemented by wrapping a key by `canonical`, so dicts
+    with the same items in different order are the same value.
     For the correct behaviour, values should not be edited after
     adding to this collection
     """
 
     def __init__(self, init_v: Iterable = None):
-        self._wrap = json.dumps
+        self._wrap = canonical
         self._wrapped = dict((self._wrap(k), k) for k in init_v) \
             if init_v else dict()
 
     def __contains__(self, item):
         return self._wrapped.__contains__(self._wrap(item))
 
+    # operations with other objectset-s by wrapped keys,
+    # without wrapping the values again
+
+    def __eq__(self, other):
+        if isinstance(other, objectset):
+            return self._wrapped.keys() == other._wrapped.keys()
+        return super().__eq__(other)
+
+    def __le__(self, other):
+        if isinstance(other, objectset):
+            return self._wrapped.keys() <= other._wrapped.keys()
+        return super().__le__(other)
+
+    def __or__(self, other):
+        if isinstance(other, objectset):
+            return self._from_wrapped({**self._wrapped, **other._wrapped})
+        return super().__or__(other)
+
+    def __and__(self, other):
+        if isinstance(other, objectset):
+            return self._from_wrapped(dict((k, v) for k, v in self._wrapped.items()
+                                           if k in other._wrapped))
+        return super().__and__(other)
+
+    def __sub__(self, other):
+        if isinstance(other, objectset):
+            return self._from_wrapped(dict((k, v) for k, v in self._wrapped.items()
+                                           if k not in other._wrapped))
+        return super().__sub__(other)
+
     def __iter__(self):
         return self._wrapped.values().__iter__()
 
@@ -33,3 +91,8 @@ class objectset(collections.abc.MutableSet):
 
     def discard(self, value):
         del self._wrapped[self._wrap(value)]
+
+    def _from_wrapped(self, wrapped: dict) -> 'objectset':
+        result = self.__class__()
+        result._wrapped = wrapped
+        return result
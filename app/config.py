@@ -1,20 +1,40 @@
-from mongomoron import query_one, update_one
+import os
+import threading
+import time
+from typing import Optional, Dict, Any
+
+from mongomoron import query, update_one
 
 from db import conn, app_config
 
 
 class Config(dict):
+    """
+    Application config, stored in `app_config`. Values are read from
+    the in-process snapshot of the collection, which is kept up to date
+    by the change stream of the collection (see `watch`), or, while there's
+    no change stream in this process, re-read every `poll_interval` seconds
+    """
+    poll_interval = 10
+
+    def __init__(self):
+        super().__init__()
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._loaded_at = 0.
+        # pid of the process which the change stream is watched in,
+        # threads don't survive fork
+        self._watching_pid = None
+
     def __getitem__(self, item):
-        config_data = conn.execute(query_one(app_config).filter(app_config._id == item))
-        if config_data:
-            return config_data['value']
-        return None
+        return self._get_snapshot().get(item)
 
     def __setitem__(self, key, value):
         conn.execute(update_one(app_config, upsert=True)
                      .filter(app_config._id == key)
                      .set({'value': value})
                      )
+        # read your writes, without waiting for the change stream
+        self._get_snapshot()[key] = value
 
     def get_or_set(self, key, value):
         """
@@ -26,5 +46,57 @@ class Config(dict):
             return value
         return ex_value
 
+    def watch(self) -> threading.Thread:
+        """
+        Start watching changes of `app_config` in background,
+        falling back to polling while the change stream is down
+        """
+        from app import logger
+
+        def _watch():
+            while True:
+                try:
+                    with conn.db()[app_config._name].watch(full_document='updateLookup') as stream:
+                        self._watching_pid = os.getpid()
+                        # changes made before the stream is opened
+                        self._load()
+                        for change in stream:
+                            self._apply_change(change)
+                except Exception as e:
+                    logger.warn('Change stream of %s failed: %s', app_config._name, e)
+                finally:
+                    self._watching_pid = None
+                time.sleep(self.poll_interval)
+
+        thread = threading.Thread(target=_watch, name='config-watch', daemon=True)
+        thread.start()
+        return thread
+
+    def _get_snapshot(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        if snapshot is None or (self._watching_pid != os.getpid() and
+                                time.monotonic() - self._loaded_at > self.poll_interval):
+            snapshot = self._load()
+        return snapshot
+
+    def _load(self) -> Dict[str, Any]:
+        snapshot = dict((r['_id'], r.get('value')) for r in conn.execute(query(app_config)))
+        self._snapshot = snapshot
+        self._loaded_at = time.monotonic()
+        return snapshot
+
+    def _apply_change(self, change: dict):
+        snapshot = self._get_snapshot()
+        operation_type = change['operationType']
+        if operation_type == 'delete':
+            snapshot.pop(change['documentKey']['_id'], None)
+        elif operation_type in ('insert', 'update', 'replace') \
+                and change.get('fullDocument'):
+            snapshot[change['documentKey']['_id']] = change['fullDocument'].get('value')
+        else:
+            # the document is already gone, or something else happened
+            # to the collection, such as drop
+            self._load()
+
 
 config = Config()
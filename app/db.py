@@ -1,40 +1,352 @@
+import atexit
 import datetime
+import inspect
 import os
-from typing import Union
+import threading
+from typing import Union, Generator, Any, Dict, Tuple
 
 import gridfs
 import pymongo
-from mongomoron import DatabaseConnection, Collection, Operation
+from mongomoron import DatabaseConnection, Collection, Operation, Executable, \
+    QueryBuilder, AggregationPipelineBuilder
+from mongomoron.expression import PipelineStage, Context, FieldExpression, Field
+from pymongo.command_cursor import CommandCursor
+from pymongo.cursor import Cursor
 from pymongo.database import Database
+from pymongo.monitoring import ConnectionPoolListener, CommandListener
+from pymongo.read_preferences import SecondaryPreferred, Primary
+
+import metrics
+
+
+class PoolStats(ConnectionPoolListener):
+    """
+    Counters of connections of a client's pools (of all servers),
+    by CMAP events
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                'open': self.open,
+                'checkedOut': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkoutFailures': self.checkout_failures,
+                'poolClears': self.pool_clears,
+            }
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+class CommandMetrics(CommandListener):
+    """
+    Timings of commands on collections, by collection family
+    (see `metrics.collection_family`)
+    """
+
+    def __init__(self):
+        # (connection, request id) -> labels of the command in flight
+        self._started: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+
+    def started(self, event):
+        # the collection is the value of the command name,
+        # except for getMore; other commands (e.g. ping) aren't timed
+        collection = event.command.get('collection') if event.command_name == 'getMore' \
+            else event.command.get(event.command_name)
+        if isinstance(collection, str):
+            self._started[(event.connection_id, event.request_id)] = \
+                (metrics.collection_family(collection), event.command_name)
+
+    def succeeded(self, event):
+        labels = self._started.pop((event.connection_id, event.request_id), None)
+        if labels:
+            metrics.mongo_command_duration.observe(event.duration_micros / 1e6, *labels)
+
+    def failed(self, event):
+        labels = self._started.pop((event.connection_id, event.request_id), None)
+        if labels:
+            metrics.mongo_command_duration.observe(event.duration_micros / 1e6, *labels)
+            metrics.mongo_command_failures.inc(*labels)
+
+
+command_metrics = CommandMetrics()
+
+
+def parse_max_staleness(env_var: str, default: int) -> int:
+    """
+    Max staleness of reads from secondaries, seconds, by the env var.
+    MongoDB only accepts -1 (no limit) or at least 90 (it can't detect
+    smaller lag reliably); 0 is ours, for reads from the primary
+    """
+    value = os.environ.get(env_var)
+    try:
+        max_staleness = int(value) if value else default
+    except ValueError:
+        raise ValueError(f'{env_var} must be an integer, got {value!r}') from None
+    if max_staleness not in (0, -1) and max_staleness < 90:
+        raise ValueError(f'{env_var} must be 0 (read from the primary), -1 (no limit) '
+                         f'or at least 90 seconds, got {max_staleness}')
+    return max_staleness
 
 
 class SadistDatabaseConnection(DatabaseConnection):
     DATABASE_URL = os.environ.get('DATABASE_URL') or \
                    'mongodb://127.0.0.1:27017,127.0.0.1:27018/sadist?replicaSet=rs0'
+    # connection pool per server, see `pymongo.MongoClient`
+    MAX_POOL_SIZE = int(os.environ.get('DATABASE_MAX_POOL_SIZE') or 100)
+    MIN_POOL_SIZE = int(os.environ.get('DATABASE_MIN_POOL_SIZE') or 0)
+    MAX_IDLE_TIME_MS = int(os.environ.get('DATABASE_MAX_IDLE_TIME_MS') or 0) or None
+    # heavy read-only queries (analytics) may be served by secondaries
+    # lagging behind the primary not more than this, seconds (90 at least);
+    # 0 to serve them by the primary, -1 for no limit
+    ANALYTICS_MAX_STALENESS = parse_max_staleness('DATABASE_ANALYTICS_MAX_STALENESS', 90)
+    ANALYTICS_READ_PREFERENCE = SecondaryPreferred(max_staleness=ANALYTICS_MAX_STALENESS) \
+        if ANALYTICS_MAX_STALENESS else Primary()
 
     def __init__(self):
         super().__init__()
-        self.mongo_client_pool = dict()
+        self.mongo_client_pool: Dict[int, pymongo.MongoClient] = dict()
+        self.pool_stats_pool: Dict[int, PoolStats] = dict()
+        # forked processes (`process_in_parallel`, workers) inherit
+        # the clients of the parent, which mustn't be used there
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.close)
 
     def mongo_client(self):
         pid = os.getpid()
         if pid not in self.mongo_client_pool:
-            self.mongo_client_pool[pid] = self._new_client()
+            self.pool_stats_pool[pid] = PoolStats()
+            self.mongo_client_pool[pid] = self._new_client(self.pool_stats_pool[pid])
         return self.mongo_client_pool[pid]
 
     def db(self) -> Database:
         return self.mongo_client().get_database()
 
+    def analytics_db(self) -> Database:
+        """
+        The DB to run heavy read-only queries, which don't need
+        the latest writes, by `ANALYTICS_READ_PREFERENCE`
+        """
+        return self.db().with_options(read_preference=self.ANALYTICS_READ_PREFERENCE)
+
     @property
     def fs(self) -> gridfs.GridFS:
         return gridfs.GridFS(self.db())
 
-    def _new_client(self) -> pymongo.MongoClient:
-        return pymongo.MongoClient(SadistDatabaseConnection.DATABASE_URL, socketTimeoutMS=30000)
+    def execute(self, builder: Executable) -> Any:
+        if isinstance(builder, AnalyticsBuilder):
+            return self._execute_analytics(builder.builder)
+        return super().execute(builder)
+
+    def close(self):
+        """
+        Close the client of the current process, e.g. before forking,
+        so that no monitor threads are running in the parent.
+        A new one will be created on demand
+        """
+        self.pool_stats_pool.pop(os.getpid(), None)
+        client = self.mongo_client_pool.pop(os.getpid(), None)
+        if client:
+            client.close()
+
+    def pool_stats(self) -> dict:
+        """
+        Settings and connection counters of the pool
+        of the current process, for monitoring
+        """
+        stats = self.pool_stats_pool.get(os.getpid())
+        return {
+            'pid': os.getpid(),
+            'maxPoolSize': self.MAX_POOL_SIZE,
+            'minPoolSize': self.MIN_POOL_SIZE,
+            'maxIdleTimeMS': self.MAX_IDLE_TIME_MS,
+            'connections': stats.to_dict() if stats else None,
+        }
+
+    @classmethod
+    def client_options(cls) -> dict:
+        """
+        Options of `pymongo.MongoClient`, also applicable to the Motor one
+        """
+        return dict(socketTimeoutMS=30000,
+                    maxPoolSize=cls.MAX_POOL_SIZE,
+                    minPoolSize=cls.MIN_POOL_SIZE,
+                    maxIdleTimeMS=cls.MAX_IDLE_TIME_MS,
+                    event_listeners=[command_metrics])
+
+    def _new_client(self, pool_stats: PoolStats) -> pymongo.MongoClient:
+        options = self.client_options()
+        options['event_listeners'] = [pool_stats, *options['event_listeners']]
+        return pymongo.MongoClient(SadistDatabaseConnection.DATABASE_URL, **options)
+
+    def _execute_analytics(self, builder: Union[QueryBuilder, AggregationPipelineBuilder]) -> Any:
+        # never in the transaction, reads from secondaries aren't allowed there
+        collection = self.analytics_db()[builder.collection._name]
+        if isinstance(builder, AggregationPipelineBuilder):
+            return collection.aggregate(builder.get_pipeline())
+        if builder.one:
+            return collection.find_one(builder.query_filer_document)
+        cursor = collection.find(builder.query_filer_document)
+        if builder.sort_list:
+            cursor.sort(builder.sort_list)
+        return cursor
+
+    def _reset(self):
+        """
+        Forget clients of other processes without closing them,
+        their sockets are shared with the processes they belong to.
+        Transaction session of the parent is forgotten as well
+        """
+        pid = os.getpid()
+        for client_pid in [client_pid for client_pid in self.mongo_client_pool
+                           if client_pid != pid]:
+            del self.mongo_client_pool[client_pid]
+            self.pool_stats_pool.pop(client_pid, None)
+        self.threadlocal.session = None
+
+
+class AnalyticsBuilder(Executable):
+    """
+    Wrapper of a read-only query or aggregation, to execute it by
+    `ANALYTICS_READ_PREFERENCE`, i.e. likely by a secondary, so it doesn't
+    compete with writes. Only for reads which are fine to miss the latest
+    writes, not for read-your-writes paths
+    """
+
+    def __init__(self, builder: Union[QueryBuilder, AggregationPipelineBuilder]):
+        if not isinstance(builder, (QueryBuilder, AggregationPipelineBuilder)):
+            raise TypeError(f'Only query or aggregation can be executed as analytics, '
+                            f'got {type(builder).__name__} instead.')
+        self.builder = builder
+
+
+def analytics(builder: Union[QueryBuilder, AggregationPipelineBuilder]) -> AnalyticsBuilder:
+    return AnalyticsBuilder(builder)
+
+
+class SamplePipelineStage(PipelineStage):
+    """
+    Randomly selects `size` documents, or all if there are fewer,
+    in random order. If it's the first stage of the pipeline, documents
+    are selected without scanning the collection (as long as `size`
+    is less than 5% of the collection)
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def to_obj(self, context: int = Context.AGGREGATION):
+        return {'$sample': {'size': self.size}}
+
+
+def sample(p: AggregationPipelineBuilder, size: int) -> AggregationPipelineBuilder:
+    """
+    Add $sample stage, which mongomoron's builder lacks
+    """
+    p.stages.append(SamplePipelineStage(size))
+    return p
+
+
+class AnyInExpression(FieldExpression):
+    """
+    Query-style `$in`, which matches if the field is one of `values`, or
+    any element of an array on the field path is. Unlike `Field.in_`,
+    which in $match of an aggregation compares the field as a whole
+    """
+
+    def __init__(self, field: Field, values: list):
+        super().__init__(field)
+        self.values = values
+
+    def get_operator_expression(self):
+        return {'$in': self.values}
+
+
+def any_in(field: Field, values: list) -> AnyInExpression:
+    return AnyInExpression(field, values)
 
 
 conn = SadistDatabaseConnection()
 
+# A plan is a generator which yields builders to execute and gets back results
+# of their execution, with cursors read to lists. This way the same code can be
+# executed either by the sync connection (`execute_plan`), or by the async one
+# (see `async_app`)
+Plan = Generator[Executable, Any, Any]
+
+
+def execute_plan(plan: Plan) -> Any:
+    """
+    Execute the plan by `conn`
+    @param plan: Plan
+    @return: Value returned by the plan
+    """
+    try:
+        builder = next(plan)
+        while True:
+            result = conn.execute(builder)
+            if isinstance(result, (Cursor, CommandCursor)):
+                result = list(result)
+            builder = plan.send(result)
+    except StopIteration as e:
+        return e.value
+
+
+def as_plan(value_or_plan: Union[Plan, Any]) -> Plan:
+    """
+    Make a plan of the value returned by a function which
+    may or may not need the DB, to `yield from` it
+    """
+    if inspect.isgenerator(value_or_plan):
+        return (yield from value_or_plan)
+    return value_or_plan
+
 
 class CollectionFamily(object):
 
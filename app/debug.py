@@ -4,6 +4,8 @@ import datetime
 from app import app
 from flask import make_response
 
+from db import conn
+
 
 @app.route('/debug/traceback')
 def traceback():
@@ -15,3 +17,8 @@ def traceback():
     response = make_response(open(tmpfilename, 'r').read())
     response.mimetype = 'text/plain'
     return response
+
+
+@app.route('/debug/pool')
+def pool():
+    return conn.pool_stats()
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, List, Optional
 
 from singleton_mixin import SingletonMixin
 
@@ -32,3 +32,25 @@ class AbstractDetailizer(SingletonMixin):
         e.g. {"name": "Raleigh", "coordinates": [ -78.63861, 35.7721 ]}
         """
         raise NotImplemented()
+
+    def preload(self):
+        """
+        Load the Model, if it's not loaded on demand yet.
+        Called before forking worker processes,
+        so that they share the loaded Model.
+        """
+        pass
+
+    def get_details_many(self, values: List[str]) -> List[Optional[Dict[str, object]]]:
+        """
+        Get details for many values of the same column at once,
+        where it's faster than one by one, e.g. by the format
+        common for the column. It's called in the main process,
+        then the values it returns None for are passed
+        to `get_details` one by one, in parallel.
+        :param values: Raw values
+        :return: List of details, the same as `get_details` would
+        return, for each of the values, or None if the value
+        is left to `get_details`
+        """
+        return [None] * len(values)
@@ -39,6 +39,10 @@ class BowDetailizer(AbstractDetailizer):
 
         return self._predict(value)
 
+    def preload(self):
+        if not self.model:
+            self._load_model()
+
     def _normalize(self, s: str) -> str:
         """
         Normalize the word, currently only transform to lower case,
@@ -1,5 +1,7 @@
 import datetime
-from typing import Dict
+import random
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 
 from detailization import AbstractDetailizer, SequenceDetailizer
 
@@ -17,6 +19,16 @@ class DatetimeDetailizer(AbstractDetailizer):
 
     labels = ['datetime']
 
+    # how many distinct values of a column are tagged
+    # to infer its format(s), and seed of their sampling,
+    # so the same column is always parsed the same way
+    sample_size = 20
+    sample_seed = 0
+    # how many formats of a column can be, and which share of
+    # the sample a format should match to be one of them
+    max_formats = 2
+    min_format_share = .2
+
     @property
     def sequence_detailizer(self) -> SequenceDetailizer:
         return SequenceDetailizer.get()
@@ -27,6 +39,89 @@ class DatetimeDetailizer(AbstractDetailizer):
     def get_details(self, value: str) -> Dict[str, object]:
         sequence = self.sequence_detailizer.get_details(value).get('sequence')
 
+        format_str, value_str = self._get_format(sequence)
+
+        value = None
+        try:
+            value = datetime.datetime.strptime(value_str, format_str)
+        except Exception as e:
+            logger.warn(f'datetime.strptime({repr(value_str)}, {repr(format_str)}) threw'
+                        f' an error: {e}')
+
+        if value:
+            return {'datetime': {'timestamp': value.timestamp()}}
+
+        return {}
+
+    def get_details_many(self, values: List[str]) -> List[Optional[Dict[str, object]]]:
+        """
+        Infer the format(s) of the column by a sample of values,
+        and parse all values by them, without tagging each value
+        """
+        formats = self._infer_formats(values)
+        if not formats:
+            return super().get_details_many(values)
+
+        result = []
+        cache = {}
+        for value in values:
+            if not isinstance(value, str):
+                result.append(None)
+                continue
+            if value not in cache:
+                cache[value] = self._parse(value.strip(), formats)
+            result.append(cache[value])
+        return result
+
+    def _infer_formats(self, values: List[str]) -> List[str]:
+        """
+        Infer dominant formats of the values by tagging a sample of them
+        @param values: Values of a column
+        @return: Formats, for `strptime`, the most common first
+        """
+        # dict as an ordered set, for the sample not to depend on hashing
+        distinct_values = list(dict.fromkeys(value.strip() for value in values
+                                             if isinstance(value, str)))
+        sample = random.Random(self.sample_seed).sample(
+            distinct_values, min(self.sample_size, len(distinct_values)))
+
+        format_counter = Counter()
+        for value in sample:
+            sequence = self.sequence_detailizer.get_details(value).get('sequence')
+            format_str, value_str = self._get_format(sequence)
+            # only formats of the whole value can be used to parse
+            # other values without tagging them
+            if format_str and value_str == value \
+                    and self._parse(value, [format_str]):
+                format_counter[format_str] += 1
+
+        return [format_str for format_str, count
+                in format_counter.most_common(self.max_formats)
+                if count >= self.min_format_share * len(sample)]
+
+    @staticmethod
+    def _parse(value: str, formats: List[str]) -> Optional[Dict[str, object]]:
+        """
+        Parse the value by the first matching format
+        @param value: Value
+        @param formats: Formats, for `strptime`
+        @return: Details, or None if no format matches
+        """
+        for format_str in formats:
+            try:
+                return {'datetime': {'timestamp': datetime.datetime.strptime(
+                    value, format_str).timestamp()}}
+            except (ValueError, OverflowError):
+                pass
+        return None
+
+    @staticmethod
+    def _get_format(sequence: List[dict]) -> Tuple[str, str]:
+        """
+        Make a format for `strptime` by the tagged sequence
+        @param sequence: Sequence of tokens with labels
+        @return: Tuple format, part of the value matching the format
+        """
         format_str = ''
         value_str  = ''
 
@@ -82,14 +177,4 @@ class DatetimeDetailizer(AbstractDetailizer):
             elif format_str:
                 break
 
-        value = None
-        try:
-            value = datetime.datetime.strptime(value_str, format_str)
-        except Exception as e:
-            logger.warn(f'datetime.strptime({repr(value_str)}, {repr(format_str)}) threw'
-                        f' an error: {e}')
-
-        if value:
-            return {'datetime': {'timestamp': value.timestamp()}}
-
-        return {}
+        return format_str, value_str
@@ -1,22 +1,28 @@
 import traceback
 from concurrent.futures._base import Future
-from typing import Union, Type, Iterable, Tuple
+from typing import Union, Type, Iterable, Tuple, List
 
 from bson import ObjectId
+from pymongo import UpdateOne
 from mongomoron import update, aggregate, dict_, document, \
     sum_, push_
 
+import async_processing
 from app import logger
 from async_loop import call_async
 from async_processing import process_in_parallel
 from db import conn, ds_classification, ds, ds_list
 from detailization.abstract_detailizer import AbstractDetailizer
+from progress import Progress
+
+# settings
+CHUNK_SIZE = 1000
 
 
 def get_details_for_cells(ds_id: Union[str, ObjectId],
                           col: str,
                           detaililzer: AbstractDetailizer):
-    input = ((cell['_id'], cell['value']) \
+    cells = [(cell['_id'], cell['value']) \
              for cell in conn.execute(
         aggregate(ds_classification[ds_id]) \
             .match(document.col == col)
@@ -25,21 +31,49 @@ def get_details_for_cells(ds_id: Union[str, ObjectId],
                     as_='row_data') \
             .project(row_data=document.row_data[0]) \
             .project(value=document.row_data.get_field(col))
-    ))
+    )]
 
     _update_ds_list_record(ds_id, col, {'status': 'in progress'})
 
+    # fast path for the whole column, if the detailizer has one,
+    # the rest of the cells are detailized one by one
+    input = []
+    writes = []
+    for (_id, value), details in zip(cells, detaililzer.get_details_many(
+            [value for _, value in cells])):
+        if details is None:
+            input.append((_id, value))
+        elif details:
+            writes.append(UpdateOne({'_id': _id}, {'$set': {'details': details}}))
+            if len(writes) >= CHUNK_SIZE:
+                _write_details(ds_id, writes)
+    _write_details(ds_id, writes)
+
+    paths = {'fast': len(cells) - len(input), 'slow': len(input)}
+    logger.info('Col %s of DS %s: %d of %d cells are detailized'
+                ' via slow path' % (col, ds_id, len(input), len(cells)))
+
+    # progress and its statistics are of the slow path only, as the processes
+    # spend time on it; the fast path is quick and its share varies by column,
+    # so counting its cells would skew the time per cell
+    progress = Progress('detailization:%s' % detaililzer.__class__.__name__,
+                        total=len(input), processes=async_processing.MAX_PROCESS_COUNT,
+                        persist=lambda d: _update_ds_list_progress(ds_id, col, d))
+    _update_ds_list_progress(ds_id, col, progress.to_dict())
+
     for _id, details in process_in_parallel(input, processor=_execute_task,
-                                            args=(detaililzer,), timeout=120):
+                                            args=(detaililzer,), timeout=120,
+                                            progress=progress):
         if details:
-            conn.execute(
-                update(ds_classification[ds_id]) \
-                    .filter(ds_classification[ds_id]._id == _id)
-                    .set({'details': details})
-            )
+            writes.append(UpdateOne({'_id': _id}, {'$set': {'details': details}}))
+            if len(writes) >= CHUNK_SIZE:
+                _write_details(ds_id, writes)
+    _write_details(ds_id, writes)
 
     _update_ds_list_record(ds_id, col, {'status': 'finished',
-                                        'labels': detaililzer.labels})
+                                        'labels': detaililzer.labels,
+                                        'paths': paths,
+                                        'progress': progress.finish()})
 
 
 def call_get_details_for_cells(ds_id: Union[str, ObjectId],
@@ -87,6 +121,16 @@ def _execute_task(task: Tuple, detailizer: AbstractDetailizer):
     return _id, detailizer.get_details(value)
 
 
+def _write_details(ds_id: Union[str, ObjectId], writes: List[UpdateOne]):
+    """
+    Write details of cells by one round trip, and clear `writes`
+    """
+    if writes:
+        # mongomoron has no bulk writes
+        conn.db()[ds_classification[ds_id]._name].bulk_write(writes, ordered=False)
+        writes.clear()
+
+
 def _update_ds_list_record(ds_id: Union[str, ObjectId],
                            col: str,
                            detailization: dict):
@@ -95,3 +139,13 @@ def _update_ds_list_record(ds_id: Union[str, ObjectId],
             .filter(ds_list._id == ObjectId(ds_id)) \
             .set({'detailization.%s' % col: detailization})
     )
+
+
+def _update_ds_list_progress(ds_id: Union[str, ObjectId],
+                             col: str,
+                             progress: dict):
+    conn.execute(
+        update(ds_list) \
+            .filter(ds_list._id == ObjectId(ds_id)) \
+            .set({'detailization.%s.progress' % col: progress})
+    )
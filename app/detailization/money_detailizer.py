@@ -1,5 +1,6 @@
 import re
-from typing import Any, Hashable, Iterable, Dict, Union, List
+from collections import Counter
+from typing import Any, Hashable, Iterable, Dict, Union, List, Optional
 
 from mongomoron import query
 
@@ -23,6 +24,12 @@ class MoneyDetailizer(BowDetailizer):
         # but let it be
         self.currencies = dict((currency['_id'], currency['name']) for
                                currency in conn.execute(query(currency_list)))
+        # dict normalized currency sign or name -> code, the model
+        # is used only for ones not in there
+        self.currency_table = self._load_currency_table()
+        # dict normalized currency sign or name -> code, resolved
+        # by the model
+        self.currency_cache: Dict[str, Optional[str]] = {}
 
     @property
     def sequence_detailizer(self) -> SequenceDetailizer:
@@ -33,14 +40,12 @@ class MoneyDetailizer(BowDetailizer):
         return NumberDetailizer.get()
 
     def get_details(self, value: str) -> Dict[str, object]:
-        # get number
-        details = self.number_detailizer.get_details(value)
-
-        # here we calculate the sequence second time, already being
-        # calculated in number_detailizer, but let skip optimization for now
         sequence = self.sequence_detailizer.get_details(value).get('sequence')
 
-        # get currency with help of neural network
+        # get number
+        details = self.number_detailizer.get_details_by_sequence(sequence)
+
+        # get currency
         currency = self._get_currency(sequence)
         if currency:
             details.update({'currency': currency})
@@ -81,6 +86,50 @@ class MoneyDetailizer(BowDetailizer):
         if currency_code and currency_code in self.currencies:
             return currency_code
         elif currency_str:
-            return super().get_details(currency_str)
+            return self._resolve_currency(currency_str)
         else:
             return None
+
+    def _resolve_currency(self, currency_str: str) -> Optional[str]:
+        """
+        Get code of the currency by its sign or name, by the table
+        if it's there, or with help of neural network otherwise
+        @param currency_str: Currency sign or name
+        @return: Currency code
+        """
+        key = self._normalize_currency(currency_str)
+        currency = self.currency_table.get(key)
+        if currency:
+            return currency
+        if key not in self.currency_cache:
+            self.currency_cache[key] = super().get_details(currency_str)
+        return self.currency_cache[key]
+
+    def _load_currency_table(self) -> Dict[str, str]:
+        """
+        Make table of currency signs and names, by the currency list
+        and labelled samples. Signs labelled as different currencies,
+        such as "$", go to the one they're labelled the most, unless
+        it's a tie
+        @return: Dict normalized currency sign or name -> code
+        """
+        counters: Dict[str, Counter] = {}
+        for code, name in self.currencies.items():
+            counters.setdefault(self._normalize_currency(code), Counter())[code] += 1
+            counters.setdefault(self._normalize_currency(name), Counter())[code] += 1
+        for sample in self._get_samples():
+            code = sample['labels'][0] if sample.get('labels') else None
+            if code in self.currencies:
+                counters.setdefault(self._normalize_currency(sample['text']),
+                                    Counter())[code] += 1
+
+        currency_table = {}
+        for key, counter in counters.items():
+            most_common = counter.most_common(2)
+            if len(most_common) == 1 or most_common[0][1] > most_common[1][1]:
+                currency_table[key] = most_common[0][0]
+        return currency_table
+
+    @staticmethod
+    def _normalize_currency(s: str) -> str:
+        return ' '.join(s.lower().split())
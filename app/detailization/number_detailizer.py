@@ -1,10 +1,24 @@
 import re
-from typing import Dict, Union
+from typing import Dict, Union, List, Optional
 
 from detailization import AbstractDetailizer, SequenceDetailizer
 
 from app import logger
 
+# plain numbers, which can be parsed without the model, such as "-12",
+# "1234.5", "1,234,567", "12.5k". a single group of thousands without
+# decimal part is ambiguous ("1,234" may be 1.234), so left to the model
+PLAIN_NUMBER_RE = re.compile(r'''
+    ([-+])?
+    (\d+|\d{1,3}(?:,\d{3}){2,}|\d{1,3},\d{3}(?=\.))?
+    (?:\.(\d+))?
+    ([kmb])?
+''', re.VERBOSE | re.IGNORECASE)
+SUFFIX_EXPONENT = {'k': 3, 'm': 6, 'b': 9}
+# suffixes in the number tagged by the model
+SUFFIX_RE = re.compile(r'[kmb]', re.IGNORECASE)
+SUFFIX_ZEROS = {'k': '000', 'm': '000000', 'b': '000000000'}
+
 
 @AbstractDetailizer.sub
 class NumberDetailizer(AbstractDetailizer):
@@ -22,14 +36,60 @@ class NumberDetailizer(AbstractDetailizer):
         pass
 
     def get_details(self, value: str) -> Dict[str, object]:
+        n = self._parse_plain(value)
+        if n is not None:
+            return {'number': n}
+
         sequence = self.sequence_detailizer.get_details(value).get('sequence')
 
+        return self.get_details_by_sequence(sequence)
+
+    def get_details_by_sequence(self, sequence: List[dict]) -> Dict[str, object]:
+        """
+        Get details by already tagged value
+        @param sequence: Sequence of tokens with labels
+        @return: Details
+        """
         n = self._get_number(sequence)
 
         if n is not None:
             return {'number': n}
         return {}
 
+    def get_details_many(self, values: List[str]) -> List[Optional[Dict[str, object]]]:
+        """
+        Parse plain numbers, the rest is left to the model
+        """
+        result = []
+        for value in values:
+            n = self._parse_plain(value)
+            result.append({'number': n} if n is not None else None)
+        return result
+
+    @staticmethod
+    def _parse_plain(value: str) -> Union[float, int, None]:
+        """
+        Parse the value if it's a plain number
+        @param value: Value
+        @return: Number, or None if it isn't a plain number
+        """
+        if not isinstance(value, str):
+            return None
+        m = PLAIN_NUMBER_RE.fullmatch(value.strip())
+        if not m:
+            return None
+        sign, integer, fraction, suffix = m.groups()
+        if integer is None and fraction is None:
+            return None
+
+        integer = (integer or '0').replace(',', '')
+        exponent = SUFFIX_EXPONENT[suffix.lower()] if suffix else 0
+        if fraction is None:
+            n = int(integer) * 10 ** exponent
+        else:
+            n = float(f'{integer}.{fraction}e{exponent}')
+        return -n if sign == '-' else n
+
     def _get_number(self, sequence) -> Union[float, int, None]:
         number_str = ''
         is_decimal_point_used = False
@@ -48,9 +108,7 @@ class NumberDetailizer(AbstractDetailizer):
                 pass
             elif number_str:
                 break
-        number_str = re.sub(r'[kK]', '000', number_str)
-        number_str = re.sub(r'[mM]', '000000', number_str)
-        number_str = re.sub(r'[bB]', '000000000', number_str)
+        number_str = SUFFIX_RE.sub(lambda m: SUFFIX_ZEROS[m.group().lower()], number_str)
 
         if not number_str:
             return None
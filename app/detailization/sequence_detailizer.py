@@ -1,6 +1,7 @@
+import functools
 import os
 import re
-from typing import List, Union, Iterable, Dict
+from typing import List, Union, Iterable, Dict, Tuple
 
 import pycrfsuite
 from mongomoron import query
@@ -17,6 +18,15 @@ class CharType:
     PUNCTUATION = 3
 
 
+# a token is a run of characters of the same type, thus digits,
+# other word characters, whitespaces, or anything else
+TOKEN_RE = re.compile(r'(\d+)|([^\W\d]+)|(\s+)|([^\w\s]+)')
+TOKEN_RE_GROUP_CHAR_TYPE = [None, CharType.DIGIT, CharType.WORD,
+                            CharType.WHITESPACE, CharType.PUNCTUATION]
+# cache of char types by character
+CHAR_TYPES: Dict[str, int] = {}
+
+
 @AbstractDetailizer.sub
 class SequenceDetailizer(AbstractDetailizer):
     """
@@ -41,6 +51,10 @@ class SequenceDetailizer(AbstractDetailizer):
 
         return self._predict(value)
 
+    def preload(self):
+        if not self.tagger:
+            self._load_model()
+
     def split(self, s: str) -> List[str]:
         """
         Split initial string to the sequence of the so-called "tokens".
@@ -48,22 +62,16 @@ class SequenceDetailizer(AbstractDetailizer):
         @param s: Initial string
         @return: Sequence of tokens
         """
-        c_type: int
-        token_type: int = 0
-        token: str = ''
-        token_list = []
-        for c in s:
-            c_type = self._get_char_type(c)
-            if token_type == c_type:
-                token += c
-            else:
-                if token:
-                    token_list.append(token)
-                token_type = c_type
-                token = c
-        if token:
-            token_list.append(token)
-        return token_list
+        return [m.group() for m in TOKEN_RE.finditer(s)]
+
+    def tokenize(self, s: str) -> List[Tuple[str, int]]:
+        """
+        The same as `split`, but also return type of each token
+        @param s: Initial string
+        @return: Sequence of tuples token, char type
+        """
+        return [(m.group(), TOKEN_RE_GROUP_CHAR_TYPE[m.lastindex])
+                for m in TOKEN_RE.finditer(s)]
 
     def get_default_sequence(self, s: str) -> List[dict]:
         """
@@ -77,18 +85,20 @@ class SequenceDetailizer(AbstractDetailizer):
             CharType.WHITESPACE: 'whitespace',
             CharType.PUNCTUATION: 'separator',
         }
-        return [{'token': token, 'label': c_to_label[self._get_char_type(token)]} for
-                token in self.split(s)]
+        return [{'token': token, 'label': c_to_label[c_type]} for
+                token, c_type in self.tokenize(s)]
 
     def _get_char_type(self, c: str) -> int:
-        if re.match(r'\d', c):
-            return CharType.DIGIT
-        elif re.match(r'\w', c):
-            return CharType.WORD
-        elif re.match(r'\s', c):
-            return CharType.WHITESPACE
-        else:
+        """
+        Char type of `c`, or of its first character if it's a token
+        """
+        if not c:
             return CharType.PUNCTUATION
+        c_type = CHAR_TYPES.get(c[0])
+        if c_type is None:
+            m = TOKEN_RE.match(c[0])
+            c_type = CHAR_TYPES[c[0]] = TOKEN_RE_GROUP_CHAR_TYPE[m.lastindex]
+        return c_type
 
     def _normalize(self, token: str) -> Union[str, int]:
         """
@@ -178,24 +188,29 @@ class SequenceDetailizer(AbstractDetailizer):
         @param tokens: List of tokens
         @return: List of features
         """
-
-        ff = [{
+        token_features = [self._get_token_features(token) for token in tokens]
+        xseq = []
+        for window in _get_feature_windows(len(token_features)):
+            x = []
+            for suffix, i in window:
+                x += token_features[i][suffix]
+            xseq.append(x)
+        return xseq
+
+    @functools.lru_cache(maxsize=0x10000)
+    def _get_token_features(self, token: str) -> 'TokenFeatures':
+        """
+        Features of the single token, tokens are mostly
+        repeated, so cached
+        @param token: Token
+        @return: Features
+        """
+        return TokenFeatures({
             'token': token,
             'chartype': self._get_char_type(token),
             'token_normal': self._normalize(token),
             'token_len': len(token),
-        } for token in tokens]
-        for i, f in enumerate(ff[1:]):
-            f.update(dict((f'{k}[-1]', v) for k, v in ff[i - 1].items()))
-        for i, f in enumerate(ff[2:]):
-            f.update(dict((f'{k}[-2]', v) for k, v in ff[i - 2].items()))
-        for i, f in enumerate(ff[:-1]):
-            f.update(dict((f'{k}[1]', v) for k, v in ff[i + 1].items()))
-        for i, f in enumerate(ff[:-2]):
-            f.update(dict((f'{k}[2]', v) for k, v in ff[i + 2].items()))
-
-        # crfsuite wants a format of '='-separated key-value strings
-        return [[f'{k}={v}' for k, v in f.items()] for f in ff]
+        })
 
     def _get_samples(self) -> Iterable[dict]:
         return conn.execute(query(dl_seq))
@@ -241,3 +256,44 @@ class SequenceDetailizer(AbstractDetailizer):
 
         sequence = [{'token': token, 'label': label} for token, label in zip(tokens, ypred)]
         return {'sequence': self._implode_sequence(sequence)}
+
+
+class TokenFeatures(dict):
+    """
+    Features of a token as '='-separated key-value strings,
+    with keys suffixed by the position relative to the token
+    they're for, e.g. `features['[-1]']`, created on demand
+    """
+
+    def __init__(self, f: Dict[str, object]):
+        super().__init__()
+        self.f = f
+
+    def __missing__(self, suffix: str) -> Tuple[str, ...]:
+        # crfsuite wants a format of '='-separated key-value strings
+        features = self[suffix] = tuple(f'{k}{suffix}={v}' for k, v in self.f.items())
+        return features
+
+
+@functools.lru_cache(maxsize=0x100)
+def _get_feature_windows(n: int) -> List[List[Tuple[str, int]]]:
+    """
+    Which features make up features of each token of a sequence,
+    thus features of the token itself and of the neighbour tokens
+    with suffixed keys. It must be exactly as it always was,
+    otherwise the model trained on it wouldn't work, thus including
+    features of features of the neighbours, and wrapping around the
+    sequence's end
+    @param n: Length of the sequence
+    @return: List of (suffix, index of token) for each token
+    """
+    ff = [[('', i)] for i in range(n)]
+    for i, f in enumerate(ff[1:]):
+        f.extend([(suffix + '[-1]', j) for suffix, j in ff[i - 1]])
+    for i, f in enumerate(ff[2:]):
+        f.extend([(suffix + '[-2]', j) for suffix, j in ff[i - 2]])
+    for i, f in enumerate(ff[:-1]):
+        f.extend([(suffix + '[1]', j) for suffix, j in ff[i + 1]])
+    for i, f in enumerate(ff[:-2]):
+        f.extend([(suffix + '[2]', j) for suffix, j in ff[i + 2]])
+    return ff
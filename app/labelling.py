@@ -1,6 +1,9 @@
+import bisect
 import json
-from typing import Callable, Union, Any, Optional
+from typing import Callable, Union, Any, Optional, List
 
+import pymongo
+from pymongo import InsertOne, UpdateOne
 from pymongo.cursor import Cursor
 
 from app import app
@@ -8,26 +11,70 @@ import random
 
 from bson import ObjectId
 
-from collections_helper import objectset
+from cached_resource import CachedResource, ResourceSnapshot
+from collections_helper import canonical
 from db import conn, dl_session, dl_session_list, ds, \
-    dl_master, dl_geo, geo_country, geo_city, dl_seq, ds_classification, dl_currency, currency_list
+    dl_master, dl_geo, geo_country, geo_city, dl_seq, ds_classification, dl_currency, currency_list, \
+    sample, any_in
 from flask import request, render_template, url_for
 from mongomoron import query_one, update_one, query, insert_one, index, \
-    insert_many, document, Collection, aggregate
+    insert_many, document, Collection, aggregate, AggregationPipelineBuilder
+from werkzeug.exceptions import BadRequest
 from werkzeug.utils import redirect
 
 from detailization import SequenceDetailizer
 
 
+# index of session samples to get the next ones, partial by `unlabelled`
+UNLABELLED_INDEX = [('unlabelled', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+
+
+class LabelCatalogSnapshot(ResourceSnapshot):
+
+    def __init__(self, data: List[dict], body: bytes):
+        super().__init__(data, body)
+        index = sorted((label['text'].casefold(), i) for i, label in enumerate(data))
+        self.keys = [key for key, _ in index]
+        self.positions = [i for _, i in index]
+
+
+class LabelCatalog(CachedResource):
+    """
+    Labels in the format needed by frontend, i.e. list of
+    {"value": <value>, "text": <text>}, searchable by prefix of the text
+    """
+
+    def search(self, prefix: str, limit: int) -> List[dict]:
+        snapshot: LabelCatalogSnapshot = self.get()
+        prefix = prefix.casefold()
+        result = []
+        for i in range(bisect.bisect_left(snapshot.keys, prefix), len(snapshot.keys)):
+            if len(result) >= limit or not snapshot.keys[i].startswith(prefix):
+                break
+            result.append(snapshot.data[snapshot.positions[i]])
+        return result
+
+    def _make_snapshot(self, data: List[dict]) -> LabelCatalogSnapshot:
+        return LabelCatalogSnapshot(data, self.serialize(data).encode())
+
+
 class LabellingInterface(object):
     """
     Interface for labelling (assigning to each text some kind of label)
     """
 
+    # count of documents sampled for a session, per value of its capacity
+    sample_factor = 2
+    # max count of samples taken for a session
+    max_sample_rounds = 10
+    # if labels are served by a catalog instead of embedding them into the page
+    has_label_catalog = False
+
     def __init__(self, type: str, prefix: str, collection: Collection):
         self._type = type
         self._prefix = prefix
         self._collection = collection
+        self._label_catalog = LabelCatalog(self.labels) if self.has_label_catalog else None
 
     def routes(self):
         def _route(rule: str, func: Callable, **options):
@@ -39,10 +86,14 @@ class LabellingInterface(object):
         _route('/session', self.session)
         _route('/session/<session_id>', self.next_sample, methods=['GET'])
         _route('/session/<session_id>', self.label_sample, methods=['POST'])
+        _route('/session/<session_id>/next', self.next_samples, methods=['GET'])
         _route('/session/<session_id>/merge', self.merge, methods=['POST'])
         _route('/session/<session_id>/resolve-conflicts',
                self.resolve_conflicts,
                methods=['POST'])
+        if self._label_catalog:
+            _route('/labels', self.label_catalog)
+            _route('/labels/search', self.search_labels)
 
     def session(self):
         session_id = request.args.get('session_id', None)
@@ -54,48 +105,9 @@ class LabellingInterface(object):
                 raise Exception("For labelling session ds_id must be provided")
             limit = int(request.args.get('limit', 1000))
 
-            # if seq_label passed, get tokens from the detailized
-            # sequence instead of values from the DS
+            session_values = self._sample_values(ds_id, col, seq_label_list, limit)
             if seq_label_list:
-                p = aggregate(ds_classification[ds_id])
-                if col:
-                    p.match(document.col == col)
-                p.project(sequence=document.details.sequence) \
-                    .unwind(document.sequence) \
-                    .project(token=document.sequence.token, label=document.sequence.label) \
-                    .match(document.label.in_(seq_label_list))
-
-                cursor = conn.execute(p)
                 col = 'token'
-            else:
-                cursor = conn.execute(query(ds[ds_id]))
-
-            # create new session based on data source
-            # `ds_id` with `limit` capacity
-            data = set()
-            for record in cursor:
-                del record['_id']
-                if col:
-                    s = str(record[col]).strip()
-                    if s:
-                        data.add(s)
-                else:
-                    for value in record.values():
-                        s = str(value).strip()
-                        if s:
-                            data.add(s)
-
-            # check if data exist
-            if not data:
-                raise Exception(f'There are no data by ds_id={ds_id}, col={col}, '
-                                f'seq_label={seq_label_list}')
-
-            # any data from any columns (or `col` if specified) of the data
-            # source
-            # in random order
-            session_values = list(data)
-            random.shuffle(session_values)
-            session_values = session_values[:limit]
 
             # add session to dl_session
             session_id = conn.execute(
@@ -107,9 +119,13 @@ class LabellingInterface(object):
             # create collection for session values
             session_collection = conn.create_collection(dl_session[session_id])
             conn.create_index(index(session_collection).asc('text').unique())
+            # next samples are got by the index of only unlabelled ones,
+            # so it doesn't get slower as the session is being labelled
+            conn.db()[session_collection._name].create_index(
+                UNLABELLED_INDEX, partialFilterExpression={'unlabelled': True})
             conn.execute(
-                insert_many(session_collection, [dict(text=value) for value in
-                                                 session_values])
+                insert_many(session_collection, [dict(text=value, unlabelled=True)
+                                                 for value in session_values])
             )
 
             # redirect to session Page
@@ -120,33 +136,46 @@ class LabellingInterface(object):
         # return the page itself  with embed session_id and labels
         # (maybe better to return bare page and do async API call,
         # not sure)
-        return render_template('spa.html',
-                               root='labelling.js',
-                               data={'type': self._type, 'prefix': self._prefix,
-                                     'sessionId': session_id,
-                                     'labels': self.labels()})
+        data = {'type': self._type, 'prefix': self._prefix, 'sessionId': session_id}
+        if self._label_catalog:
+            # the page loads (and caches by ETag) or searches the labels
+            # lazily instead of getting them embedded into every page
+            data['labelsUrl'] = self._label_catalog.versioned_url(self._prefix + '/labels')
+            data['labelsSearchUrl'] = self._prefix + '/labels/search'
+        else:
+            data['labels'] = self.labels()
+        return render_template('spa.html', root='labelling.js', data=data)
 
     def next_sample(self, session_id):
-        sample = conn.execute(
-            query_one(dl_session[session_id]).filter(
-                dl_session[session_id].labels == None)
-        )
-
-        if sample:
+        samples = self._next_samples(session_id, 1)
+        if samples:
             return {
-                'text': sample['text'],
+                **samples[0],
                 'success': True
             }
 
-        conn.execute(
-            update_one(dl_session_list) \
-                .filter(dl_session_list._id == ObjectId(session_id)) \
-                .set({'status': 'finished'})
-        )
+        return self._finish(session_id)
+
+    def next_samples(self, session_id):
+        """
+        Next `count` samples, for UI to prefetch them
+        """
+        try:
+            count = int(request.args.get('count', 10))
+        except ValueError:
+            raise BadRequest('count must be an integer')
+        # limit(0) is no limit in Mongo
+        count = max(1, min(count, 100))
+        samples = self._next_samples(session_id, count)
+        if samples:
+            return {
+                'list': samples,
+                'success': True
+            }
 
         return {
-            'status': 'finished',
-            'success': True
+            'list': [],
+            **self._finish(session_id)
         }
 
     def label_sample(self, session_id):
@@ -158,37 +187,48 @@ class LabellingInterface(object):
         conn.execute(
             update_one(dl_session[session_id]) \
                 .filter(document.text == text) \
-                .set({'labels': [self._ftob(label)]})
+                .set({'labels': [self._ftob(label)], 'unlabelled': False})
         )
 
         return self.next_sample(session_id)
 
     @conn.transactional
     def merge(self, session_id):
-        session_dict = dict((sample['text'], sample) for sample in
-                            conn.execute(query(dl_session[session_id]).filter(
-                                document.labels != None)))
+        return self._merge(session_id)
 
-        master_dict = dict((sample['text'], sample) for sample in
-                           conn.execute(query(self._collection).filter(
-                               document.text.in_(list(session_dict.keys())))))
+    def _merge(self, session_id):
+        # labelled session samples, with the master sample of the same text, if any
+        session_collection = dl_session[session_id]
+        p = aggregate(session_collection) \
+            .match(document.labels.exists()) \
+            .lookup(self._collection, local_field='text', foreign_field='text', as_='master') \
+            .project(document.text, document.labels, document.override,
+                     master=document.master[0])
 
         conflicts = []
-        for text, master_sample in master_dict.items():
-            session_sample = session_dict[text]
-            master_labels = objectset(master_sample['labels'])
-            session_labels = objectset(session_sample['labels'])
-
-            if (master_labels == session_labels):
-                pass
-            elif session_sample.get('override', False):
+        writes = []
+        for sample in conn.execute(p):
+            master_sample = sample.get('master')
+            if not master_sample:
+                # insert new samples
+                writes.append(InsertOne({'text': sample['text'], 'labels': sample['labels']}))
+                continue
+
+            master_labels = dict((canonical(label), label) for label in master_sample['labels'])
+            session_labels = dict((canonical(label), label) for label in sample['labels'])
+
+            if master_labels.keys() == session_labels.keys():
                 pass
+            elif sample.get('override', False):
+                # update overridden samples
+                writes.append(UpdateOne({'text': sample['text']},
+                                        {'$set': {'labels': sample['labels']}}))
             else:
-                all_labels = master_labels | session_labels
+                all_labels = {**master_labels, **session_labels}
                 diff = []
-                for label in all_labels:
-                    label_in_master = label in master_labels
-                    label_in_session = label in session_labels
+                for key, label in all_labels.items():
+                    label_in_master = key in master_labels
+                    label_in_session = key in session_labels
                     source = None
                     if label_in_master and label_in_session:
                         source = 'both'
@@ -197,31 +237,19 @@ class LabellingInterface(object):
                     elif label_in_session:
                         source = 'session'
                     diff.append({
-                        'label': self._btof(label),
+                        'label': label,
                         'source': source
                     })
                 conflicts.append({
-                    'text': text,
+                    'text': sample['text'],
                     'diff': diff
                 })
 
         if not conflicts:
-            # insert new samples
-            conn.execute(
-                insert_many(self._collection,
-                            ({'text': text, 'labels': sample['labels']} for
-                             text, sample in
-                             session_dict.items()
-                             if text not in master_dict.keys()))
-            )
-            # update overridden samples
-            for sample in filter(lambda sample: sample.get('override', False),
-                                 session_dict.values()):
-                conn.execute(
-                    update_one(self._collection) \
-                        .filter(document.text == sample['text']) \
-                        .set({'labels': sample['labels']})
-                )
+            # all at once, mongomoron has no bulk writes
+            if writes:
+                conn.db()[self._collection._name].bulk_write(
+                    writes, ordered=False, session=conn.session())
 
             conn.execute(
                 update_one(dl_session_list) \
@@ -233,6 +261,11 @@ class LabellingInterface(object):
                 'success': True
             }
 
+        # convert labels of all conflicts at once
+        diff_items = [item for conflict in conflicts for item in conflict['diff']]
+        for item, label in zip(diff_items, self._btof_many([item['label'] for item in diff_items])):
+            item['label'] = label
+
         conn.execute(
             update_one(dl_session_list) \
                 .filter(dl_session_list._id == ObjectId(session_id))
@@ -261,6 +294,92 @@ class LabellingInterface(object):
 
         return self.merge(session_id)
 
+    def _sample_values(self, ds_id: str, col: Optional[str],
+                       seq_label_list: List[str], limit: int) -> List[str]:
+        """
+        Sample distinct values for a new labelling session. Documents
+        are sampled server-side, more than `limit` as values may repeat,
+        and sampled again if the sample had too few distinct values,
+        until it brings no new ones or `max_sample_rounds` are taken,
+        so the DS is never scanned as a whole
+        @param ds_id: DS id
+        @param col: Column to sample from, by default all columns
+        @param seq_label_list: If not empty, tokens of the detailized
+        sequences with these labels are sampled instead of values
+        @param limit: Max count of values
+        @return: Values in random order
+        """
+        sample_size = self.sample_factor * limit
+
+        # dict as a set which keeps the order of the sample
+        data = dict()
+
+        for _ in range(self.max_sample_rounds):
+            count = len(data)
+            for record in conn.execute(self._sample_pipeline(
+                    ds_id, col, seq_label_list, sample_size)):
+                del record['_id']
+                for value in record.values():
+                    s = str(value).strip()
+                    if s:
+                        data[s] = None
+            if len(data) >= limit or len(data) == count:
+                break
+
+        # check if data exist
+        if not data:
+            raise Exception(f'There are no data by ds_id={ds_id}, col={col}, '
+                            f'seq_label={seq_label_list}')
+
+        # any data from any columns (or `col` if specified) of the data
+        # source in random order; documents are already sampled in random
+        # order, shuffle to mix values of different columns of a document
+        session_values = list(data)[:limit]
+        random.shuffle(session_values)
+        return session_values
+
+    @staticmethod
+    def _sample_pipeline(ds_id: str, col: Optional[str],
+                         seq_label_list: List[str], size: int) -> AggregationPipelineBuilder:
+        """
+        Pipeline of `size` random documents of the DS, with values
+        of `col` only if specified, or of `size` random sequences
+        having labels of `seq_label_list`, with their tokens of these labels
+        """
+        # if seq_label passed, get tokens from the detailized
+        # sequence instead of values from the DS
+        if seq_label_list:
+            p = aggregate(ds_classification[ds_id])
+            if col:
+                p.match(document.col == col)
+            # only sequences having the labels, which may be rare
+            p.match(any_in(document.details.sequence.label, seq_label_list))
+            return sample(p, size) \
+                .project(sequence=document.details.sequence) \
+                .unwind(document.sequence) \
+                .project(token=document.sequence.token, label=document.sequence.label) \
+                .match(document.label.in_(seq_label_list)) \
+                .project(token=document.token)
+        p = sample(aggregate(ds[ds_id]), size)
+        if col:
+            p.project(value=document.get_field(col))
+        return p
+
+    def label_catalog(self):
+        return self._label_catalog.response()
+
+    def search_labels(self):
+        prefix = request.args['prefix']
+        try:
+            limit = int(request.args.get('limit', 20))
+        except ValueError:
+            raise BadRequest('limit must be an integer')
+        limit = max(1, min(limit, 100))
+        return {
+            'list': self._label_catalog.search(prefix, limit),
+            'success': True
+        }
+
     def labels(self) -> list:
         """
         Labels of the given type of labelling interface,
@@ -268,9 +387,42 @@ class LabellingInterface(object):
         """
         return []
 
+    def _next_samples(self, session_id: str, count: int) -> List[dict]:
+        # in order of the session values, i.e. random
+        cursor = conn.execute(
+            query(dl_session[session_id]).filter(document.unlabelled == True)
+            .sort((document._id, pymongo.ASCENDING))
+        )
+        return [self._sample(record['text']) for record in cursor.limit(count)]
+
+    def _sample(self, text: str) -> dict:
+        """
+        Sample in the format needed by frontend
+        """
+        return {'text': text}
+
+    def _finish(self, session_id: str) -> dict:
+        conn.execute(
+            update_one(dl_session_list) \
+                .filter(dl_session_list._id == ObjectId(session_id)) \
+                .set({'status': 'finished'})
+        )
+
+        return {
+            'status': 'finished',
+            'success': True
+        }
+
     def _btof(self, label):
         return label
 
+    def _btof_many(self, labels: List) -> List:
+        """
+        Convert many labels from backend to frontend format at once,
+        override if it can be done faster than one by one
+        """
+        return [self._btof(label) for label in labels]
+
     def _ftob(self, label):
         return label
 
@@ -304,12 +456,11 @@ class SequenceLabellingInterface(LabellingInterface):
     def detailizer(self) -> SequenceDetailizer:
         return SequenceDetailizer.get()
 
-    def next_sample(self, session_id):
-        sample = super().next_sample(session_id)
-        text: Optional[str] = sample.get('text')
-        if text:
-            sample['sequence'] = self.detailizer.get_default_sequence(text)
-        return sample
+    def _sample(self, text: str) -> dict:
+        return {
+            'text': text,
+            'sequence': self.detailizer.get_default_sequence(text)
+        }
 
     def labels(self) -> list:
         return self.detailizer.seq_labels
@@ -322,6 +473,7 @@ class GeoLabellingInterface(LabellingInterface):
     """
     Labelling interface for geo locations - cities and countries
     """
+    has_label_catalog = True
 
     def __init__(self):
         super(GeoLabellingInterface, self).__init__(type='geo', prefix='/dlgeo',
@@ -341,22 +493,34 @@ class GeoLabellingInterface(LabellingInterface):
                conn.execute(query(geo_city))]
 
     def _btof(self, label: dict):
-        city_id = label.get('city_id', None)
-        country_id = label.get('country_id', None)
-
-        if country_id:
-            country = conn.execute(
-                query_one(geo_country).filter(geo_country._id == country_id))
-        else:
-            country = {'_id': 'null', 'name': '-'}
-        if city_id:
-            city = conn.execute(
-                query_one(geo_city).filter(geo_city._id == city_id))
-        else:
-            city = {'_id': 'null', 'name': '-'}
+        return self._btof_many([label])[0]
+
+    def _btof_many(self, labels: List[dict]) -> List[dict]:
+        # one query per collection for all labels
+        country_ids = list(set(label['country_id'] for label in labels if label.get('country_id')))
+        city_ids = list(set(label['city_id'] for label in labels if label.get('city_id')))
+        countries = dict((country['_id'], country) for country in conn.execute(
+            query(geo_country).filter(geo_country._id.in_(country_ids)))) if country_ids else {}
+        cities = dict((city['_id'], city) for city in conn.execute(
+            query(geo_city).filter(geo_city._id.in_(city_ids)))) if city_ids else {}
+
+        result = []
+        for label in labels:
+            city_id = label.get('city_id', None)
+            country_id = label.get('country_id', None)
+
+            if country_id:
+                country = countries.get(country_id, {'_id': country_id, 'name': country_id})
+            else:
+                country = {'_id': 'null', 'name': '-'}
+            if city_id:
+                city = cities.get(city_id, {'_id': city_id, 'name': city_id})
+            else:
+                city = {'_id': 'null', 'name': '-'}
 
-        return {'value': '%s,%s' % (city['_id'], country['_id']),
-                'text': '%s, %s' % (city['name'], country['name'])}
+            result.append({'value': '%s,%s' % (city['_id'], country['_id']),
+                           'text': '%s, %s' % (city['name'], country['name'])})
+        return result
 
     def _ftob(self, label: str):
         [city_id, country_id] = label.split(',')
@@ -372,6 +536,8 @@ class CurrencyLabellingInterface(LabellingInterface):
     """
     Labelling interface for currencies
     """
+    has_label_catalog = True
+
     def __init__(self):
         # let reuse UI of geo labelling
         super().__init__('geo', '/dlcur', dl_currency)
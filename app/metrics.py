@@ -0,0 +1,200 @@
+"""
+Metrics of the process (requests, DB operations, background jobs, caches),
+exposed in Prometheus text format by `render`. Updating a metric is
+a dict lookup under a lock, so it's cheap enough for hot paths;
+gauges which are expensive to track are collected on render instead.
+Metrics are per process, with multiple workers each one has its own.
+"""
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Tuple, Dict, Callable, List, Optional, Iterator
+
+# seconds
+DEFAULT_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60., 300.)
+
+_registry: List['Metric'] = []
+
+
+class Metric(object):
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        """
+        @return: Iterator of tuples suffix of the name, label names,
+        label values, value
+        """
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_render_labels(labels, values)} {_render_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *values: str, amount: float = 1.):
+        with self.lock:
+            self._values[values] = self._values.get(values, 0.) + amount
+
+    def get(self, *values: str) -> float:
+        return self._values.get(values, 0.)
+
+    def samples(self):
+        with self.lock:
+            items = list(self._values.items())
+        for values, value in items:
+            yield '', self.labels, values, value
+
+
+class Gauge(Metric):
+    """
+    Gauge, either set/inc/dec, or collected by `collect`, which
+    returns dict of label values -> value, on render
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *values: str):
+        with self.lock:
+            self._values[values] = value
+
+    def inc(self, *values: str, amount: float = 1.):
+        with self.lock:
+            self._values[values] = self._values.get(values, 0.) + amount
+
+    def dec(self, *values: str, amount: float = 1.):
+        self.inc(*values, amount=-amount)
+
+    def get(self, *values: str) -> float:
+        return self._values.get(values, 0.)
+
+    def samples(self):
+        if self.collect:
+            items = list(self.collect().items())
+        else:
+            with self.lock:
+                items = list(self._values.items())
+        for values, value in items:
+            yield '', self.labels, values, value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # label values -> counts of observations per bucket (not cumulative,
+        # the last one is +Inf), sum of observations
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *values: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, sum_ = self._values.get(values) or \
+                           self._values.setdefault(values, ([0] * (len(self.buckets) + 1), [0.]))
+            counts[i] += 1
+            sum_[0] += value
+
+    @contextmanager
+    def time(self, *values: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *values)
+
+    def count(self, *values: str) -> int:
+        counts, _ = self._values.get(values, ([], [0.]))
+        return sum(counts)
+
+    def samples(self):
+        with self.lock:
+            items = [(values, list(counts), sum_[0]) for values, (counts, sum_) in self._values.items()]
+        labels = (*self.labels, 'le')
+        for values, counts, sum_ in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                yield '_bucket', labels, (*values, _render_value(bound)), cumulative
+            yield '_sum', self.labels, values, sum_
+            yield '_count', self.labels, values, cumulative
+
+
+def render() -> str:
+    """
+    All metrics in Prometheus text format
+    """
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+_OBJECT_ID_RE = re.compile(r'[0-9a-f]{24}')
+
+
+def collection_family(name: str) -> str:
+    """
+    Family of the collection, e.g. `ds_*_classification`
+    for `ds_<id>_classification`, to keep cardinality of labels low
+    """
+    return _OBJECT_ID_RE.sub('*', name)
+
+
+def _render_labels(labels: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (label, str(value).replace('\\', '\\\\')
+                                       .replace('"', '\\"').replace('\n', '\\n'))
+                          for label, value in zip(labels, values)) + '}'
+
+
+def _render_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+http_request_duration = Histogram('http_request_duration_seconds',
+                                  'Latency of HTTP requests by endpoint',
+                                  ('endpoint', 'method'))
+http_requests = Counter('http_requests_total', 'HTTP requests by endpoint and status',
+                        ('endpoint', 'status'))
+http_requests_in_progress = Gauge('http_requests_in_progress', 'HTTP requests being served')
+
+mongo_command_duration = Histogram('mongo_command_duration_seconds',
+                                   'Duration of MongoDB commands by collection family',
+                                   ('collection', 'command'))
+mongo_command_failures = Counter('mongo_command_failures_total',
+                                 'Failed MongoDB commands by collection family',
+                                 ('collection', 'command'))
+
+job_duration = Histogram('job_duration_seconds', 'Duration of background jobs',
+                         ('job', 'status'), buckets=(1., 5., 15., 60., 300., 900., 3600., 4 * 3600.))
+jobs_in_progress = Gauge('jobs_in_progress', 'Background jobs being executed')
+
+cache_requests = Counter('cache_requests_total', 'Cache lookups by result (hit or miss)',
+                         ('cache', 'result'))
@@ -0,0 +1,56 @@
+"""
+Flask side of `metrics`: timing of requests, gauges collected
+on scrape, and the endpoint to scrape the metrics
+"""
+import time
+from typing import Optional
+
+from flask import Blueprint, Response, request, g
+
+import async_loop
+import metrics
+from db import conn
+
+blueprint = Blueprint('monitoring', __name__)
+
+
+@blueprint.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.http_requests_in_progress.inc()
+
+
+@blueprint.after_app_request
+def remember_status(response: Response) -> Response:
+    g.response_status = response.status_code
+    return response
+
+
+@blueprint.teardown_app_request
+def observe_request(e: Optional[BaseException]):
+    # unlike `after_app_request`, called even if the response failed to build
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.http_requests_in_progress.dec()
+        endpoint = request.endpoint or 'none'
+        metrics.http_request_duration.observe(time.perf_counter() - started,
+                                              endpoint, request.method)
+        metrics.http_requests.inc(endpoint, str(g.pop('response_status', 500)))
+
+
+def _collect_pool():
+    connections = conn.pool_stats()['connections'] or {}
+    return {('open',): connections.get('open', 0),
+            ('checked_out',): connections.get('checkedOut', 0),
+            ('max',): conn.MAX_POOL_SIZE}
+
+
+metrics.Gauge('mongo_pool_connections', 'Connections of MongoDB pool of the process',
+              ('state',), collect=_collect_pool)
+metrics.Gauge('jobs_queued', 'Background jobs waiting for execution',
+              collect=lambda: {(): async_loop.queue_size()})
+
+
+@blueprint.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
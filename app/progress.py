@@ -0,0 +1,155 @@
+"""
+Progress of stages of the processing pipeline (classification of a DS,
+detailization of a column): items done, throughput, queue depth and
+utilization of the processes, persisted periodically to the DS list
+record, so that clients can show live progress. ETA is estimated by
+statistics of the finished runs of the same stage (see `cl_stat`),
+and refined by the observed throughput as the run goes.
+"""
+import datetime
+import statistics
+import time
+from typing import Callable, Optional, Dict
+
+import pymongo
+from mongomoron import query, insert_one, and_
+
+from db import conn, cl_stat, analytics
+
+# progress is persisted not more often than this, seconds
+PERSIST_INTERVAL = 2
+# count of the latest finished runs of a stage the estimation is based on
+HISTORY_SIZE = 20
+
+
+def estimate_duration(stage: str, count: int, processes: int) -> Optional[float]:
+    """
+    Estimate duration of the run by the statistics of the latest runs
+    of the stage: median time per item spent by processes (so it doesn't
+    depend on count of processes or on idle time of processes waiting
+    for other jobs), times count of items, divided by count of processes
+    @param stage: Stage, e.g. 'classification:PatternClassifier'
+    @param count: Count of items
+    @param processes: Count of processes
+    @return: Seconds, None if there are no statistics of the stage
+    """
+    cursor = conn.execute(analytics(
+        query(cl_stat)
+        .filter(and_(cl_stat.stage == stage, cl_stat.workerSeconds.exists()))
+        .sort((cl_stat.started, pymongo.DESCENDING)))).limit(HISTORY_SIZE)
+    per_item = [record['workerSeconds'] / record['count'] for record in cursor if record['count']]
+    if not per_item:
+        return None
+    return statistics.median(per_item) * count / max(processes, 1)
+
+
+class Progress(object):
+    """
+    Progress of a run of a stage. `update` it as items are done,
+    it's passed to `persist` every `PERSIST_INTERVAL` seconds;
+    `finish` it to add the run to the statistics
+    """
+
+    def __init__(self, stage: str, total: int, processes: int,
+                 persist: Callable[[dict], None]):
+        """
+        @param stage: Stage, the run's statistics are comparable with
+        the statistics of other runs of the same stage only
+        @param total: Count of items to process
+        @param processes: Count of processes which process items
+        @param persist: Function to save progress (see `to_dict`)
+        """
+        self.stage = stage
+        self.total = total
+        self.processes = processes
+        self.persist = persist
+        self.done = 0
+        self.queue = total
+        # seconds each process (by pid) spent processing items
+        self.busy: Dict[int, float] = {}
+        self.started = datetime.datetime.now()
+        self._started = time.monotonic()
+        self._persisted = self._started
+        self.estimated = estimate_duration(stage, total, processes)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    @property
+    def rate(self) -> float:
+        """
+        Items per second
+        """
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        Seconds remaining. The estimation by the statistics is
+        trusted less as more items are done at the observed rate
+        """
+        remaining = self.total - self.done
+        if not remaining:
+            return 0.
+        rate = self.rate
+        by_rate = remaining / rate if rate else None
+        by_history = max(self.estimated - self.elapsed, 0.) \
+            if self.estimated is not None else None
+        if by_rate is None:
+            return by_history
+        if by_history is None:
+            return by_rate
+        weight = self.done / self.total
+        return weight * by_rate + (1 - weight) * by_history
+
+    def update(self, done: int = 1, queue: Optional[int] = None,
+               pid: Optional[int] = None, busy: float = 0.):
+        """
+        @param done: Count of items done since the last update
+        @param queue: Count of items not taken by processes yet,
+        if known, otherwise it's assumed all not done
+        @param pid: Process which has done the items
+        @param busy: Seconds the process spent on the items
+        """
+        self.done += done
+        self.queue = queue if queue is not None else self.total - self.done
+        if pid is not None:
+            self.busy[pid] = self.busy.get(pid, 0.) + busy
+        if time.monotonic() - self._persisted >= PERSIST_INTERVAL:
+            self._persisted = time.monotonic()
+            self.persist(self.to_dict())
+
+    def finish(self) -> dict:
+        """
+        Add the run to the statistics, unless there was nothing to do
+        @return: Final progress
+        """
+        if not self.total:
+            return self.to_dict()
+        conn.execute(insert_one(cl_stat, {
+            'stage': self.stage,
+            'count': self.total,
+            'processes': self.processes,
+            'workerSeconds': sum(self.busy.values()),
+            'started': self.started,
+            'finished': datetime.datetime.now(),
+        }))
+        return self.to_dict()
+
+    def to_dict(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            'stage': self.stage,
+            'total': self.total,
+            'done': self.done,
+            'rate': self.rate,
+            'queue': self.queue,
+            'processes': self.processes,
+            # share of time each process was busy
+            'utilization': [busy / elapsed if elapsed > 0 else 0.
+                            for busy in self.busy.values()],
+            'eta': self.eta,
+            'updatedAt': datetime.datetime.now(),
+        }
@@ -2,7 +2,7 @@ import csv
 import io
 import json
 from concurrent.futures._base import Future
-from typing import Union, Iterable, Optional
+from typing import Union, Iterable, Optional, Mapping
 
 import pymongo
 from bson import ObjectId
@@ -12,7 +12,7 @@ from mongomoron import *
 from app import app, logger
 from category import Category
 from classification import call_classify_cells, PatternClassifier, SequenceClassifier
-from db import conn, ds, ds_list, ds_classification
+from db import conn, ds, ds_list, ds_classification, Plan, execute_plan, as_plan, analytics
 from detailization import call_get_details_for_all_cols
 from error_handler import error
 from serializer import serialize
@@ -51,45 +51,63 @@ def create_ds():
     }
 
 
+# read-only endpoints are executed via plans (see `db.Plan`),
+# to be served by the async path as well (see `async_app`)
+
 @app.route('/ls')
 def list_ds():
-    q = query(ds_list).filter(_get_access_clause()).filter(document.status == 'active')
-    _id = request.args.get('id')
+    return execute_plan(list_ds_plan(request.args, session.get('user')))
+
+
+@app.route('/ds/<ds_id>')
+def get_ds(ds_id):
+    return execute_plan(get_ds_plan(ds_id, session.get('user')))
+
+
+@app.route('/ds/<ds_id>/visualize')
+def visualize_ds(ds_id):
+    return execute_plan(visualize_ds_plan(ds_id, request.args, session.get('user')))
+
+
+@app.route('/ds/<ds_id>/filter')
+def filter_ds(ds_id):
+    return execute_plan(filter_ds_plan(ds_id, request.args, session.get('user')))
+
+
+def list_ds_plan(args: Mapping[str, str], user: Optional[dict]) -> Plan:
+    q = query(ds_list).filter(_get_access_clause(user)).filter(document.status == 'active')
+    _id = args.get('id')
     if (_id):
         q.filter(document._id == ObjectId(_id))
 
-    cursor = conn.execute(q)
-    v = request.args.get('-v')
-    f = request.args.get('-f')
+    result = yield q
+    v = args.get('-v')
+    f = args.get('-f')
     if v or f:
-        result = list(cursor)
         for record in result:
             if v:
                 record.setdefault('visualization', Category.get_all_visualization(record))
             if f:
-                record.setdefault('filtering', Category.get_all_filtering(record))
-        return _list_response(result)
+                record.setdefault('filtering', (yield from Category.get_all_filtering(record)))
 
-    return _list_response(cursor)
+    return _list_response(result)
 
 
-@app.route('/ds/<ds_id>')
-def get_ds(ds_id):
-    if not _has_access(ds_id):
+def get_ds_plan(ds_id: str, user: Optional[dict]) -> Plan:
+    if not (yield from _has_access(ds_id, user)):
         return _list_response([])
 
-    return _list_response(conn.execute(query(ds[ds_id])
-                                       .sort((document._id, pymongo.ASCENDING))))
+    return _list_response((yield query(ds[ds_id])
+                           .sort((document._id, pymongo.ASCENDING))))
 
 
-@app.route('/ds/<ds_id>/visualize')
-def visualize_ds(ds_id):
-    if not _has_access(ds_id):
+def visualize_ds_plan(ds_id: str, args: Mapping[str, str], user: Optional[dict]) -> Plan:
+    if not (yield from _has_access(ds_id, user)):
         return _list_response([])
 
     # visualization pipeline (not to be confused with aggregation pipeline).
     # format is defined in the frontend repo.
-    pipeline_str = request.args['pipeline']
+    pipeline_str = args['pipeline']
     pipeline = json.loads(pipeline_str)
     pipeline = [{**item, 'key': item.get('key', 'f%i' % i)} for i, item in enumerate(pipeline)]
 
@@ -120,7 +138,7 @@ def visualize_ds(ds_id):
                 # count them only within the boundaries
                 if item.get('action') == 'accumulate' and \
                         item.get('accumulater') in ['avg', 'median', 'min', 'max']:
-                    boundaries = category.get_boundaries(ds_id, item['col'], item['label'])
+                    boundaries = yield from category.get_boundaries(ds_id, item['col'], item['label'])
                     p.match(and_(document.get_field(item['key']) >= boundaries[0],
                                  document.get_field(item['key']) < boundaries[1]))
         if pipeline0:
@@ -169,7 +187,7 @@ def visualize_ds(ds_id):
                 if not category:
                     raise Exception(f"Reducer can be applied only within known categories: "
                                     f"{Category.__map__.keys()}. Got {repr(item.get('label'))} instead.")
-                ranges = category.get_ranges(ds_id, col, item.get('reducer'))
+                ranges = yield from as_plan(category.get_ranges(ds_id, col, item.get('reducer')))
                 if not ranges:
                     raise Exception(f"No ranges for {field._name}!")
                 lowbond = [range[0] for range, _ in ranges]
@@ -192,25 +210,23 @@ def visualize_ds(ds_id):
         else:
             logger.warn("Action %s not implemented, skip" % action)
 
-    cursor = conn.execute(p)
-    result = list(cursor)
+    result = yield analytics(p)
 
     # todo here I aimed to do post-processing, but not implemented for now
 
     return _list_response(result)
 
 
-@app.route('/ds/<ds_id>/filter')
-def filter_ds(ds_id):
-    if not _has_access(ds_id):
+def filter_ds_plan(ds_id: str, args: Mapping[str, str], user: Optional[dict]) -> Plan:
+    if not (yield from _has_access(ds_id, user)):
         return _list_response([])
 
-    query_str = request.args['query']
+    query_str = args['query']
     query = json.loads(query_str)
 
     # if query is empty, return all rows
     if not query:
-        return get_ds(ds_id)
+        return (yield from get_ds_plan(ds_id, user))
 
     query_labeled = [item for item in query if 'label' in item]
     query_raw = [item for item in query if 'label' not in item]
@@ -277,7 +293,7 @@ def filter_ds(ds_id):
             p.match(expr)
 
     p.sort((document._id, pymongo.ASCENDING));
-    return _list_response(conn.execute(p))
+    return _list_response((yield analytics(p)))
 
 
 @app.route('/ds/<ds_id>/label-values')
@@ -288,7 +304,7 @@ def get_label_values(ds_id):
     @param ds_id:
     @return:
     """
-    if not _has_access(ds_id):
+    if not execute_plan(_has_access(ds_id, session.get('user'))):
         return _list_response([])
 
     col = request.args['col']
@@ -370,13 +386,13 @@ def _list_response(cursor: Iterable):
     }
 
 
-def _get_access_clause() -> Expression:
+def _get_access_clause(user: Optional[dict]) -> Expression:
     clause = ds_list.extra.access.type == 'public'
-    if "user" in session:
-        return or_(clause, ds_list.owner == session["user"]['_id'])
+    if user:
+        return or_(clause, ds_list.owner == user['_id'])
     return clause
 
 
-def _has_access(ds_id: Union[ObjectId, str]) -> bool:
-    q = query_one(ds_list).filter(and_(ds_list._id == ObjectId(ds_id), _get_access_clause()))
-    return conn.execute(q) is not None
+def _has_access(ds_id: Union[ObjectId, str], user: Optional[dict]) -> Plan:
+    q = query_one(ds_list).filter(and_(ds_list._id == ObjectId(ds_id), _get_access_clause(user)))
+    return (yield q) is not None
@@ -1,22 +1,149 @@
-from typing import Union
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Union, Optional, Any, Tuple
 
 from bson import ObjectId
 from flask.sessions import SessionMixin, SessionInterface
-from mongomoron import query_one, update_one, insert_one
+from mongomoron import query_one, update_one, insert_one, delete, and_, or_
 
 import db
-from db import conn, app_user_session
+import metrics
+from db import conn, app_user_session, Plan, execute_plan
+
+# sessions not seen for this time are deleted (by the TTL index)
+SESSION_TTL = datetime.timedelta(days=30)
+# anonymous sessions not seen for this time are deleted by the compaction,
+# most of them are of the visitors who never come back
+ANONYMOUS_SESSION_TTL = datetime.timedelta(days=1)
+# `lastSeen` of the session is updated not more often than this
+SESSION_TOUCH_INTERVAL = datetime.timedelta(hours=1)
+
+
+# changes of sessions which invalidate them in caches of other processes;
+# `lastSeen` updates don't
+SESSION_CHANGE_PIPELINE = [{'$match': {'$or': [
+    {'operationType': {'$nin': ['insert', 'update']}},
+    {'updateDescription.updatedFields.user_id': {'$exists': True}},
+]}}]
+
+
+class SessionCache(object):
+    """
+    In-process cache of session id -> user, so requests of the
+    known sessions don't go to the DB. Entries are updated on
+    save of the session (e.g. on login/logout) in this process,
+    invalidated by the change stream of the sessions on login/logout
+    in other processes (see `watch`), and expire in `ttl` seconds.
+    Sessions are only cached while the change stream is watched in this
+    process, otherwise a login or logout in another process would be missed
+    """
+    MISSING = object()
+    # seconds to wait before re-opening the failed change stream
+    retry_interval = 10
+
+    def __init__(self, ttl: float = 60, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: OrderedDict[ObjectId, Tuple[float, Optional[dict],
+                                                 Optional[datetime.datetime]]] = OrderedDict()
+        self._lock = threading.Lock()
+        # pid of the process which the change stream is watched in,
+        # threads don't survive fork
+        self._watching_pid = None
+
+    def get(self, _id: ObjectId) -> Any:
+        """
+        Get user of the session
+        @param _id: Session id
+        @return: Tuple user (None for the anonymous session),
+        time the session was last seen in the DB; or `MISSING`
+        """
+        with self._lock:
+            item = self._items.get(_id)
+            if not item:
+                metrics.cache_requests.inc('session', 'miss')
+                return SessionCache.MISSING
+            expires_at, user, last_seen = item
+            if expires_at < time.monotonic() or not self.watching:
+                del self._items[_id]
+                metrics.cache_requests.inc('session', 'miss')
+                return SessionCache.MISSING
+            metrics.cache_requests.inc('session', 'hit')
+            return user, last_seen
+
+    def put(self, _id: ObjectId, user: Optional[dict],
+            last_seen: Optional[datetime.datetime]):
+        with self._lock:
+            if not self.watching:
+                self._items.pop(_id, None)
+                return
+            self._items[_id] = (time.monotonic() + self.ttl, user, last_seen)
+            self._items.move_to_end(_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, _id: ObjectId):
+        with self._lock:
+            self._items.pop(_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    @property
+    def watching(self) -> bool:
+        return self._watching_pid == os.getpid()
+
+    def watch(self) -> threading.Thread:
+        """
+        Start watching logins/logouts (changes of `user_id`) and deletions
+        of sessions in background, to invalidate them in this process
+        """
+        from app import logger
+
+        def _watch():
+            while True:
+                try:
+                    with conn.db()[app_user_session._name].watch(SESSION_CHANGE_PIPELINE) as stream:
+                        self._watching_pid = os.getpid()
+                        # changes made before the stream is opened
+                        self.clear()
+                        for change in stream:
+                            self._apply_change(change)
+                except Exception as e:
+                    logger.warn('Change stream of %s failed: %s', app_user_session._name, e)
+                finally:
+                    self._watching_pid = None
+                time.sleep(self.retry_interval)
+
+        thread = threading.Thread(target=_watch, name='session-watch', daemon=True)
+        thread.start()
+        return thread
+
+    def _apply_change(self, change: dict):
+        if 'documentKey' in change:
+            self.invalidate(change['documentKey']['_id'])
+        else:
+            # something happened to the collection, such as drop
+            self.clear()
+
+
+session_cache = SessionCache()
 
 
 class UserSession(dict, SessionMixin):
-    def __init__(self, session_record: dict = None):
+    def __init__(self, _id: Optional[ObjectId] = None, user: Optional[dict] = None):
         super().__init__()
-        self._modified = False
-        if session_record:
-            self['id'] = session_record['_id']
-            user = conn.execute(query_one(db.app_user).filter(db.app_user._id == session_record['user_id']))
+        if _id:
+            self['id'] = _id
             if user:
-                self['user'] = user
+                # the cached one is shared between requests
+                self['user'] = dict(user)
+        # loaded session isn't modified until changed
+        self._modified = False
 
     def __setitem__(self, key, value):
         super().__setitem__(key, value)
@@ -28,23 +155,54 @@ class UserSession(dict, SessionMixin):
 
     @staticmethod
     def load(_id: Union[str, ObjectId]) -> 'UserSession':
+        return execute_plan(UserSession.load_plan(_id))
+
+    @staticmethod
+    def load_plan(_id: Union[str, ObjectId]) -> Plan:
+        """
+        Plan of `load`, to load the session by the async path as well
+        """
         if _id:
-            session_record = conn.execute(
-                query_one(app_user_session).filter(app_user_session._id == _id)
-            )
-            if session_record:
-                return UserSession(session_record)
+            cached = session_cache.get(_id)
+            if cached is not SessionCache.MISSING:
+                user, last_seen = cached
+            else:
+                session_record = yield query_one(app_user_session).filter(app_user_session._id == _id)
+                if not session_record:
+                    return UserSession()
+                user = None
+                if session_record.get('user_id'):
+                    user = yield query_one(db.app_user).filter(
+                        db.app_user._id == session_record['user_id'])
+                last_seen = session_record.get('lastSeen')
+                session_cache.put(_id, user, last_seen)
+
+            now = datetime.datetime.utcnow()
+            if not last_seen or now - last_seen > SESSION_TOUCH_INTERVAL:
+                # prolong the session, as it's just seen
+                yield update_one(app_user_session).filter(app_user_session._id == _id) \
+                    .set(UserSession._get_lifetime(now))
+                session_cache.put(_id, user, now)
+            return UserSession(_id, user)
 
         return UserSession()
 
+    @staticmethod
+    def _get_lifetime(now: datetime.datetime) -> dict:
+        return {'lastSeen': now, 'expiresAt': now + SESSION_TTL}
+
     def save(self):
         _id = self.get('id')
         user = self.get('user')
         user_id = user.get('_id') if user else None
+        now = datetime.datetime.utcnow()
         if _id:
-            conn.execute(update_one(app_user_session).filter(app_user_session._id == _id).set({'user_id': user_id}))
+            conn.execute(update_one(app_user_session).filter(app_user_session._id == _id)
+                         .set({'user_id': user_id, **self._get_lifetime(now)}))
         else:
-            self['id'] = conn.execute(insert_one(app_user_session, {'user_id': user_id})).inserted_id
+            _id = self['id'] = conn.execute(insert_one(
+                app_user_session, {'user_id': user_id, **self._get_lifetime(now)})).inserted_id
+        session_cache.put(_id, dict(user) if user else None, now)
         self._modified = False
 
     @property
@@ -52,22 +210,68 @@ class UserSession(dict, SessionMixin):
         return self._modified
 
 
+def parse_session_id(session_id: Optional[str]) -> Optional[ObjectId]:
+    """
+    Session id by the value of the session cookie
+    """
+    if not session_id:
+        # no cookie, not ObjectId() which is a new id
+        return None
+    try:
+        return ObjectId(session_id)
+    except:
+        # session_id in wrong format
+        return None
+
+
 class UserSessionInterface(SessionInterface):
     def open_session(self, app, request):
         if request.path.startswith(app.static_url_path):
             return UserSession()
 
-        session_id = request.cookies.get(app.session_cookie_name)
-
-        try:
-            _id = ObjectId(session_id)
-        except:
-            # session_id in wrong format
-            _id = None
-
-        return UserSession.load(_id)
+        return UserSession.load(parse_session_id(
+            request.cookies.get(app.session_cookie_name)))
 
     def save_session(self, app, session: UserSession, response):
         if session.modified:
             session.save()
             response.set_cookie(app.session_cookie_name, str(session['id']))
+
+
+def compact_sessions() -> int:
+    """
+    Delete anonymous sessions not seen for `ANONYMOUS_SESSION_TTL`, or
+    which the TTL index can't expire, as they don't have `expiresAt`.
+    Sessions of logged-in users without `expiresAt` are kept, they get
+    it by the migration (m0008), even if compaction runs before it
+    @return: Count of deleted sessions
+    """
+    now = datetime.datetime.utcnow()
+    # `filter` of the delete builder doesn't return the builder
+    d = delete(app_user_session)
+    d.filter(and_(
+        app_user_session.user_id == None,
+        or_(app_user_session.lastSeen < now - ANONYMOUS_SESSION_TTL,
+            app_user_session.expiresAt.not_exists()),
+    ))
+    return conn.execute(d).deleted_count
+
+
+def start_session_compaction(interval: float = 3600) -> threading.Thread:
+    """
+    Start compaction of sessions in background, every `interval` seconds
+    """
+    from app import logger
+
+    def _compact():
+        while True:
+            time.sleep(interval)
+            try:
+                count = compact_sessions()
+                logger.info('Session compaction: %d sessions deleted', count)
+            except Exception as e:
+                logger.warn('Session compaction failed: %s', e)
+
+    thread = threading.Thread(target=_compact, name='session-compaction', daemon=True)
+    thread.start()
+    return thread
@@ -1,15 +1,33 @@
-from typing import List, Any, Optional, Dict
+import hashlib
+import json
+import threading
+from typing import List, Any, Optional, Set, Tuple, FrozenSet
 
 import pyjsparser
 import pymongo
-from flask import request, make_response
+from flask import request
 from mongomoron import query_one, document, update_one, query
 
 from app import app
+from cached_resource import CachedResource
 from db import conn, wc_script_template
 from error_handler import error
 
 
+def _build_script_template_list() -> str:
+    cursor = conn.execute(query(wc_script_template)) \
+        .sort([('readonly', pymongo.DESCENDING), ('_id', pymongo.ASCENDING)])
+    return '[' + ','.join([record['data'] for record in cursor]) + ']'
+
+
+# templates are only changed by `create_script_template`, which invalidates
+# the list; TTL bounds staleness in other worker processes
+script_template_list = CachedResource(_build_script_template_list, ttl=60,
+                                      mimetype='text/plain',
+                                      serialize=lambda data: data,
+                                      strong_etag=True)
+
+
 @app.route('/wc/template', methods=['PUT'])
 def create_script_template():
     content_type = request.headers.get('Content-Type')
@@ -31,23 +49,27 @@ def create_script_template():
     conn.execute(update_one(wc_script_template, upsert=True)
                  .filter(document._id == script_template_name)
                  .set({'data': script_template_data, 'readonly': False}))
+    script_template_list.invalidate()
 
     return {"success": True}
 
 
 @app.route('/wc/template', methods=['GET'])
 def list_script_template():
-    cursor = conn.execute(query(wc_script_template)) \
-        .sort([('readonly', pymongo.DESCENDING), ('_id', pymongo.ASCENDING)])
-    data = '[' + ','.join([record['data'] for record in cursor]) + ']'
-    response = make_response()
-    response.stream.write(bytearray(data, 'utf-8'))
-    response.headers.set('content-type', 'text/plain; charset=utf-8')
-    return response
+    return script_template_list.response()
 
 
 class _Sanitizer(object):
-    _function_body_map: Optional[Dict[str, List[Any]]] = None
+    # templates are a few KB, larger uploads aren't parsed at all
+    MAX_SCRIPT_TEMPLATE_SIZE = 256 * 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # digests of data of the readonly templates the fingerprints are
+        # built of, to rebuild them whenever the templates change
+        self._template_digests: Optional[FrozenSet[str]] = None
+        # fingerprints of allowed function bodies, (function name, body hash)
+        self._function_body_fingerprints: Set[Tuple[str, str]] = set()
 
     def sanitize_script_template(self, script_template_data: str):
         """
@@ -63,38 +85,52 @@ class _Sanitizer(object):
         @param script_template_data: Script template as a string (JS object)
         @return: None; if check fails, throw an Exception
         """
-        tree = pyjsparser.parse("var a = " + script_template_data)
-        assert len(tree["body"]) == 1
-        assert len(tree["body"][0]["declarations"]) == 1
-        script_template_properties = tree["body"][0]["declarations"][0]["init"]["properties"]
-        for property in script_template_properties:
-            prop_name = property["key"]["value"]
-            prop_type = property["value"]["type"]
+        if len(script_template_data) > self.MAX_SCRIPT_TEMPLATE_SIZE:
+            raise Exception('Script template is too large')
+        allowed_function_bodies = self._get_allowed_function_bodies()
+        for prop_name, prop_value in self._get_properties(script_template_data):
+            prop_type = prop_value["type"]
             if prop_type == "FunctionExpression":
-                function_body = property["value"]["body"]
-                assert function_body in self._get_allowed_function_bodies(prop_name)
+                function_body = prop_value["body"]
+                assert (prop_name, self._fingerprint(function_body)) in allowed_function_bodies
             elif prop_type == "Literal":
-                prop_value = property["value"]["value"]
-                assert isinstance(prop_value, str)
+                assert isinstance(prop_value["value"], str)
             else:
                 assert False
 
-    def _get_allowed_function_bodies(self, function_name: str) -> List[Any]:
-        if self._function_body_map is None:
-            self._function_body_map = {}
-            for script_template in conn.execute(
-                    query(wc_script_template).filter(document.readonly == True)):
-                data = script_template['data']
-                tree = pyjsparser.parse('var a = ' + data)
-                script_template_properties = tree["body"][0]["declarations"][0]["init"]["properties"]
-                for property in script_template_properties:
-                    prop_name = property["key"]["value"]
-                    prop_type = property["value"]["type"]
-                    if prop_type == "FunctionExpression":
-                        function_body = property["value"]["body"]
-                        self._function_body_map.setdefault(prop_name, [])
-                        self._function_body_map[prop_name].append(function_body)
-        return self._function_body_map.get(function_name, [])
+    def _get_allowed_function_bodies(self) -> Set[Tuple[str, str]]:
+        # readonly templates are few and small, reading them is cheap,
+        # unlike parsing; they're only re-parsed if changed, e.g. by a migration
+        template_data_list = [script_template['data'] for script_template in conn.execute(
+            query(wc_script_template).filter(document.readonly == True))]
+        template_digests = frozenset(hashlib.sha1(data.encode()).hexdigest()
+                                     for data in template_data_list)
+        with self.lock:
+            if template_digests != self._template_digests:
+                fingerprints = set()
+                for data in template_data_list:
+                    for prop_name, prop_value in self._get_properties(data):
+                        if prop_value["type"] == "FunctionExpression":
+                            fingerprints.add((prop_name, self._fingerprint(prop_value["body"])))
+                self._function_body_fingerprints = fingerprints
+                self._template_digests = template_digests
+            return self._function_body_fingerprints
+
+    @staticmethod
+    def _get_properties(script_template_data: str) -> List[Tuple[str, dict]]:
+        tree = pyjsparser.parse("var a = " + script_template_data)
+        assert len(tree["body"]) == 1
+        assert len(tree["body"][0]["declarations"]) == 1
+        return [(property["key"]["value"], property["value"])
+                for property in tree["body"][0]["declarations"][0]["init"]["properties"]]
+
+    @staticmethod
+    def _fingerprint(node: Any) -> str:
+        """
+        Structural hash of AST node, equal for equal nodes
+        """
+        return hashlib.sha256(json.dumps(node, sort_keys=True, separators=(',', ':'))
+                              .encode()).hexdigest()
 
 
 sanitizer = _Sanitizer()
@@ -0,0 +1,128 @@
+"""
+Multi-worker serving: the application state (singletons, models)
+is loaded once in the master process, then worker processes are forked,
+sharing the loaded state copy-on-write, and serving the same socket.
+The master only supervises the workers, restarting ones which died.
+"""
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional
+
+import uvicorn
+
+import async_processing
+from app import logger
+from classification import AbstractClassifier
+from db import conn
+from detailization import AbstractDetailizer
+
+# index of the current worker, from 0, None in the master
+worker_index: Optional[int] = None
+
+
+def preload():
+    """
+    Load all classifiers' and detailizers' models, so that
+    workers forked after that share them instead of each loading its own
+    """
+    for cls in [*AbstractClassifier.__map__.values(), *AbstractDetailizer.__map__.values()]:
+        try:
+            cls.get().preload()
+        except Exception as e:
+            # e.g. a model isn't learned yet, the worker
+            # will try to load it on demand
+            logger.warning('%s is not preloaded: %s', cls.__name__, e)
+
+    # nothing loaded so far will be freed, exclude it from GC, so that
+    # collections in the workers don't touch (and so copy) shared pages
+    gc.collect()
+    gc.freeze()
+
+
+def serve(asgi_app: Callable, workers: int, host: str, port: int,
+          on_worker_start: Callable[[int], None], **kwargs):
+    """
+    Serve the app by `workers` processes
+    @param asgi_app: ASGI app
+    @param workers: Count of worker processes; if 1, the app is served
+    in the current process
+    @param host: Host to bind
+    @param port: Port to bind
+    @param on_worker_start: Called in each worker with its index before
+    serving, e.g. to start background jobs. Jobs which must run once
+    should only be started by the worker 0, it's restarted with the same
+    index if dies
+    @param kwargs: Passed to `uvicorn.Config`
+    """
+    if workers <= 1:
+        _run_worker(0, workers, asgi_app, on_worker_start, None, host=host, port=port, **kwargs)
+        return
+
+    preload()
+    # clients have their own threads, which mustn't exist at fork
+    conn.close()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+
+    pids: Dict[int, int] = {}
+    started: Dict[int, float] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _run_worker(index, workers, asgi_app, on_worker_start, sock, **kwargs)
+            finally:
+                os._exit(0)
+        pids[pid] = index
+        started[index] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info('Master %d is serving by %d workers on %s:%d', os.getpid(), workers, host, port)
+    for index in range(workers):
+        spawn(index)
+
+    while pids:
+        pid, status = os.wait()
+        index = pids.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning('Worker %d (%d) exited with status %d, restarting...',
+                       index, pid, os.waitstatus_to_exitcode(status))
+        # don't restart in a tight loop a worker failing on start
+        if time.monotonic() - started[index] < 1:
+            time.sleep(1)
+        spawn(index)
+
+    sock.close()
+
+
+def _run_worker(index: int, workers: int, asgi_app: Callable,
+                on_worker_start: Callable[[int], None],
+                sock: Optional[socket.socket], **kwargs):
+    global worker_index
+    worker_index = index
+    # parallel processing of background jobs shouldn't
+    # oversubscribe CPUs, all the workers can run jobs at once
+    async_processing.MAX_PROCESS_COUNT = max(1, (os.cpu_count() or 1) // workers)
+
+    on_worker_start(index)
+    server = uvicorn.Server(uvicorn.Config(asgi_app, **kwargs))
+    server.run(sockets=[sock] if sock else None)
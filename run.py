@@ -1,5 +1,27 @@
-import uvicorn
+import os
 
 import app
+import workers
+from config import config
+from user_session import start_session_compaction, session_cache
 
-uvicorn.run(app.asgi_app, log_config=None, forwarded_allow_ips='*', host='0.0.0.0')
+# read-heavy endpoints are served by the native async path,
+# unless ASYNC_ENDPOINTS=0 (e.g. to compare, see scripts/load_test.py)
+if os.environ.get('ASYNC_ENDPOINTS', '1') != '0':
+    from async_app import async_app as asgi_app
+else:
+    asgi_app = app.asgi_app
+
+
+def on_worker_start(index: int):
+    config.watch()
+    session_cache.watch()
+    # jobs which must run once are owned by the worker 0
+    if index == 0:
+        start_session_compaction()
+
+
+# WORKERS > 1 forks worker processes after loading the models, see `workers`
+workers.serve(asgi_app, workers=int(os.environ.get('WORKERS', '1')),
+              host='0.0.0.0', port=8000, on_worker_start=on_worker_start,
+              log_config=None, forwarded_allow_ips='*')
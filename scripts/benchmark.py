@@ -0,0 +1,320 @@
+"""
+Benchmarks of the hot spots of classification and detailization,
+on synthetic data, so they can be run without a populated DB.
+
+Usage: python -m scripts.benchmark <benchmark> [--size N] [--seed S]
+"""
+import json
+import random
+import re
+import string
+import time
+from argparse import ArgumentParser
+from typing import List, Tuple, Callable, Any, Dict
+
+import app.classification as classification
+from classification.pattern_classifier import PatternClassifier, Pattern, \
+    SampleCount, Char
+from collections_helper import canonical
+from detailization.sequence_detailizer import SequenceDetailizer, CharType
+
+
+def timeit(fn: Callable, *args, **kwargs) -> Tuple[Any, float]:
+    t = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t
+
+
+def make_cells(size: int, rnd: random.Random) -> List[Tuple[str, str]]:
+    """
+    Make a synthetic corpus of labelled cells looking like ones in `dl_master`
+    @param size: Number of cells
+    @param rnd: Random generator
+    @return: List of tuples text, label
+    """
+
+    def word(lo=3, hi=10):
+        return ''.join(rnd.choice(string.ascii_lowercase)
+                       for _ in range(rnd.randint(lo, hi))).capitalize()
+
+    def number():
+        n = rnd.choice([rnd.randint(0, 100), rnd.randint(0, 100000),
+                        rnd.random() * 1000])
+        return rnd.choice(['{:,}', '{}', '-{}', '{}k'])\
+            .format(round(n, 2) if isinstance(n, float) else n)
+
+    def date():
+        return rnd.choice(['%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%d %b %Y',
+                           '%b %d, %Y %I:%M %p', '%m/%d/%y']) \
+            .replace('%d', '%02d' % rnd.randint(1, 28)) \
+            .replace('%m', '%02d' % rnd.randint(1, 12)) \
+            .replace('%Y', str(rnd.randint(1950, 2030))) \
+            .replace('%y', '%02d' % rnd.randint(0, 99)) \
+            .replace('%H', '%02d' % rnd.randint(0, 23)) \
+            .replace('%I', '%02d' % rnd.randint(1, 12)) \
+            .replace('%M', '%02d' % rnd.randint(0, 59)) \
+            .replace('%S', '%02d' % rnd.randint(0, 59)) \
+            .replace('%b', rnd.choice(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']))\
+            .replace('%p', rnd.choice(['AM', 'PM']))
+
+    def money():
+        return rnd.choice(['${}', '{} USD', '€{}', '{} руб.', 'GBP {}']) \
+            .format('{:,.2f}'.format(rnd.random() * 10000))
+
+    generators = [
+        (lambda: word(), 'city'),
+        (lambda: '%s, %s' % (word(), word(2, 2).upper()), 'city'),
+        (lambda: word(4, 12), 'country'),
+        (number, 'number'),
+        (date, 'timestamp'),
+        (money, 'money'),
+        (lambda: ' '.join(word().lower() for _ in range(rnd.randint(2, 8))),
+         'phrase'),
+        (lambda: ''.join(rnd.choice(string.printable)
+                         for _ in range(rnd.randint(1, 20))), 'trash'),
+    ]
+    cells = []
+    for _ in range(size):
+        generator, label = rnd.choice(generators)
+        cells.append((generator(), label))
+    return cells
+
+
+def make_clusters_reference(pattern_elements, likelihood):
+    """
+    The original clustering loop of `PatternClassifier.learn`, which
+    re-calculates coupling of every candidate cluster from scratch.
+    Pattern elements are kept in a list rather than a set, so of elements
+    with equal coupling `max` takes the first one, like `_make_clusters`
+    """
+    pattern_elements = list(pattern_elements)
+
+    def coupling(cluster):
+        return sum((likelihood.get((a, b), 0))
+                   for a in cluster for b in cluster) / \
+            len(cluster)
+
+    clusters = []
+    cluster = set()
+    cluster_coupling = 0
+    while len(pattern_elements):
+        pattern_element_with_max_coupling = \
+            max(pattern_elements,
+                key=lambda pattern_element: coupling(
+                    cluster.union({pattern_element})))
+        if coupling(cluster.union(
+                pattern_element_with_max_coupling)) >= cluster_coupling:
+            cluster.add(pattern_element_with_max_coupling)
+            cluster_coupling = coupling(cluster)
+            pattern_elements.remove(pattern_element_with_max_coupling)
+        else:
+            clusters.append(cluster)
+            cluster = set()
+            cluster_coupling = 0
+    if cluster:
+        clusters.append(cluster)
+    return clusters
+
+
+def benchmark_pattern_clusters(size: int, rnd: random.Random):
+    """
+    Build all levels of patterns as `PatternClassifier.learn` does (without
+    the DB), clustering each level by both `_make_clusters`
+    and the reference implementation
+    """
+    patterns: Dict[Pattern, SampleCount] = dict()
+    for text, label in make_cells(size, rnd):
+        pattern = Pattern(level=0, sequence=text)
+        patterns.setdefault(pattern, SampleCount())
+        patterns[pattern].add_label(label)
+
+    level = 0
+    total, total_reference = 0., 0.
+    while True:
+        pattern_elements, likelihood = PatternClassifier._get_likelihood(patterns)
+        clusters, t = timeit(PatternClassifier._make_clusters,
+                             pattern_elements, likelihood)
+        clusters_reference, t_reference = timeit(make_clusters_reference,
+                                                 pattern_elements, likelihood)
+        total += t
+        total_reference += t_reference
+        print(f'level {level}: {len(patterns)} patterns, '
+              f'{len(pattern_elements)} elements -> {len(clusters)} clusters; '
+              f'{t:.3f}s vs {t_reference:.3f}s reference')
+        assert set(map(frozenset, clusters)) == \
+               set(map(frozenset, clusters_reference)), \
+            f'Clusters of level {level} differ from the reference ones'
+
+        level += 1
+        if not (len(clusters) < len(pattern_elements)):
+            break
+        pattern_element_to_char = dict()
+        for cluster in clusters:
+            char = Char(level=level, cluster=cluster)
+            for pattern_element in cluster:
+                pattern_element_to_char[pattern_element] = char
+        next_patterns: Dict[Pattern, SampleCount] = dict()
+        for pattern, sample_count in patterns.items():
+            pattern = Pattern(level=level,
+                              sequence=[pattern_element_to_char[pattern_element]
+                                        for pattern_element in pattern.get_pattern()])
+            next_patterns.setdefault(pattern, SampleCount())
+            next_patterns[pattern].merge(sample_count)
+        patterns = next_patterns
+
+    print(f'total: {total:.3f}s vs {total_reference:.3f}s reference '
+          f'({total_reference / total:.1f}x), clusters are identical')
+
+
+def split_reference(s: str) -> List[str]:
+    """
+    Previous implementation of `SequenceDetailizer.split`,
+    char by char with a few `re.match` per char
+    """
+
+    def get_char_type(c: str) -> int:
+        if re.match(r'\d', c):
+            return CharType.DIGIT
+        elif re.match(r'\w', c):
+            return CharType.WORD
+        elif re.match(r'\s', c):
+            return CharType.WHITESPACE
+        else:
+            return CharType.PUNCTUATION
+
+    token_type: int = 0
+    token: str = ''
+    token_list = []
+    for c in s:
+        c_type = get_char_type(c)
+        if token_type == c_type:
+            token += c
+        else:
+            if token:
+                token_list.append(token)
+            token_type = c_type
+            token = c
+    if token:
+        token_list.append(token)
+    return token_list
+
+
+def benchmark_tokenize(size: int, rnd: random.Random):
+    """
+    Split synthetic cells to tokens by `SequenceDetailizer.split`
+    and by the reference implementation
+    """
+    cells = [text for text, _ in make_cells(size, rnd)]
+    # split doesn't need labels from the DB, so skip __init__
+    detailizer = SequenceDetailizer.__new__(SequenceDetailizer)
+
+    tokens, t = timeit(lambda: [detailizer.split(s) for s in cells])
+    tokens_reference, t_reference = timeit(lambda: [split_reference(s) for s in cells])
+    if tokens != tokens_reference:
+        raise Exception('Tokens differ from the reference ones')
+    print(f'{len(cells)} cells, {sum(len(s) for s in cells)} chars: '
+          f'{t:.3f}s vs {t_reference:.3f}s reference '
+          f'({t_reference / t:.1f}x), tokens are identical')
+
+
+def get_features_reference(detailizer: SequenceDetailizer,
+                           tokens: List[str]) -> List[List[str]]:
+    """
+    Previous implementation of `SequenceDetailizer._get_features`,
+    which copies dicts of the neighbours into dict of each token
+    """
+    ff = [{
+        'token': token,
+        'chartype': detailizer._get_char_type(token),
+        'token_normal': detailizer._normalize(token),
+        'token_len': len(token),
+    } for token in tokens]
+    for i, f in enumerate(ff[1:]):
+        f.update(dict((f'{k}[-1]', v) for k, v in ff[i - 1].items()))
+    for i, f in enumerate(ff[2:]):
+        f.update(dict((f'{k}[-2]', v) for k, v in ff[i - 2].items()))
+    for i, f in enumerate(ff[:-1]):
+        f.update(dict((f'{k}[1]', v) for k, v in ff[i + 1].items()))
+    for i, f in enumerate(ff[:-2]):
+        f.update(dict((f'{k}[2]', v) for k, v in ff[i + 2].items()))
+    return [[f'{k}={v}' for k, v in f.items()] for f in ff]
+
+
+def benchmark_crf_features(size: int, rnd: random.Random):
+    """
+    Get CRF features of tokens of synthetic cells
+    by `SequenceDetailizer._get_features` and by the reference implementation
+    """
+    # features don't need labels from the DB, so skip __init__
+    detailizer = SequenceDetailizer.__new__(SequenceDetailizer)
+    cells = [detailizer.split(text) for text, _ in make_cells(size, rnd)]
+    n = sum(len(tokens) for tokens in cells)
+
+    def run(fn):
+        for tokens in cells:
+            fn(tokens)
+
+    # features of the tokens are cached, so the first pass is slower
+    _, t_first = timeit(run, detailizer._get_features)
+    _, t = timeit(run, detailizer._get_features)
+    _, t_reference = timeit(run, lambda tokens: get_features_reference(detailizer, tokens))
+    for tokens in cells:
+        if detailizer._get_features(tokens) != get_features_reference(detailizer, tokens):
+            raise Exception(f'Features of {tokens} differ from the reference ones')
+    print(f'{len(cells)} cells, {n} tokens: '
+          f'{t / n * 1e6:.1f}us ({t_first / n * 1e6:.1f}us first pass) '
+          f'vs {t_reference / n * 1e6:.1f}us reference per token '
+          f'({t_reference / t:.1f}x), features are identical')
+
+
+def benchmark_label_hashing(size: int, rnd: random.Random):
+    """
+    Compare sets of labels of session and master samples as `merge` does,
+    by `canonical` keys and by the reference json.dumps keys
+    """
+
+    def label():
+        kind = rnd.randrange(3)
+        if kind == 0:
+            return rnd.choice(['city', 'country', 'number', 'money', 'phrase'])
+        elif kind == 1:
+            items = [('city_id', str(rnd.randrange(100))), ('country_id', rnd.choice(['RU', 'FR']))]
+            rnd.shuffle(items)
+            return dict(items)
+        else:
+            return [{'token': t, 'label': rnd.choice(['word', 'number'])}
+                    for t in rnd.choice(['a b', '1 a', 'c']).split()]
+
+    pairs = [([label() for _ in range(rnd.randint(1, 2))],
+              [label() for _ in range(rnd.randint(1, 2))]) for _ in range(size)]
+
+    def run(key):
+        return sum(dict((key(l), l) for l in a).keys() == dict((key(l), l) for l in b).keys()
+                   for a, b in pairs)
+
+    _, t = timeit(run, canonical)
+    _, t_reference = timeit(run, json.dumps)
+    distinct = len(set(canonical(l) for a, b in pairs for l in a + b))
+    distinct_reference = len(set(json.dumps(l) for a, b in pairs for l in a + b))
+    print(f'{size} pairs of label sets: {t:.3f}s vs {t_reference:.3f}s reference '
+          f'({t_reference / t:.1f}x); {distinct} distinct labels vs {distinct_reference} '
+          f'by the reference, which depends on order of keys')
+
+
+benchmarks = {
+    'pattern-clusters': benchmark_pattern_clusters,
+    'tokenize': benchmark_tokenize,
+    'crf-features': benchmark_crf_features,
+    'label-hashing': benchmark_label_hashing,
+}
+
+if __name__ == '__main__':
+    argparser = ArgumentParser()
+    argparser.add_argument('benchmark', help='One of %s' % list(benchmarks.keys()))
+    argparser.add_argument('--size', help='Number of synthetic cells',
+                           type=int, default=2000)
+    argparser.add_argument('--seed', help='Random seed', type=int, default=0)
+
+    args = argparser.parse_args()
+
+    benchmarks[args.benchmark](args.size, random.Random(args.seed))
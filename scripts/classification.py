@@ -4,7 +4,7 @@ from argparse import ArgumentParser
 
 import app.classification as classification
 from classification import classify_cells, AbstractClassifier
-from db import conn, dl_master
+from db import conn, dl_master, dl_session
 from mongomoron import query
 
 from detailization import call_get_details_for_all_cols
@@ -21,11 +21,22 @@ if __name__ == '__main__':
                                                  'after classification finished, '
                                                  'in fact, simulate the processing '
                                                  'of the uploaded DS', action='store_true')
+    argparser.add_argument('--session', help='Labelling session ID, to learn '
+                                             'incrementally from its labelled samples '
+                                             'only, instead of re-learning from scratch')
 
     args = argparser.parse_args()
 
     classifier = AbstractClassifier.get(args.classifier)
     if args.action == 'l':
+        if args.session:
+            session_collection = dl_session[args.session]
+            classifier.learn([(record['text'], record['labels'][0])
+                              for record in conn.execute(
+                                  query(session_collection).filter(
+                                      session_collection.labels != None))],
+                             incremental=True)
+            exit(0)
         classifier.learn([(record['text'], record['labels'][0])
                           for record in conn.execute(query(dl_master))])
     elif args.action == 'c':
@@ -0,0 +1,90 @@
+"""
+Load test of the read-heavy endpoints, to compare serving modes, e.g.
+the native async path and the Flask app in threads:
+
+    ASYNC_ENDPOINTS=1 python run.py  # or 0, in another terminal
+    python -m scripts.load_test --url http://127.0.0.1:8000 --ds <DS id>
+
+For each endpoint, prints throughput and latency percentiles.
+"""
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from typing import List, Tuple, Dict
+
+import aiohttp
+
+
+def get_requests(ds_id: str, col: str) -> List[Tuple[str, Dict[str, str]]]:
+    requests = [('/ls', {}), ('/user/whoami', {})]
+    if ds_id:
+        requests += [
+            (f'/ds/{ds_id}', {}),
+            (f'/ds/{ds_id}/filter', {'query': '[]'}),
+        ]
+        if col:
+            requests.append((f'/ds/{ds_id}/visualize', {'pipeline': json.dumps([
+                {'col': col, 'action': 'group'},
+                {'action': 'accumulate', 'accumulater': 'count'},
+            ])}))
+    return requests
+
+
+async def run_endpoint(session: aiohttp.ClientSession, url: str, params: Dict[str, str],
+                       concurrency: int, duration: float) -> Tuple[List[float], int]:
+    """
+    Request the endpoint by `concurrency` clients for `duration` seconds
+    @return: Tuple latencies of successful requests, count of failed ones
+    """
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            try:
+                async with session.get(url, params=params) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors
+
+
+async def main(args):
+    async with aiohttp.ClientSession() as session:
+        for path, params in get_requests(args.ds, args.col):
+            latencies, errors = await run_endpoint(session, args.url + path, params,
+                                                   args.concurrency, args.duration)
+            latencies.sort()
+
+            def percentile(p):
+                return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 \
+                    if latencies else float('nan')
+
+            print(f'{path}: {len(latencies) / args.duration:.1f} req/s, '
+                  f'p50 {percentile(.5):.1f}ms, p95 {percentile(.95):.1f}ms, '
+                  f'p99 {percentile(.99):.1f}ms, {errors} errors')
+
+
+if __name__ == '__main__':
+    argparser = ArgumentParser()
+    argparser.add_argument('--url', help='Base URL of the server',
+                           default='http://127.0.0.1:8000')
+    argparser.add_argument('--ds', help='DS id to request /ds/<id>/... endpoints')
+    argparser.add_argument('--col', help='Column of the DS to visualize')
+    argparser.add_argument('--concurrency', help='Count of concurrent clients',
+                           type=int, default=50)
+    argparser.add_argument('--duration', help='Seconds to load each endpoint',
+                           type=float, default=10)
+
+    asyncio.run(main(argparser.parse_args()))
@@ -0,0 +1,24 @@
+import datetime
+
+import pymongo
+from pymongo.database import Database
+
+from user_session import SESSION_TTL
+
+
+def upgrade(db: Database):
+    now = datetime.datetime.utcnow()
+    db.app_user_session.update_many({'expiresAt': {'$exists': False}},
+                                    {'$set': {'lastSeen': now,
+                                              'expiresAt': now + SESSION_TTL}})
+    db.app_user_session.create_index([('expiresAt', pymongo.ASCENDING)],
+                                     expireAfterSeconds=0)
+    db.app_user_session.create_index([('user_id', pymongo.ASCENDING),
+                                      ('lastSeen', pymongo.ASCENDING)])
+
+
+def downgrade(db: Database):
+    db.app_user_session.drop_index([('expiresAt', pymongo.ASCENDING)])
+    db.app_user_session.drop_index([('user_id', pymongo.ASCENDING),
+                                    ('lastSeen', pymongo.ASCENDING)])
+    db.app_user_session.update_many({}, {'$unset': {'lastSeen': '', 'expiresAt': ''}})
@@ -0,0 +1,22 @@
+import pymongo
+from pymongo.database import Database
+
+UNLABELLED_INDEX = [('unlabelled', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+
+
+def _session_collections(db: Database):
+    for session in db.dl_session.find({}, {'_id': 1}):
+        yield db['dl_session_%s' % session['_id']]
+
+
+def upgrade(db: Database):
+    for collection in _session_collections(db):
+        collection.update_many({'labels': None}, {'$set': {'unlabelled': True}})
+        collection.update_many({'labels': {'$ne': None}}, {'$set': {'unlabelled': False}})
+        collection.create_index(UNLABELLED_INDEX, partialFilterExpression={'unlabelled': True})
+
+
+def downgrade(db: Database):
+    for collection in _session_collections(db):
+        collection.drop_index(UNLABELLED_INDEX)
+        collection.update_many({}, {'$unset': {'unlabelled': ''}})
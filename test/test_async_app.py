@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+from bson import ObjectId
+from mongomoron import delete, insert_many, insert_one
+
+from app import app
+from async_app import async_app, aconn
+from db import conn, ds, ds_list
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+async def execute(builder):
+    """
+    Execute by the sync connection, what the async one does by Motor
+    """
+    result = conn.execute(builder)
+    if isinstance(result, (pymongo.cursor.Cursor, pymongo.command_cursor.CommandCursor,
+                           mongomock.command_cursor.CommandCursor, mongomock.collection.Cursor)):
+        return list(result)
+    return result
+
+
+def get(path: str, query_string: str = ''):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(async_app({
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': query_string.encode(),
+        'headers': [],
+    }, receive, send))
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+
+@Patch
+@mock.patch.object(aconn, 'execute', execute)
+def test_async_app():
+    ds_id = ObjectId()
+    conn.execute(delete(ds_list))
+    conn.execute(insert_one(ds_list, {
+        '_id': ds_id,
+        'name': '1111.csv',
+        'status': 'active',
+        'extra': {'access': {'type': 'public'}},
+        'cols': ['Comment'],
+    }))
+    conn.execute(insert_many(ds[str(ds_id)], [
+        {'_id': 1, 'Comment': 'a'},
+        {'_id': 2, 'Comment': 'b'},
+    ]))
+    client = app.test_client()
+
+    # the same responses as of the Flask app
+    for path, query_string in [
+        ('/ls', ''),
+        (f'/ds/{ds_id}', ''),
+        (f'/ds/{ds_id}/filter', 'query=' + json.dumps([
+            {'col': 'Comment', 'predicate': {'op': 'eq', 'value': 'b'}}])),
+        ('/user/whoami', ''),
+    ]:
+        response = client.get(path, query_string=query_string)
+        assert (response.status_code, response.get_json()) == get(path, query_string)
+
+    # missing argument
+    assert (400, {'error': 'Bad Request'}) == get(f'/ds/{ds_id}/filter')
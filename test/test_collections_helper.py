@@ -1,4 +1,4 @@
-from collections_helper import objectset
+from collections_helper import objectset, canonical
 
 
 def test_objectset():
@@ -13,3 +13,27 @@ def test_objectset():
     assert {1: 'c'} in clist
     assert {1: 'd'} in clist
     assert {2: 'a'} in clist
+
+
+def test_canonical():
+    assert canonical({'city_id': '1', 'country_id': 'RU'}) == canonical({'country_id': 'RU', 'city_id': '1'})
+    assert canonical([{'a': [1, 2]}]) == canonical([{'a': [1, 2]}])
+    assert canonical([{'a': [1, 2]}]) != canonical([{'a': [2, 1]}])
+    assert canonical(True) != canonical(1)
+    assert canonical([1]) != canonical((1,))
+
+
+def test_objectset_order_of_keys():
+    a = objectset([{'a': 1, 'b': 2}, {'b': 2, 'a': 1}])
+    assert 1 == len(a)
+    assert {'b': 2, 'a': 1} in a
+
+    a = objectset([{'city_id': '1', 'country_id': 'RU'}, 'city'])
+    b = objectset(['city', {'country_id': 'RU', 'city_id': '1'}])
+
+    assert a == b
+    assert a <= b
+    assert 2 == len(a | b)
+    assert 2 == len(a & b)
+    assert 0 == len(a - b)
+    assert ['city'] == list(a - objectset([{'city_id': '1', 'country_id': 'RU'}]))
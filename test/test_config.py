@@ -0,0 +1,42 @@
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+from mongomoron import update_one, delete
+
+from app import app
+from config import Config
+from db import conn, app_config
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+@Patch
+def test_config():
+    conn.execute(delete(app_config))
+    config = Config()
+
+    assert 'a' == config.get_or_set('a', 'a')
+    assert 'a' == config.get_or_set('a', 'b')
+
+    # read from the snapshot
+    with mock.patch.object(conn, 'execute') as execute:
+        assert 'a' == config['a']
+        assert config['b'] is None
+        execute.assert_not_called()
+
+    # changed by someone else, seen when the snapshot is re-read
+    conn.execute(update_one(app_config).filter(app_config._id == 'a').set({'value': 'c'}))
+    assert 'a' == config['a']
+    config.poll_interval = 0
+    assert 'c' == config['a']
+
+    config._apply_change({'operationType': 'delete', 'documentKey': {'_id': 'a'}})
+    config.poll_interval = 10
+    assert config['a'] is None
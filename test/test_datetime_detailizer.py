@@ -0,0 +1,62 @@
+import datetime
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+
+from app import app
+from db import conn
+from detailization import DatetimeDetailizer, SequenceDetailizer
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+def tag_iso_date(self, value):
+    """
+    Tag the value as if it's yyyy-mm-dd, the model isn't needed
+    """
+    sequence = []
+    date_labels = ['year', 'month', 'day']
+    for token in self.split(value):
+        if token.isdigit() and date_labels:
+            label = date_labels.pop(0)
+        elif token == '-':
+            label = 'separator'
+        else:
+            label = 'word'
+        sequence.append({'token': token, 'label': label})
+    return {'sequence': sequence}
+
+
+@Patch
+@mock.patch.object(SequenceDetailizer, 'get_details', tag_iso_date)
+def test_get_details_many():
+    detailizer = DatetimeDetailizer.get()
+
+    def details(*args):
+        return {'datetime': {'timestamp': datetime.datetime(*args).timestamp()}}
+
+    assert [details(2020, 1, 2), details(2021, 12, 31), details(2020, 1, 2),
+            None, None, None] == \
+           detailizer.get_details_many(['2020-01-02', '2021-12-31', ' 2020-01-02 ',
+                                        '2020-13-01', 'yesterday', None])
+
+
+@Patch
+@mock.patch.object(SequenceDetailizer, 'get_details', tag_iso_date)
+def test_infer_formats_deterministic():
+    detailizer = DatetimeDetailizer.get()
+    # a mix of formats where a random sample may or may not
+    # let the minor one pass `min_format_share`
+    values = ['%d-%02d-%02d' % (2000 + i, i % 12 + 1, i % 28 + 1) for i in range(80)] + \
+             ['%d-%02d' % (2000 + i, i % 12 + 1) for i in range(20)]
+
+    formats = detailizer._infer_formats(values)
+    for _ in range(10):
+        assert formats == detailizer._infer_formats(values)
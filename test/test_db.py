@@ -0,0 +1,65 @@
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+import pytest
+from mongomoron import insert_many, aggregate, query_one, delete
+
+from app import app
+from db import SadistDatabaseConnection, ds_list, analytics, parse_max_staleness
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+
+
+def test_reset_after_fork():
+    conn = SadistDatabaseConnection()
+    client = conn.mongo_client()
+    assert {'open': 0, 'checkedOut': 0, 'checkouts': 0, 'checkoutFailures': 0,
+            'poolClears': 0} == conn.pool_stats()['connections']
+
+    # as if the client was inherited from the parent process
+    conn.mongo_client_pool[os.getpid() + 1] = conn.mongo_client_pool.pop(os.getpid())
+    conn.pool_stats_pool[os.getpid() + 1] = conn.pool_stats_pool.pop(os.getpid())
+    conn._reset()
+
+    assert {} == conn.mongo_client_pool
+    assert {} == conn.pool_stats_pool
+    assert conn.pool_stats()['connections'] is None
+    assert client is not conn.mongo_client()
+    client.close()
+    conn.close()
+    assert {} == conn.mongo_client_pool
+
+
+def test_analytics():
+    conn = SadistDatabaseConnection()
+    with mock.patch.object(conn, 'mongo_client', lambda: test_client):
+        conn.execute(insert_many(ds_list, [{'_id': 1, 'v': 'a'}, {'_id': 2, 'v': 'b'}]))
+
+        assert conn.ANALYTICS_READ_PREFERENCE == conn.analytics_db().read_preference
+        assert [{'_id': 2}] == list(conn.execute(analytics(
+            aggregate(ds_list).match(ds_list.v == 'b').project(ds_list._id))))
+        assert {'_id': 1, 'v': 'a'} == conn.execute(analytics(query_one(ds_list).filter(ds_list._id == 1)))
+        with pytest.raises(TypeError):
+            analytics(delete(ds_list))
+
+        conn.execute(delete(ds_list))
+
+
+def test_parse_max_staleness():
+    env_var = 'TEST_MAX_STALENESS'
+    with mock.patch.dict(os.environ, {}, clear=False):
+        os.environ.pop(env_var, None)
+        assert 90 == parse_max_staleness(env_var, 90)
+        for value, max_staleness in [('0', 0), ('-1', -1), ('90', 90), ('600', 600)]:
+            os.environ[env_var] = value
+            assert max_staleness == parse_max_staleness(env_var, 90)
+        for value in ['30', '-5', 'soon']:
+            os.environ[env_var] = value
+            with pytest.raises(ValueError, match=env_var):
+                parse_max_staleness(env_var, 90)
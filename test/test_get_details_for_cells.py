@@ -0,0 +1,69 @@
+import importlib
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+from mongomoron import insert_many, insert_one, query, query_one, delete
+
+from app import app
+from db import conn, ds, ds_classification, ds_list, cl_stat
+from detailization import get_details_for_cells
+
+# the module, shadowed by the function of the same name in the package
+get_details_for_cells_module = importlib.import_module('detailization.get_details_for_cells')
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+class LengthDetailizer(object):
+    """
+    Details of even numbers by the fast path,
+    of the rest by the slow one
+    """
+    labels = ['number']
+
+    def get_details_many(self, values):
+        return [{'length': len(value)} if int(value) % 2 == 0 else None for value in values]
+
+    def get_details(self, value):
+        return {'length': len(value), 'slow': True} if value != '1' else {}
+
+
+@Patch
+def test_get_details_for_cells():
+    conn.execute(delete(cl_stat))
+    ds_id = conn.execute(insert_one(ds_list, {'name': 'test'})).inserted_id
+    conn.execute(insert_many(ds[ds_id], [{'_id': i, 'n': str(i)} for i in range(25)]))
+    conn.execute(insert_many(ds_classification[ds_id], [{'row': i, 'col': 'n', 'label': 'number'}
+                                                        for i in range(25)]))
+
+    # writes are flushed by chunks and at the end
+    with mock.patch.object(get_details_for_cells_module, 'CHUNK_SIZE', 4):
+        get_details_for_cells(ds_id, 'n', LengthDetailizer())
+
+    details = dict((cell['row'], cell.get('details')) for cell in
+                   conn.execute(query(ds_classification[ds_id])))
+    assert {'length': 2} == details[10]
+    assert {'length': 2, 'slow': True} == details[11]
+    assert details[1] is None
+    assert 24 == sum(1 for d in details.values() if d)
+
+    record = conn.execute(query_one(ds_list).filter(ds_list._id == ds_id))
+    assert {'fast': 13, 'slow': 12} == record['detailization']['n']['paths']
+    assert 'finished' == record['detailization']['n']['status']
+    # of the slow path only
+    assert 12 == record['detailization']['n']['progress']['total']
+    assert 12 == record['detailization']['n']['progress']['done']
+    stat = conn.execute(query_one(cl_stat).filter(cl_stat.stage == 'detailization:LengthDetailizer'))
+    assert 12 == stat['count']
+    assert 0 < stat['workerSeconds']
+
+    conn.drop_collection(ds[ds_id])
+    conn.drop_collection(ds_classification[ds_id])
+    conn.execute(delete(cl_stat))
@@ -0,0 +1,213 @@
+import gzip
+import json
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+from bson import ObjectId
+from mongomoron import insert_many, delete, insert_one, query_one, query, update_one
+
+from app import app
+from db import conn, ds, ds_classification, geo_country, geo_city, dl_session, dl_session_list, dl_geo
+from app.labelling import ClassLabellingInterface, GeoLabellingInterface
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+@Patch
+def test_sample_values():
+    ds_id = str(ObjectId())
+    conn.execute(insert_many(ds[ds_id], [{'_id': i, 'city': 'City %d ' % (i % 50), 'n': ''}
+                                         for i in range(1000)]))
+    interface = ClassLabellingInterface()
+
+    values = interface._sample_values(ds_id, 'city', [], 10)
+    assert 10 == len(values) == len(set(values))
+    assert all(value.startswith('City ') and value == value.strip() for value in values)
+
+    # the sample covers the whole DS, so all distinct values are there
+    values = interface._sample_values(ds_id, None, [], 500)
+    assert {'City %d' % i for i in range(50)} == set(values)
+
+    conn.drop_collection(ds[ds_id])
+
+
+@Patch
+def test_sample_values_sparse():
+    ds_id = str(ObjectId())
+    # low-cardinality column, a sample of 2 * limit documents
+    # has fewer distinct values than limit
+    conn.execute(insert_many(ds[ds_id], [{'_id': i, 'kind': 'Kind %d' % (i % 3)}
+                                         for i in range(1000)]))
+    # a label which is rare across the sequences
+    conn.execute(insert_many(ds_classification[ds_id], [
+        {'row': i, 'col': 'addr', 'details': {'sequence': [
+            {'token': 'Street', 'label': 'street'},
+            *([{'token': 'Zip %d' % i, 'label': 'zip'}] if i % 100 == 0 else [])]}}
+        for i in range(1000)]))
+    interface = ClassLabellingInterface()
+
+    values = interface._sample_values(ds_id, 'kind', [], 10)
+    assert {'Kind %d' % i for i in range(3)} == set(values)
+
+    values = interface._sample_values(ds_id, 'addr', ['zip'], 5)
+    assert 5 == len(set(values))
+    assert all(value.startswith('Zip ') for value in values)
+
+    conn.drop_collection(ds[ds_id])
+    conn.drop_collection(ds_classification[ds_id])
+
+
+@Patch
+def test_label_catalog():
+    conn.execute(delete(geo_country))
+    conn.execute(delete(geo_city))
+    conn.execute(insert_many(geo_country, [{'_id': 'FR', 'name': 'France'},
+                                           {'_id': 'RU', 'name': 'Russia'}]))
+    conn.execute(insert_many(geo_city, [{'_id': '1', 'name': 'Moscow', 'country_code': 'RU'},
+                                        {'_id': '2', 'name': 'Paris', 'country_code': 'FR'},
+                                        {'_id': '3', 'name': 'Paris', 'country_code': 'RU'}]))
+    app.view_functions['GeoLabellingInterface.label_catalog'].__self__._label_catalog.invalidate()
+    client = app.test_client()
+
+    response = client.get('/dlgeo/labels')
+    assert 200 == response.status_code
+    assert {'value': '2,FR', 'text': 'Paris, France'} in response.json
+    assert 6 == len(response.json)
+    assert 'no-cache' == response.headers['Cache-Control']
+    etag, weak = response.get_etag()
+    assert weak
+
+    assert 304 == client.get('/dlgeo/labels', headers={'If-None-Match': f'W/"{etag}"'}).status_code
+
+    response = client.get(f'/dlgeo/labels?v={etag}', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert 'gzip' == response.headers['Content-Encoding']
+    assert 6 == len(json.loads(gzip.decompress(response.data)))
+    assert response.cache_control.immutable
+
+    # the page gets the URL of the labels instead of the labels
+    page = client.get('/dlgeo/session?session_id=%s' % ObjectId()).get_data(as_text=True)
+    assert '"labelsUrl": "/dlgeo/labels?v=%s"' % etag in page
+    assert '"labelsSearchUrl": "/dlgeo/labels/search"' in page
+    assert 'Paris, France' not in page
+
+    response = client.get('/dlgeo/labels/search?prefix=PAR&limit=10')
+    assert [{'value': '2,FR', 'text': 'Paris, France'},
+            {'value': '3,RU', 'text': 'Paris, Russia'}] == response.json['list']
+    assert ['Russia'] == [label['text'] for label in
+                          client.get('/dlgeo/labels/search?prefix=russ').json['list']]
+    assert 400 == client.get('/dlgeo/labels/search?prefix=par&limit=abc').status_code
+    assert 1 == len(client.get('/dlgeo/labels/search?prefix=par&limit=0').json['list'])
+    assert 1 == len(client.get('/dlgeo/labels/search?prefix=par&limit=-5').json['list'])
+
+    conn.execute(delete(geo_country))
+    conn.execute(delete(geo_city))
+
+
+@Patch
+def test_next_samples():
+    session_id = conn.execute(insert_one(dl_session_list, {'status': 'open', 'type': 'class'})).inserted_id
+    conn.execute(insert_many(dl_session[session_id], [{'text': text, 'unlabelled': True}
+                                                      for text in ['c', 'a', 'b']]))
+    client = app.test_client()
+
+    assert ['c', 'a'] == [sample['text'] for sample in
+                          client.get(f'/dl/session/{session_id}/next?count=2').json['list']]
+    assert 1 == len(client.get(f'/dl/session/{session_id}/next?count=0').json['list'])
+    assert 1 == len(client.get(f'/dl/session/{session_id}/next?count=-5').json['list'])
+    response = client.get(f'/dl/session/{session_id}/next?count=x')
+    assert 400 == response.status_code
+    assert 'Bad Request' == response.json['error']
+    assert 'a' == client.post(f'/dl/session/{session_id}',
+                              data={'text': 'c', 'label': 'city'}).json['text']
+    assert ['a', 'b'] == [sample['text'] for sample in
+                          client.get(f'/dl/session/{session_id}/next?count=5').json['list']]
+    client.post(f'/dl/session/{session_id}', data={'text': 'a', 'label': 'city'})
+    assert {'status': 'finished', 'success': True} == \
+           client.post(f'/dl/session/{session_id}', data={'text': 'b', 'label': 'number'}).json
+    assert {'list': [], 'status': 'finished', 'success': True} == \
+           client.get(f'/dl/session/{session_id}/next').json
+    assert [['city'], ['city'], ['number']] == [
+        conn.execute(query_one(dl_session[session_id]).filter(dl_session[session_id].text == text))['labels']
+        for text in ['c', 'a', 'b']]
+
+    conn.drop_collection(dl_session[session_id])
+    conn.execute(delete(dl_session_list))
+
+
+@Patch
+def test_merge():
+    conn.execute(delete(dl_geo))
+    conn.execute(delete(geo_country))
+    conn.execute(delete(geo_city))
+    conn.execute(insert_many(geo_country, [{'_id': 'FR', 'name': 'France'},
+                                           {'_id': 'US', 'name': 'United States'}]))
+    conn.execute(insert_many(geo_city, [{'_id': '2', 'name': 'Paris', 'country_code': 'FR'},
+                                        {'_id': '3', 'name': 'Paris', 'country_code': 'US'}]))
+    conn.execute(insert_many(dl_geo, [
+        {'text': 'Moscow', 'labels': [{'city_id': '1', 'country_id': 'RU'}]},
+        {'text': 'Paris', 'labels': [{'city_id': '2', 'country_id': 'FR'}]},
+        {'text': 'Rome', 'labels': [{'city_id': '4', 'country_id': 'IT'}]},
+    ]))
+    session_id = conn.execute(insert_one(dl_session_list, {'status': 'open', 'type': 'geo'})).inserted_id
+    conn.execute(insert_many(dl_session[session_id], [
+        # the same labels, keys in other order
+        {'text': 'Moscow', 'labels': [{'country_id': 'RU', 'city_id': '1'}], 'unlabelled': False},
+        {'text': 'Paris', 'labels': [{'city_id': '3', 'country_id': 'US'}], 'unlabelled': False},
+        {'text': 'Rome', 'labels': [{'country_id': 'IT'}], 'unlabelled': False, 'override': True},
+        {'text': 'Berlin', 'labels': [{'country_id': 'DE'}], 'unlabelled': False},
+        {'text': 'Oslo', 'unlabelled': True},
+    ]))
+    interface = GeoLabellingInterface()
+
+    result = interface._merge(str(session_id))
+    assert 'merging' == result['status']
+    assert ['Paris'] == [conflict['text'] for conflict in result['conflicts']]
+    assert [{'label': {'value': '2,FR', 'text': 'Paris, France'}, 'source': 'master'},
+            {'label': {'value': '3,US', 'text': 'Paris, United States'}, 'source': 'session'}] == \
+           result['conflicts'][0]['diff']
+
+    conn.execute(update_one(dl_session[session_id]).filter(dl_session[session_id].text == 'Paris')
+                 .set({'override': True}))
+    assert 'merged' == interface._merge(str(session_id))['status']
+    assert {
+               'Moscow': [{'city_id': '1', 'country_id': 'RU'}],
+               'Paris': [{'city_id': '3', 'country_id': 'US'}],
+               'Rome': [{'country_id': 'IT'}],
+               'Berlin': [{'country_id': 'DE'}],
+           } == dict((sample['text'], sample['labels']) for sample in conn.execute(query(dl_geo)))
+
+    conn.drop_collection(dl_session[session_id])
+    conn.execute(delete(dl_session_list))
+    conn.execute(delete(dl_geo))
+    conn.execute(delete(geo_country))
+    conn.execute(delete(geo_city))
+
+
+@Patch
+def test_btof_many():
+    conn.execute(delete(geo_country))
+    conn.execute(delete(geo_city))
+    conn.execute(insert_many(geo_country, [{'_id': 'FR', 'name': 'France'},
+                                           {'_id': 'US', 'name': 'United States'}]))
+    conn.execute(insert_many(geo_city, [{'_id': '2', 'name': 'Paris', 'country_code': 'FR'},
+                                        {'_id': '3', 'name': 'Paris', 'country_code': 'US'}]))
+    labels = [{'city_id': '2', 'country_id': 'FR'}, {'country_id': 'US'},
+              {'city_id': '3', 'country_id': 'US'}, {}] * 100
+
+    with mock.patch.object(conn, 'execute', wraps=conn.execute) as execute:
+        result = GeoLabellingInterface()._btof_many(labels)
+    assert 2 == execute.call_count
+    assert [{'value': '2,FR', 'text': 'Paris, France'},
+            {'value': 'null,US', 'text': '-, United States'},
+            {'value': '3,US', 'text': 'Paris, United States'},
+            {'value': 'null,null', 'text': '-, -'}] * 100 == result
+
+    conn.execute(delete(geo_country))
+    conn.execute(delete(geo_city))
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from app import app
+import metrics
+from db import command_metrics
+
+
+def test_histogram():
+    histogram = metrics.Histogram('test_duration_seconds', 'Test', ('endpoint',), buckets=(.1, 1.))
+    histogram.observe(.05, 'a')
+    histogram.observe(.5, 'a')
+    histogram.observe(5, 'a')
+
+    assert 3 == histogram.count('a')
+    assert 0 == histogram.count('b')
+    assert histogram.render() == '\n'.join([
+        '# HELP test_duration_seconds Test',
+        '# TYPE test_duration_seconds histogram',
+        'test_duration_seconds_bucket{endpoint="a",le="0.1"} 1',
+        'test_duration_seconds_bucket{endpoint="a",le="1"} 2',
+        'test_duration_seconds_bucket{endpoint="a",le="+Inf"} 3',
+        'test_duration_seconds_sum{endpoint="a"} 5.55',
+        'test_duration_seconds_count{endpoint="a"} 3',
+    ])
+
+
+def test_collection_family():
+    assert 'ds_*' == metrics.collection_family('ds_5f9b3c2e1a2b3c4d5e6f7a8b')
+    assert 'ds_*_classification' == metrics.collection_family('ds_5f9b3c2e1a2b3c4d5e6f7a8b_classification')
+    assert 'dl_master' == metrics.collection_family('dl_master')
+
+
+def test_command_metrics():
+    def event(request_id, command_name, command, duration_micros=None):
+        return SimpleNamespace(connection_id=('localhost', 27017), request_id=request_id,
+                               command_name=command_name, command=command,
+                               duration_micros=duration_micros)
+
+    count = metrics.mongo_command_duration.count('dl_session_*', 'find')
+    command_metrics.started(event(1, 'find', {'find': 'dl_session_5f9b3c2e1a2b3c4d5e6f7a8b'}))
+    command_metrics.started(event(2, 'ping', {'ping': 1}))
+    command_metrics.succeeded(event(1, 'find', {}, 1500))
+    command_metrics.succeeded(event(2, 'ping', {}, 100))
+
+    assert count + 1 == metrics.mongo_command_duration.count('dl_session_*', 'find')
+    assert 0 == metrics.mongo_command_duration.count('none', 'ping')
+    assert not command_metrics._started
+
+
+def test_metrics_endpoint():
+    client = app.test_client()
+    count = metrics.http_request_duration.count('monitoring.prometheus_metrics', 'GET')
+
+    response = client.get('/metrics')
+    assert 200 == response.status_code
+    assert response.mimetype == 'text/plain'
+    assert count + 1 == metrics.http_request_duration.count('monitoring.prometheus_metrics', 'GET')
+    assert 1 <= metrics.http_requests.get('monitoring.prometheus_metrics', '200')
+    assert 0 == metrics.http_requests_in_progress.get()
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_requests_total{endpoint="monitoring.prometheus_metrics",status="200"}' in text
+    assert 'mongo_pool_connections{state="max"}' in text
+
+
+def test_failed_request():
+    def fail():
+        raise Exception('Failed')
+
+    client = app.test_client()
+    count = metrics.http_requests.get('monitoring.prometheus_metrics', '500')
+    with mock.patch.dict(app.view_functions, {'monitoring.prometheus_metrics': fail}):
+        assert 500 == client.get('/metrics').status_code
+    assert count + 1 == metrics.http_requests.get('monitoring.prometheus_metrics', '500')
+    assert 0 == metrics.http_requests_in_progress.get()
+
+    # the response fails to build, so `after_request` isn't called
+    with mock.patch.object(app, 'make_response', side_effect=RuntimeError('Broken response')):
+        with pytest.raises(RuntimeError):
+            client.get('/metrics')
+    assert count + 2 == metrics.http_requests.get('monitoring.prometheus_metrics', '500')
+    assert 0 == metrics.http_requests_in_progress.get()
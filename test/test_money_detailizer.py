@@ -0,0 +1,51 @@
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+from mongomoron import delete, insert_many
+
+from app import app
+from db import conn, currency_list, dl_currency
+from detailization import MoneyDetailizer
+from detailization.bow_detailizer import BowDetailizer
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+@Patch
+def test_resolve_currency():
+    conn.execute(delete(currency_list))
+    conn.execute(delete(dl_currency))
+    conn.execute(insert_many(currency_list, [
+        {'_id': 'USD', 'name': 'US Dollar'},
+        {'_id': 'AUD', 'name': 'Australian Dollar'},
+        {'_id': 'RUB', 'name': 'Russian Ruble'},
+    ]))
+    conn.execute(insert_many(dl_currency, [
+        {'text': '$', 'labels': ['USD']},
+        {'text': '$', 'labels': ['USD']},
+        {'text': '$', 'labels': ['AUD']},
+        {'text': 'руб.', 'labels': ['RUB']},
+        {'text': 'dollar', 'labels': ['USD']},
+        {'text': 'dollar', 'labels': ['AUD']},
+    ]))
+
+    with mock.patch.object(BowDetailizer, 'get_details', return_value='AUD') as model:
+        detailizer = MoneyDetailizer()
+
+        assert 'USD' == detailizer._resolve_currency('$')
+        assert 'RUB' == detailizer._resolve_currency('Руб.')
+        assert 'USD' == detailizer._resolve_currency('us  dollar')
+        assert 'RUB' == detailizer._resolve_currency('rub')
+        model.assert_not_called()
+
+        # a tie, it's up to the model, once
+        assert 'AUD' == detailizer._resolve_currency('dollar')
+        assert 'AUD' == detailizer._resolve_currency('Dollar')
+        model.assert_called_once_with('dollar')
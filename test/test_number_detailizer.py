@@ -0,0 +1,13 @@
+from app import app
+from detailization import NumberDetailizer
+
+
+def test_get_details_many():
+    detailizer = NumberDetailizer.get()
+
+    assert [{'number': 1234.5}, {'number': -12}, {'number': 1234567},
+            {'number': 1234.5}, {'number': 12500.}, {'number': 3000000},
+            {'number': .5}, None, None, None, None] == \
+           detailizer.get_details_many(['1234.5', '-12', ' 1,234,567 ',
+                                        '1,234.5', '12.5k', '3M',
+                                        '.5', '1,234', '5.', 'twelve', None])
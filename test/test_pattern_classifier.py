@@ -0,0 +1,149 @@
+import os
+import random
+import string
+from unittest import mock
+
+import mongomock
+import pymongo
+from bson import ObjectId
+from mongomoron import query_one, query
+
+from app import app
+from classification import PatternClassifier
+from classification.pattern_classifier import Cache, Char, Pattern
+from db import conn, cl_pattern
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+samples = [
+    ('Moscow', 'city'),
+    ('Paris', 'city'),
+    ('London', 'city'),
+    ('New York', 'city'),
+    ('123', 'number'),
+    ('4567', 'number'),
+    ('12.5', 'number'),
+]
+
+
+@Patch
+def test_learn_incremental():
+    classifier = PatternClassifier.get()
+    classifier.learn(samples)
+    Cache.clear()
+
+    # unknown characters can't be matched before incremental learning
+    assert classifier.classify('Berlin') is None
+    assert classifier.classify('999') is None
+    Cache.clear()
+
+    classifier.learn([('Berlin', 'city'), ('999', 'number'),
+                      ('Zürich', 'city'), ('Moscow', 'city')], incremental=True)
+
+    assert 'city' == classifier.classify('Berlin')
+    assert 'city' == classifier.classify('Zürich')
+    assert 'number' == classifier.classify('999')
+
+    # count of the existing pattern is merged, not duplicated
+    moscow = conn.execute(query_one(cl_pattern).filter(
+        cl_pattern.level == 0).filter(
+        cl_pattern.pattern == [[c, 1] for c in 'Moscow']))
+    assert 2 == moscow['countTotal']
+    assert {'city': 2} == moscow['countByLabel']
+
+
+def classify_reference(s: str):
+    """
+    The previous `PatternClassifier.classify`, which builds patterns
+    of each level of `Pattern` and `Char` objects from `Cache`
+    """
+    level = 0
+    s_pattern = Pattern(level=0, sequence=s)
+
+    while True:
+        sample_count = Cache.get_patterns_by_level(level).get(s_pattern)
+        if sample_count:
+            for label, count in sample_count.count_by_label.items():
+                if count / sample_count.count_total > .5:
+                    return label
+
+        level += 1
+        if not Cache.get_chars_by_level(level):
+            break
+        sequence = list()
+        for pattern_element in s_pattern.pattern:
+            char = Cache.get_char_by_pattern_element(pattern_element)
+            if not char:
+                return None
+            sequence.append(char)
+        s_pattern = Pattern(level=level, sequence=sequence)
+
+    return None
+
+
+@Patch
+def test_pattern_index():
+    rnd = random.Random(0)
+
+    def word():
+        return ''.join(rnd.choice(string.ascii_lowercase)
+                       for _ in range(rnd.randint(3, 10))).capitalize()
+
+    def number():
+        return rnd.choice(['{}', '{:,}', '-{}', '{}k']).format(rnd.randint(0, 100000))
+
+    generators = [(word, 'city'), (lambda: '%s, %s' % (word(), word()[:2].upper()), 'city'),
+                  (number, 'number'), (lambda: '%02d/%02d/%d' % (rnd.randint(1, 28), rnd.randint(1, 12),
+                                                                 rnd.randint(1950, 2030)), 'timestamp')]
+
+    def cells(size: int):
+        return [(generator(), label) for generator, label in
+                (rnd.choice(generators) for _ in range(size))]
+
+    learnt = cells(300)
+    classifier = PatternClassifier.get()
+    classifier.learn(learnt)
+    Cache.clear()
+    assert 2 < max(record['level'] for record in conn.execute(query(cl_pattern)))
+
+    # learnt texts, new ones of the same kinds, and unknown characters
+    texts = [text for text, _ in learnt + cells(300)] + ['Zürich', '???', '']
+    labels = [classifier.classify(text) for text in texts]
+    assert labels == [classify_reference(text) for text in texts]
+    # new texts are matched by higher levels, unknown ones are not
+    assert {None, 'city', 'number', 'timestamp'} == set(labels)
+
+
+def test_make_clusters():
+    a, b, c, d = ('a', 1), ('b', 1), ('c', 1), ('d', 1)
+    likelihood = {(a, b): 1., (b, a): .5, (b, c): .5, (c, d): 1., (d, c): 1.}
+
+    clusters = PatternClassifier._make_clusters([a, b, c, d], likelihood)
+
+    assert [{a, b}, {c, d}] == clusters
+
+
+def test_char_eq_hash():
+    cluster = {('a', 0), ('b', 0)}
+    saved, other_saved, not_saved = Char(1, cluster), Char(1, cluster), Char(1, cluster)
+    saved._id = ObjectId()
+    other_saved._id = ObjectId()
+
+    # equal chars have equal hashes, so they are found in dicts and sets
+    for a, b in [(saved, other_saved), (saved, not_saved), (not_saved, Char(1, cluster))]:
+        assert (a == b) == (b == a)
+        if a == b:
+            assert hash(a) == hash(b)
+    assert not_saved == Char(1, cluster)
+    assert saved != not_saved
+
+    # a saved char is the same as its cluster is extended
+    extended = Char(1, cluster | {('c', 0)})
+    extended._id = saved._id
+    assert extended == saved
+    assert {saved: 1}[extended] == 1
@@ -0,0 +1,82 @@
+import datetime
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+from mongomoron import delete, insert_many, query
+
+import app  # noqa, before `async_processing`, which is imported by the app
+import progress as progress_module
+from async_processing import process_in_parallel
+from db import conn, cl_stat
+from progress import Progress, estimate_duration
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+def _double(task: int) -> int:
+    return task * 2
+
+
+@Patch
+def test_estimate_duration():
+    conn.execute(delete(cl_stat))
+    now = datetime.datetime.now()
+    conn.execute(insert_many(cl_stat, [
+        # legacy records, without statistics of processes
+        {'count': 100, 'started': now, 'finished': now},
+        {'stage': 'a', 'count': 100, 'processes': 2, 'workerSeconds': 10., 'started': now},
+        {'stage': 'a', 'count': 100, 'processes': 4, 'workerSeconds': 20., 'started': now},
+        {'stage': 'a', 'count': 100, 'processes': 4, 'workerSeconds': 1000., 'started': now},
+        {'stage': 'b', 'count': 100, 'processes': 4, 'workerSeconds': 1., 'started': now},
+    ]))
+
+    # median of .1, .2, 10 seconds per item
+    assert 5. == estimate_duration('a', 100, 4)
+    assert estimate_duration('c', 100, 4) is None
+
+    conn.execute(delete(cl_stat))
+
+
+@Patch
+def test_progress():
+    conn.execute(delete(cl_stat))
+    persisted = []
+
+    with mock.patch.object(progress_module, 'PERSIST_INTERVAL', 0):
+        progress = Progress('a', total=10, processes=2, persist=persisted.append)
+        assert progress.estimated is None
+        assert progress.eta is None
+
+        progress.update(done=4)
+        results = sorted(process_in_parallel(range(6), processor=_double, args=(),
+                                             progress=progress))
+
+    assert [0, 2, 4, 6, 8, 10] == results
+    assert 7 == len(persisted)
+    assert 4 == persisted[0]['done']
+    assert 10 == persisted[-1]['done']
+    assert 0 == persisted[-1]['queue']
+    assert 0. == persisted[-1]['eta']
+    assert all(0. <= utilization <= 1. for utilization in persisted[-1]['utilization'])
+    assert 0 < progress.rate
+
+    d = progress.finish()
+    assert 10 == d['done']
+    record, = conn.execute(query(cl_stat))
+    assert 'a' == record['stage']
+    assert 10 == record['count']
+    assert sum(progress.busy.values()) == record['workerSeconds']
+    assert estimate_duration('a', 10, 2) is not None
+
+    # nothing to do, nothing to learn
+    Progress('b', total=0, processes=2, persist=persisted.append).finish()
+    assert estimate_duration('b', 10, 2) is None
+
+    conn.execute(delete(cl_stat))
@@ -0,0 +1,46 @@
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+
+from app import app
+from db import conn
+from detailization import SequenceDetailizer
+from detailization.sequence_detailizer import CharType
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+@Patch
+def test_split():
+    detailizer = SequenceDetailizer()
+
+    assert [] == detailizer.split('')
+    assert ['12', '.', '5', 'k'] == detailizer.split('12.5k')
+    assert ['Zürich', ',', ' ', 'CH'] == detailizer.split('Zürich, CH')
+    assert ['$', '1', ',', '000', '  ', 'a_b', '-/', '²'] == \
+           detailizer.split('$1,000  a_b-/²')
+    assert [('2020', CharType.DIGIT), ('-', CharType.PUNCTUATION),
+            ('Jan', CharType.WORD), (' \t', CharType.WHITESPACE)] == \
+           detailizer.tokenize('2020-Jan \t')
+
+
+@Patch
+def test_get_features():
+    detailizer = SequenceDetailizer()
+
+    assert [] == detailizer._get_features([])
+    # windows are as the model was trained on, odd as they are
+    assert [['token=a', 'chartype=2', 'token_normal=a', 'token_len=1',
+             'token[1]=1', 'chartype[1]=1', 'token_normal[1]=1', 'token_len[1]=1',
+             'token[-1][1]=1', 'chartype[-1][1]=1', 'token_normal[-1][1]=1',
+             'token_len[-1][1]=1'],
+            ['token=1', 'chartype=1', 'token_normal=1', 'token_len=1',
+             'token[-1]=1', 'chartype[-1]=1', 'token_normal[-1]=1',
+             'token_len[-1]=1']] == detailizer._get_features(iter(['a', '1']))
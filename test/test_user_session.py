@@ -0,0 +1,103 @@
+import datetime
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+from bson import ObjectId
+from mongomoron import insert_one, insert_many, delete, query, query_one
+
+from app import app
+from db import conn, app_user, app_user_session
+from user_session import UserSession, SessionCache, session_cache, compact_sessions
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+@Patch
+def test_cached_session():
+    session_cache.clear()
+    user_id = conn.execute(insert_one(app_user, {'type': 'google'})).inserted_id
+    _id = conn.execute(insert_one(app_user_session, {'user_id': user_id})).inserted_id
+
+    # sessions of logged-in users are cached while logouts
+    # in other processes are watched
+    with mock.patch.object(session_cache, '_watching_pid', os.getpid()):
+        session = UserSession.load(_id)
+        assert user_id == session['user']['_id']
+        assert not session.modified
+        # just seen
+        session_record = conn.execute(query_one(app_user_session)
+                                      .filter(app_user_session._id == _id))
+        assert session_record['expiresAt'] > datetime.datetime.utcnow()
+
+        # known session doesn't go to the DB
+        with mock.patch.object(conn, 'execute') as execute:
+            session = UserSession.load(_id)
+            assert user_id == session['user']['_id']
+            execute.assert_not_called()
+
+        # logout
+        del session['user']
+        session.save()
+        conn.execute(delete(app_user_session))
+        assert 'user' not in UserSession.load(_id)
+
+
+def test_session_cache_of_other_process():
+    # caches of two worker processes
+    cache, other_cache = SessionCache(), SessionCache()
+    _id, anonymous_id = ObjectId(), ObjectId()
+    user = {'_id': ObjectId()}
+    now = datetime.datetime.utcnow()
+
+    # without the change stream, a login or logout in another process
+    # would be missed, so sessions aren't cached
+    for c in (cache, other_cache):
+        c.put(_id, user, now)
+        c.put(anonymous_id, None, now)
+    assert SessionCache.MISSING is other_cache.get(_id)
+    assert SessionCache.MISSING is other_cache.get(anonymous_id)
+
+    with mock.patch.object(other_cache, '_watching_pid', os.getpid()):
+        other_cache.put(_id, user, now)
+        other_cache.put(anonymous_id, None, now)
+        assert (user, now) == other_cache.get(_id)
+        assert (None, now) == other_cache.get(anonymous_id)
+        # logout and login in the process of `cache`,
+        # seen by the change stream of `other_cache`
+        for session_id, user_id in ((_id, None), (anonymous_id, user['_id'])):
+            other_cache._apply_change({'operationType': 'update', 'documentKey': {'_id': session_id},
+                                       'updateDescription': {'updatedFields': {'user_id': user_id}}})
+            assert SessionCache.MISSING is other_cache.get(session_id)
+
+        other_cache.put(_id, user, now)
+        # the change stream is down
+        other_cache._watching_pid = None
+        assert SessionCache.MISSING is other_cache.get(_id)
+
+
+@Patch
+def test_compact_sessions():
+    conn.execute(delete(app_user_session))
+    now = datetime.datetime.utcnow()
+    user_id = conn.execute(insert_one(app_user, {'type': 'google'})).inserted_id
+    conn.execute(insert_many(app_user_session, [
+        {'user_id': None, 'lastSeen': now, 'expiresAt': now},
+        {'user_id': None, 'lastSeen': now - datetime.timedelta(days=2),
+         'expiresAt': now},
+        {'user_id': user_id, 'lastSeen': now - datetime.timedelta(days=2),
+         'expiresAt': now},
+        {'user_id': None},
+        # not migrated yet, mustn't be logged out
+        {'user_id': user_id},
+    ]))
+
+    assert 2 == compact_sessions()
+    assert [None, user_id, user_id] == \
+           [r['user_id'] for r in conn.execute(query(app_user_session))]
@@ -0,0 +1,75 @@
+import gzip
+import os
+from unittest import mock
+
+import mongomock
+import pymongo
+import pytest
+from mongomoron import delete, insert_many, update_one, document
+
+from app import app
+from app.web_crawler import script_template_list, sanitizer
+from db import conn, wc_script_template
+
+test_database_url = 'mongodb://localhost:27017,127.0.0.1:27018/test_sadist_be?replicaSet=rs0'
+if os.getenv('USE_MONGOMOCK'):
+    test_client = mongomock.MongoClient(test_database_url)
+else:
+    test_client = pymongo.MongoClient(test_database_url)
+Patch = mock.patch.object(conn, 'mongo_client', lambda: test_client)
+
+
+@Patch
+def test_list_script_template():
+    conn.execute(delete(wc_script_template))
+    conn.execute(insert_many(wc_script_template, [{'_id': 'b', 'data': '{"name":"b"}', 'readonly': False},
+                                                  {'_id': 'a', 'data': '{"name":"a"}', 'readonly': True}]))
+    script_template_list.invalidate()
+    client = app.test_client()
+
+    response = client.get('/wc/template')
+    assert 200 == response.status_code
+    assert 'text/plain; charset=utf-8' == response.headers['Content-Type']
+    assert '[{"name":"a"},{"name":"b"}]' == response.get_data(as_text=True)
+    etag, weak = response.get_etag()
+    assert not weak
+
+    assert 304 == client.get('/wc/template', headers={'If-None-Match': f'"{etag}"'}).status_code
+
+    response = client.get('/wc/template', headers={'Accept-Encoding': 'gzip'})
+    gzip_etag, _ = response.get_etag()
+    assert etag != gzip_etag
+    assert b'[{"name":"a"},{"name":"b"}]' == gzip.decompress(response.data)
+
+    response = client.put('/wc/template', data='{"name":"c"}',
+                          headers={'Content-Type': 'application/x-script-template',
+                                   'X-Template-Name': 'c'})
+    assert response.json['success']
+
+    response = client.get('/wc/template', headers={'If-None-Match': f'"{etag}"'})
+    assert 200 == response.status_code
+    assert '[{"name":"a"},{"name":"b"},{"name":"c"}]' == response.get_data(as_text=True)
+
+    conn.execute(delete(wc_script_template))
+
+
+@Patch
+def test_sanitize_script_template():
+    conn.execute(delete(wc_script_template))
+    conn.execute(insert_many(wc_script_template, [
+        {'_id': 'a', 'data': '{"name":"a","getScript":function(page){return page.text;}}', 'readonly': True}]))
+
+    sanitizer.sanitize_script_template('{"name":"b","getScript":function(page) {\n  return page.text\n}}')
+    with pytest.raises(AssertionError):
+        sanitizer.sanitize_script_template('{"name":"b","getScript":function(page){return page.html;}}')
+    with pytest.raises(AssertionError):
+        sanitizer.sanitize_script_template('{"name":"b","run":function(page){return page.text;}}')
+    with pytest.raises(Exception, match='too large'):
+        sanitizer.sanitize_script_template('{"name":"%s"}' % ('b' * sanitizer.MAX_SCRIPT_TEMPLATE_SIZE))
+
+    # allowed functions follow changes of readonly templates
+    conn.execute(update_one(wc_script_template).filter(document._id == 'a').set(
+        {'data': '{"name":"a","getScript":function(page){return page.html;}}'}))
+    sanitizer.sanitize_script_template('{"name":"b","getScript":function(page){return page.html;}}')
+
+    conn.execute(delete(wc_script_template))